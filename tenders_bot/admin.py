@@ -1,12 +1,141 @@
+import re
+from threading import Thread
+
 from adminsortable2.admin import SortableAdminBase, SortableTabularInline
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ORDER_VAR, PAGE_VAR, ChangeList
+from django.contrib.postgres.search import SearchQuery
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Substr
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from django.utils.text import Truncator
+
+from tenders_bot import export
+from tenders_bot.models import Feedback, File, Node, OutboxEmail, UserUploadedFile
+from tenders_bot.settings import ID_FORMAT, TELEGRAM_STORAGE_CHAT_ID
+
+# Номер обращения в формате ID_FORMAT, например "GKE-123"
+ID_PATTERN = re.compile("^" + re.escape(ID_FORMAT).replace(re.escape("{id}"), r"(?P<id>\d+)") + "$", re.IGNORECASE)
+
+
+def parse_feedback_id(search_term):
+    match = ID_PATTERN.match(search_term)
+    if match is None:
+        return None
+    return int(match.group("id"))
+
+
+# Сколько символов длинных текстов показывать в списках
+LIST_TEXT_LENGTH = 100
+# С какого размера таблицы без фильтров вместо COUNT(*) брать оценку из статистики PostgreSQL
+ESTIMATED_COUNT_THRESHOLD = 10000
+# Параметр адреса для постраничного перехода по ключу: показать обращения, созданные раньше последнего
+# показанного ("<created_at>,<id>")
+CURSOR_VAR = "before"
+
+
+def format_cursor(obj) -> str:
+    return f"{obj.created_at.isoformat()},{obj.pk}"
+
+
+# Условие "строка идёт в списке после строки-курсора" для сортировки ("-created_at", "-id")
+def parse_cursor(cursor) -> Q:
+    created_at, _, pk = cursor.rpartition(",")
+    created_at = parse_datetime(created_at)
+    if created_at is None or not pk.isdigit():
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=int(pk))
+
+
+# Оценка числа строк таблицы по статистике PostgreSQL (None, если оценки нет)
+def estimated_row_count(model):
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+        row = cursor.fetchone()
+    return row[0] if row and row[0] >= 0 else None
+
+
+# Для больших таблиц без фильтров точный COUNT(*) не нужен, хватает оценки
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            estimate = estimated_row_count(self.object_list.model)
+            if estimate is not None and estimate > ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
 
-from tenders_bot.models import Feedback, File, Node, UserUploadedFile
-from tenders_bot.settings import ID_FORMAT
+# Список с переходом по страницам по ключу ((created_at, id) < последнего показанного) вместо OFFSET:
+# дальние страницы открываются так же быстро, как первая. При сортировке по другой колонке
+# работает обычная постраничная разбивка
+class KeysetChangeList(ChangeList):
+    keyset = False
+    next_page_url = None
+    first_page_url = None
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_queryset(self, request, *args, **kwargs):
+        # Полный текст и поисковый вектор в списке не нужны
+        return super().get_queryset(request, *args, **kwargs).defer("text", "search_vector")
+
+    def get_results(self, request):
+        if ORDER_VAR in self.params or self.show_all:
+            return super().get_results(request)
+
+        queryset = self.queryset
+        cursor = request.GET.get(CURSOR_VAR)
+        if cursor:
+            try:
+                queryset = queryset.filter(parse_cursor(cursor))
+            except ValueError:
+                raise IncorrectLookupParameters
+        rows = list(queryset[: self.list_per_page + 1])
+
+        self.keyset = True
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = self.paginator.count
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.result_list = rows[: self.list_per_page]
+        self.can_show_all = False
+        self.multi_page = len(rows) > self.list_per_page or bool(cursor)
+        if len(rows) > self.list_per_page:
+            self.next_page_url = self.get_query_string(
+                {CURSOR_VAR: format_cursor(self.result_list[-1])}, remove=[PAGE_VAR]
+            )
+        if cursor:
+            self.first_page_url = self.get_query_string(remove=[CURSOR_VAR, PAGE_VAR])
+
+
+class FileInlineForm(forms.ModelForm):
+    class Meta:
+        model = File
+        fields = ("file",)
+
+    def save(self, commit=True):
+        # Файл заменили - сохранённый в Telegram file_id больше не подходит
+        if "file" in self.changed_data:
+            self.instance.telegram_file_id = None
+        return super().save(commit)
 
 
 class FileInline(admin.StackedInline):
     model = File
+    form = FileInlineForm
     extra = 0
 
 
@@ -14,7 +143,7 @@ class UserUploadedFileInline(admin.StackedInline):
     model = UserUploadedFile
     extra = 0
     can_delete = False
-    readonly_fields = ("file",)
+    readonly_fields = ("name", "file")
 
     def has_add_permission(self, request, obj=None):
         return False
@@ -33,25 +162,57 @@ class NodeInline(SortableTabularInline):
 
 @admin.register(Node)
 class NodeAdmin(SortableAdminBase, admin.ModelAdmin):
-    list_display = ("path", "text", "nav_text", "number_of_files")
+    list_display = ("path", "short_text", "nav_text", "number_of_files")
     ordering = ("path",)
     exclude = ("button_order",)
     inlines = [FileInline, NodeInline]
 
+    def save_formset(self, request, form, formset, change):
+        super().save_formset(request, form, formset, change)
+        if formset.model is File and TELEGRAM_STORAGE_CHAT_ID:
+            file_pks = [f.instance.pk for f in formset.forms if "file" in f.changed_data and f.instance.pk]
+            if file_pks:
+                from tenders_bot.telegram import prewarm_files  # не создаём бота, пока он не нужен
+
+                transaction.on_commit(lambda: Thread(daemon=True, target=prewarm_files, args=(file_pks,)).start())
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(files_count=Count("files"))
+
+    @admin.display(description="Text")
+    def short_text(self, obj):
+        return Truncator(obj.text or "").chars(LIST_TEXT_LENGTH)
+
+    @admin.display(ordering="files_count")
     def number_of_files(self, obj):
-        return len(obj.files.all())
+        return obj.files_count
 
 
 @admin.register(Feedback)
 class FeedbackAdmin(admin.ModelAdmin):
-    list_display = ("formatted_id", "created_at", "type", "company", "email", "telegram_username", "text", "processed")
+    list_display = (
+        "formatted_id",
+        "created_at",
+        "type",
+        "company",
+        "email",
+        "telegram_username",
+        "short_text",
+        "number_of_files",
+        "processed",
+    )
+    # Те же поля, что в Feedback.SEARCH_VECTOR: в PostgreSQL поиск идёт по нему (см. get_search_results),
+    # в других СУБД - по этим полям напрямую
     search_fields = (
-        "id",
         "company",
+        "inn",
+        "name",
+        "email",
+        "contact_number",
         "telegram_username",
         "text",
     )
-    exclude = ("telegram_chat_id", "telegram_sent_message_id", "submitted", "next_field")
+    exclude = ("telegram_chat_id", "telegram_sent_message_id", "submitted", "next_field", "search_vector")
     readonly_fields = (
         "formatted_id",
         "type",
@@ -66,16 +227,102 @@ class FeedbackAdmin(admin.ModelAdmin):
         "telegram_first_name",
         "telegram_last_name",
     )
-    ordering = ("-created_at",)
+    ordering = ("-created_at", "-id")
     list_filter = ("type", "processed")
     inlines = [UserUploadedFileInline]
-    actions = ["mark_as_processed"]
+    actions = ["mark_as_processed", "export_csv", "export_xlsx"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_queryset(self, request):
+        uploaded_files = (
+            UserUploadedFile.objects.filter(feedback=OuterRef("pk"))
+            .order_by()
+            .values("feedback")
+            .annotate(count=Count("*"))
+            .values("count")
+        )
+        # Подзапрос считается только для строк текущей страницы, в отличие от JOIN + GROUP BY по всей таблице
+        return super().get_queryset(request).annotate(
+            uploaded_files_count=Coalesce(Subquery(uploaded_files, output_field=IntegerField()), Value(0)),
+            text_preview=Substr("text", 1, LIST_TEXT_LENGTH + 1),
+        )
 
     def formatted_id(self, obj):
         return ID_FORMAT.format(id=obj.id)
 
     formatted_id.short_description = "Номер обращения"
 
+    @admin.display(description="Запрос")
+    def short_text(self, obj):
+        return Truncator(obj.text_preview or "").chars(LIST_TEXT_LENGTH)
+
+    @admin.display(description="Файлов", ordering="uploaded_files_count")
+    def number_of_files(self, obj):
+        return obj.uploaded_files_count
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+
+        # Номер обращения ("GKE-123") ищем по первичному ключу
+        feedback_id = parse_feedback_id(search_term)
+        if feedback_id is not None:
+            return queryset.filter(pk=feedback_id), False
+
+        if connection.vendor == "postgresql":
+            query = SearchQuery(search_term, config="russian", search_type="websearch")
+            results, may_have_duplicates = queryset.filter(search_vector=query), False
+        else:
+            results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        # Просто число - это может быть ИНН, телефон или номер обращения без префикса
+        if search_term.isdigit():
+            results = results | queryset.filter(pk=int(search_term))
+        return results, may_have_duplicates
+
     @admin.action(description="Пометить обработанным")
     def mark_as_processed(self, request, queryset):
         queryset.update(processed=True)
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        if export.openpyxl is None:
+            actions.pop("export_xlsx", None)
+        return actions
+
+    @admin.action(description="Выгрузить в CSV")
+    def export_csv(self, request, queryset):
+        return export.csv_response(queryset, f"feedback_{timezone.localdate():%Y-%m-%d}.csv")
+
+    @admin.action(description="Выгрузить в Excel")
+    def export_xlsx(self, request, queryset):
+        return export.xlsx_response(queryset, f"feedback_{timezone.localdate():%Y-%m-%d}.xlsx")
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ("formatted_feedback_id", "status", "attempts", "created_at", "next_attempt_at", "sent_at")
+    list_filter = ("status",)
+    readonly_fields = (
+        "feedback", "status", "attempts", "created_at", "next_attempt_at", "sent_at", "last_error", "digest_sent_to"
+    )
+    ordering = ("-created_at",)
+    actions = ["retry"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def formatted_feedback_id(self, obj):
+        return ID_FORMAT.format(id=obj.feedback_id)
+
+    formatted_feedback_id.short_description = "Номер обращения"
+
+    @admin.action(description="Отправить повторно")
+    def retry(self, request, queryset):
+        queryset.exclude(status=OutboxEmail.Status.SENT).update(
+            status=OutboxEmail.Status.PENDING, attempts=0, next_attempt_at=timezone.now()
+        )
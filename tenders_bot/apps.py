@@ -4,6 +4,7 @@ import sys
 from threading import Thread
 
 from django.apps import AppConfig
+from django.conf import settings
 from django.db import DatabaseError
 
 logger = logging.getLogger(__name__)
@@ -18,6 +19,10 @@ class TendersConfig(AppConfig):
         super().__init__(app_name, app_module)
 
     def ready(self):
+        # Подключаем сигналы, по которым перестраивается снимок дерева узлов
+        # и удаляются с диска файлы удалённых вложений
+        from tenders_bot import node_tree, retention  # noqa: F401
+
         if os.path.basename(sys.argv[0]) == "manage.py" and sys.argv[1] == "runserver":
             start_app()
 
@@ -26,19 +31,30 @@ def start_app():
     logger.info("Starting tenders_bot app")
     try:
         setup_node_tree()
-        start_telegram_bot()
+        # В режиме webhook обновления принимает Django (tenders_bot.webhook), polling не нужен
+        if settings.TELEGRAM_BOT_MODE == "polling" and settings.TELEGRAM_BOT_IN_RUNSERVER:
+            start_telegram_bot()
+        if settings.OUTBOX_WORKER_IN_PROCESS:
+            start_outbox_worker()
     except DatabaseError:
-        logger.exception(f"Database error on startup")
+        logger.exception("Database error on startup")
         raise
     logger.info("Started tenders_bot app")
 
 # Строим структуру данных дерева
-def setup_node_tree():
+# fix_paths=False - только загрузить снимок, ничего не проверяя и не записывая (пути поддерживает Node.save)
+def setup_node_tree(fix_paths=True):
     from tenders_bot.models import Node
+    from tenders_bot.node_tree import get_node_tree, invalidate_node_tree
 
-    logger.info("Recalculating node tree")
-    TendersConfig.root_node = Node.objects.filter(parent_node__isnull=True).first()
-    TendersConfig.root_node.save(update_fields=["path"])
+    if fix_paths:
+        logger.info("Checking node paths")
+        # Обычно пути уже согласованы, и тогда ничего не пишем
+        changed = Node.recompute_paths()
+        if changed:
+            invalidate_node_tree()  # bulk_update не отправляет сигналы
+            logger.info("Fixed paths of %s nodes", changed)
+    get_node_tree()  # заодно выставляет TendersConfig.root_node
     logger.info("Successfully updated node tree")
 
 def start_telegram_bot(*args, **kwargs):
@@ -46,4 +62,10 @@ def start_telegram_bot(*args, **kwargs):
 
     logger.info("Starting telegram bot")
     Thread(daemon=True, target=telegram_bot_main, args=args, kwargs=kwargs).start()
-    logger.info("Telegram bot thread running")
\ No newline at end of file
+    logger.info("Telegram bot thread running")
+
+def start_outbox_worker():
+    from tenders_bot.outbox import run_outbox_worker
+
+    logger.info("Starting outbox worker")
+    Thread(daemon=True, target=run_outbox_worker).start()
@@ -0,0 +1,142 @@
+# Движок обработки обновлений на asyncio (TELEGRAM_BOT_ENGINE="asyncio", запускается manage.py runbot)
+# Обновления обрабатываются корутинами в одном цикле событий поверх telebot.async_telebot, все запросы
+# к Bot API идут через одну keep-alive сессию aiohttp (не больше ASYNC_HTTP_CONNECTIONS соединений).
+# /start и навигация по дереву (основная часть обновлений) в базу не ходят - узлы берутся из снимка
+# дерева в памяти - и выполняются целиком в цикле событий, поэтому ожидание ответа Telegram не держит поток.
+# Сами обработчики общие с движком на потоках (tenders_bot.navigation), здесь только выполнение их шагов;
+# шаги с базой (начало ввода, file_id, состояние в базе) идут в пул потоков параллельно для разных чатов
+# (см. tenders_bot.db.database_sync_to_async).
+# Форма обратной связи (черновики, скачивание файлов, очередь писем) работает с базой и диском и
+# по-прежнему выполняется в потоках диспетчера tenders_bot.telegram: асинхронный ORM Django сам выполняет
+# запросы в потоке через sync_to_async, так что перенос формы на aget/asave потоков бы не убрал
+import asyncio
+import io
+import logging
+import os
+
+import telebot
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from tenders_bot.db import database_sync_to_async
+from tenders_bot.dispatcher import AsyncUpdateDispatcher, run_async_polling, update_chat_id
+from tenders_bot.metrics import UPDATE_SECONDS, Gauge, observe_handler
+from tenders_bot.navigation import (
+    Call,
+    RememberFileId,
+    ResetState,
+    StartInput,
+    UploadFile,
+    arun_steps,
+    navigate_steps,
+    start_steps,
+)
+from tenders_bot.node_tree import NavData, NodeTree, aget_node_tree
+from tenders_bot.outbound import AsyncScheduledBot, scheduler
+from tenders_bot.settings import ASYNC_HTTP_CONNECTIONS, ASYNC_MAX_CONCURRENT_UPDATES
+from tenders_bot.telegram import dispatcher, process_input_node, remember_file_id
+from tenders_bot.tracing import start_trace
+from tenders_bot.user_state import user_states
+
+try:
+    from telebot import asyncio_helper
+    from telebot.async_telebot import AsyncTeleBot
+except ImportError:  # нужен aiohttp, без него работает только движок на потоках
+    AsyncTeleBot = None
+
+logger = logging.getLogger(__name__)
+
+if AsyncTeleBot is not None:
+    asyncio_helper.REQUEST_LIMIT = ASYNC_HTTP_CONNECTIONS  # размер пула соединений общей сессии
+    async_bot = AsyncTeleBot(settings.TELEGRAM_TOKEN)
+    async_sender = AsyncScheduledBot(async_bot, scheduler)
+else:
+    async_bot = async_sender = None
+
+
+# Обновления, которые обрабатываются прямо в цикле событий: /start и переход к узлу без ввода данных
+def handled_natively(update: telebot.types.Update, tree: NodeTree) -> bool:
+    message = update.message
+    if message is not None:
+        return message.content_type == "text" and telebot.util.extract_command(message.text) == "start"
+    call = update.callback_query
+    if call is not None and call.message is not None and NavData.check(call.data):
+        return not NavData.deserialize(call.data, tree).nav_to_node.input_function
+    return False
+
+
+# Синхронный ORM в цикле событий запрещён (SynchronousOnlyOperation), поэтому снимок дерева берётся
+# один раз через aget_node_tree и передаётся обработчикам
+async def process_update(update: telebot.types.Update):
+    tree = await aget_node_tree()
+    if handled_natively(update, tree):
+        attributes = {"telegram.update_id": update.update_id, "telegram.chat_id": update_chat_id(update)}
+        with UPDATE_SECONDS.time(), start_trace("telegram.update", attributes=attributes):
+            if update.message is not None:
+                await start(update.message, tree)
+            else:
+                await navigate(update.callback_query, tree)
+        return
+    # Остальное - обработчикам движка на потоках; ждём, чтобы следующее обновление чата не обогнало это
+    future = await asyncio.to_thread(dispatcher.dispatch, update)
+    await asyncio.wrap_future(future)
+
+
+async_dispatcher = AsyncUpdateDispatcher(process_update, max_concurrent=ASYNC_MAX_CONCURRENT_UPDATES)
+
+Gauge("tenders_bot_async_updates_in_progress", "Updates being processed by the asyncio engine", lambda: async_dispatcher.busy)
+Gauge("tenders_bot_async_updates_pending", "Updates accepted by the asyncio engine and not finished yet", async_dispatcher.pending)
+
+
+# Функция запуска бота в режиме polling на asyncio (stop_event - остановить опрос,
+# уже полученные обновления дорабатываются не дольше drain_timeout секунд)
+def telegram_bot_main_async(stop_event=None, drain_timeout=None):
+    if AsyncTeleBot is None:
+        raise RuntimeError("TELEGRAM_BOT_ENGINE=asyncio requires aiohttp")
+    asyncio.run(_run(stop_event, drain_timeout))
+
+
+async def _run(stop_event, drain_timeout):
+    await async_bot.remove_webhook()
+    try:
+        await run_async_polling(async_bot, async_dispatcher, stop_event, timeout=10, long_polling_timeout=5)
+        await async_dispatcher.join(drain_timeout)
+    finally:
+        if asyncio_helper.session_manager.session is not None:
+            await async_bot.close_session()
+
+
+# Выполнить шаг навигации (tenders_bot.navigation) в цикле событий
+async def execute_step(step):
+    if isinstance(step, Call):
+        return await getattr(async_sender, step.method)(*step.args, **step.kwargs)
+    if isinstance(step, ResetState):
+        return await user_states.adelete(step.chat_id)
+    if isinstance(step, UploadFile):
+        # Файлы узлов небольшие: читаем целиком в потоке, чтобы не блокировать цикл событий диском
+        content = await asyncio.to_thread(_read_file, step.file.name)
+        document = telebot.types.InputFile(io.BytesIO(content), file_name=os.path.basename(step.file.name))
+        return await async_sender.send_document(step.chat_id, document)
+    if isinstance(step, RememberFileId):
+        return await database_sync_to_async(remember_file_id)(step.file.id, step.file.name, step.telegram_file_id)
+    if isinstance(step, StartInput):
+        # Форма ввода работает с базой, её обработчики синхронные
+        return await database_sync_to_async(process_input_node)(step.chat_id, step.node)
+    raise TypeError(f"Unknown navigation step {step!r}")
+
+
+def _read_file(name):
+    with default_storage.open(name, "rb") as content:
+        return content.read()
+
+
+# Обработка команды /start
+@observe_handler
+async def start(message, tree: NodeTree):
+    await arun_steps(start_steps(message, tree), execute_step)
+
+
+# Обработка навигации по кнопкам
+@observe_handler
+async def navigate(call, tree: NodeTree):
+    await arun_steps(navigate_steps(call, tree), execute_step)
@@ -0,0 +1,81 @@
+# Хранение загрузок пользователей по содержимому
+# Одинаковые файлы (карточку компании, лицензию присылают ко многим обращениям) храним один раз:
+# StoredBlob - содержимое под именем по sha256, строки UserUploadedFile на него ссылаются, число ссылок
+# хранится в ref_count. Содержимое, которое Telegram уже присылал (тот же file_unique_id), не скачиваем вовсе
+import os
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from tenders_bot.models import StoredBlob, UserUploadedFile
+from tenders_bot.uploads import Download
+
+
+# Имя файла в хранилище: по первым символам хэша раскладываем по подпапкам, чтобы не было огромной папки
+def blob_file_name(sha256, extension):
+    return f"{sha256[:2]}/{sha256}{extension.lower()}"
+
+
+# Расширение, с которым содержимое было сохранено
+def blob_extension(blob: StoredBlob):
+    return os.path.splitext(blob.file.name)[-1]
+
+
+def find_blob(file_unique_id):
+    if not file_unique_id:
+        return None
+    return StoredBlob.objects.filter(telegram_file_unique_id=file_unique_id).first()
+
+
+# Сохраняем скачанное содержимое, если такого ещё нет, иначе возвращаем уже сохранённое
+def store_blob(download: Download, extension, file_unique_id=None) -> StoredBlob:
+    blob = StoredBlob.objects.filter(sha256=download.sha256).first()
+    if blob is None:
+        field = StoredBlob._meta.get_field("file")
+        # Если файл с таким именем ещё ждёт удаления после удаления прежнего блоба, хранилище выберет другое имя
+        name = field.storage.save(field.generate_filename(None, blob_file_name(download.sha256, extension)), download.file)
+        try:
+            with transaction.atomic():
+                return StoredBlob.objects.create(
+                    sha256=download.sha256, file=name, size=download.size, telegram_file_unique_id=file_unique_id
+                )
+        except IntegrityError:
+            # То же содержимое одновременно сохранил другой поток. Удаляем файл под тем именем, которое
+            # вернуло хранилище: оно может отличаться от запрошенного
+            field.storage.delete(name)
+            blob = StoredBlob.objects.get(sha256=download.sha256)
+        except BaseException:
+            field.storage.delete(name)  # строки блоба нет, иначе файл остался бы без владельца
+            raise
+    if file_unique_id and blob.telegram_file_unique_id is None:
+        StoredBlob.objects.filter(pk=blob.pk).update(telegram_file_unique_id=file_unique_id)
+    return blob
+
+
+# Прикрепляем содержимое к обращению. None - блоб только что удалён вместе с последней ссылкой,
+# тогда файл надо скачать заново
+def attach_blob(blob: StoredBlob, feedback, name) -> UserUploadedFile | None:
+    with transaction.atomic():
+        if not StoredBlob.objects.filter(pk=blob.pk).update(ref_count=F("ref_count") + 1):
+            return None
+        return UserUploadedFile.objects.create(
+            feedback=feedback, blob=blob, file=blob.file.name, name=name, size=blob.size, sha256=blob.sha256
+        )
+
+
+# Сохраняем скачанное содержимое (или находим такое же) и прикрепляем к обращению
+def attach_download(download: Download, feedback, name, extension, file_unique_id=None) -> UserUploadedFile:
+    while True:
+        uploaded_file = attach_blob(store_blob(download, extension, file_unique_id), feedback, name)
+        if uploaded_file is not None:
+            return uploaded_file
+        download.file.seek(0)  # найденный блоб удалили, сохраняем содержимое заново
+
+
+# Ссылка на содержимое удалена; с последней ссылкой удаляем и блоб (файл удалится после коммита,
+# см. tenders_bot.retention). Обновление блокирует строку, поэтому одновременный attach_blob
+# либо успеет увеличить счётчик, либо не найдёт блоб
+def release_blob(blob_id, using=None):
+    blobs = StoredBlob.objects.using(using).filter(pk=blob_id)
+    blobs.update(ref_count=F("ref_count") - 1)
+    blobs.filter(ref_count=0).delete()
@@ -0,0 +1,49 @@
+# Соединения с базой в потоках бота
+# Потоки диспетчера работают вне цикла запроса Django, поэтому то, что Django делает вокруг запроса,
+# делаем вокруг каждого обновления. Каждый поток держит одно постоянное соединение (CONN_MAX_AGE),
+# так что соединений бота не больше, чем потоков диспетчера (TELEBOT_NUM_THREADS). До обновления
+# соединение с истёкшим сроком закрывается, простоявшее - проверяется (CONN_HEALTH_CHECKS), при
+# необходимости открывается новое - всё это до обработчиков, и время ожидания попадает в метрику.
+# После обновления закрывается соединение, сломанное ошибкой, или то, у которого истёк срок
+import functools
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from tenders_bot.metrics import DB_CONNECTION_WAIT_SECONDS, DB_CONNECTIONS_OPENED
+
+
+@receiver(connection_created)
+def count_connection(sender, connection, **kwargs):
+    DB_CONNECTIONS_OPENED.inc()
+
+
+# Рабочее соединение текущего потока на время обработки обновления
+@contextmanager
+def managed_connection(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    started = time.perf_counter()
+    close_old_connections()
+    connection.close_if_health_check_failed()
+    connection.ensure_connection()
+    DB_CONNECTION_WAIT_SECONDS.observe(time.perf_counter() - started)
+    try:
+        yield connection
+    finally:
+        close_old_connections()
+
+
+# Синхронная работа с базой из цикла событий (движок на asyncio): func выполняется в пуле потоков цикла
+# с тем же обслуживанием соединения, что и обновление в потоке диспетчера. thread_sensitive=False: иначе
+# sync_to_async выполняет всё в одном общем потоке, и работа с базой всех обновлений шла бы по очереди.
+# У каждого потока пула своё соединение, так что соединений не больше, чем потоков пула
+def database_sync_to_async(func):
+    def run(*args, **kwargs):
+        with managed_connection():
+            return func(*args, **kwargs)
+
+    return sync_to_async(functools.wraps(func)(run), thread_sensitive=False)
@@ -0,0 +1,251 @@
+# Диспетчер обновлений Telegram
+# Обновления одного чата обрабатываются строго по очереди, обновления разных чатов - параллельно.
+# Каждый чат закреплён за одним рабочим потоком (по chat_id), у каждого потока своя очередь.
+# Через диспетчер идут обновления и при polling, и при webhook.
+# AsyncUpdateDispatcher - то же для движка asyncio: вместо потоков корутины, порядок в чате держит asyncio.Lock
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Optional, Set
+
+import telebot
+
+from tenders_bot.logs import log_context
+from tenders_bot.metrics import DISPATCHER_BUSY_SECONDS, UPDATE_LAG, UPDATE_QUEUE_SECONDS
+from tenders_bot.settings import ASYNC_MAX_CONCURRENT_UPDATES, TELEBOT_NUM_THREADS, UPDATE_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Пауза после ошибки getUpdates, секунд
+POLLING_ERROR_DELAY = 3
+
+# Поля обновления, в которых есть сообщение (а в нём - чат)
+MESSAGE_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post")
+# Поля обновления, в которых есть чат напрямую
+CHAT_FIELDS = ("my_chat_member", "chat_member", "chat_join_request")
+
+
+# Чат, к которому относится обновление (None, если чата нет)
+def update_chat_id(update: telebot.types.Update) -> Optional[int]:
+    for field in MESSAGE_FIELDS + CHAT_FIELDS:
+        value = getattr(update, field, None)
+        if value is not None:
+            return value.chat.id
+    call = update.callback_query
+    if call is not None:
+        # У старых inline-сообщений message может не быть, тогда пишем в личный чат пользователя
+        return call.message.chat.id if call.message is not None else call.from_user.id
+    return None
+
+
+# Время отправки сообщения в Telegram (у нажатий кнопок своего времени нет)
+def update_date(update: telebot.types.Update) -> Optional[int]:
+    for field in MESSAGE_FIELDS:
+        value = getattr(update, field, None)
+        if value is not None:
+            return value.date
+    return None
+
+
+class UpdateDispatcher:
+    def __init__(self, process: Callable, num_workers: int = TELEBOT_NUM_THREADS, queue_size: int = UPDATE_QUEUE_SIZE):
+        self.process = process
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self._queues = []
+        self._threads = []
+        self._lock = threading.Lock()
+        self.busy = 0  # сколько потоков сейчас обрабатывают обновления
+        self._busy_lock = threading.Lock()
+
+    # Потоки запускаются при первом обновлении, чтобы процессы без бота их не держали
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._queues = [queue.Queue(self.queue_size) for _ in range(self.num_workers)]
+            for index, updates in enumerate(self._queues):
+                thread = threading.Thread(
+                    target=self._work, args=(updates,), name=f"dispatcher-{index}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    # Поставить обновление в очередь его чата. Если очередь заполнена, ждём (так polling не
+    # забирает у Telegram больше, чем успевает обработать). Future завершится после обработки
+    def dispatch(self, update: telebot.types.Update) -> Future:
+        self.start()
+        date = update_date(update)
+        if date is not None:
+            UPDATE_LAG.observe(max(0.0, time.time() - date))
+        future = Future()
+        self._queues[self.shard(update)].put((update, future, time.monotonic()))
+        return future
+
+    def shard(self, update: telebot.types.Update) -> int:
+        return self.chat_shard(update_chat_id(update))
+
+    # Номер потока, который обрабатывает обновления чата
+    def chat_shard(self, chat_id) -> int:
+        return 0 if chat_id is None else chat_id % self.num_workers
+
+    # Сколько обновлений ждут обработки в каждой очереди
+    def queue_sizes(self):
+        return [updates.qsize() for updates in self._queues]
+
+    # Дождаться обработки уже поставленных обновлений
+    def join(self):
+        for updates in self._queues:
+            updates.join()
+
+    # Остановить потоки после обработки уже поставленных обновлений. Возвращает номера потоков,
+    # которые не успели остановиться за timeout секунд (всего, а не на каждый поток)
+    def stop(self, timeout: Optional[float] = None) -> Set[int]:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            for updates in self._queues:
+                updates.put(None)
+            for thread in self._threads:
+                thread.join(max(0.0, deadline - time.monotonic()) if deadline is not None else None)
+            running = {index for index, thread in enumerate(self._threads) if thread.is_alive()}
+            self._queues = []
+            self._threads = []
+        return running
+
+    def _work(self, updates: queue.Queue):
+        while True:
+            item = updates.get()
+            try:
+                if item is None:
+                    return
+                update, future, queued_at = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                started = time.monotonic()
+                UPDATE_QUEUE_SECONDS.observe(started - queued_at)
+                with self._busy_lock:
+                    self.busy += 1
+                try:
+                    with log_context(chat_id=update_chat_id(update), update_id=update.update_id):
+                        try:
+                            self.process(update)
+                        except Exception as e:
+                            logger.exception("Exception while processing update %s", update.update_id)
+                            future.set_exception(e)
+                        else:
+                            future.set_result(None)
+                finally:
+                    with self._busy_lock:
+                        self.busy -= 1
+                    DISPATCHER_BUSY_SECONDS.inc(time.monotonic() - started)
+            finally:
+                updates.task_done()
+
+
+class AsyncUpdateDispatcher:
+    def __init__(self, process: Callable, max_concurrent: int = ASYNC_MAX_CONCURRENT_UPDATES):
+        self.process = process  # корутина, обрабатывающая одно обновление
+        self.max_concurrent = max_concurrent
+        self._slots = None  # asyncio.Semaphore, создаётся в цикле событий при первом обновлении
+        self._chats = {}  # chat_id -> [asyncio.Lock, сколько задач чата ещё не завершились]
+        self._tasks = set()
+        self.busy = 0  # сколько обновлений сейчас обрабатывается
+
+    # Запустить обработку обновления. Если в работе уже max_concurrent обновлений, ждём освобождения
+    # (так polling не забирает у Telegram больше, чем успевает обработать). Задача завершится после обработки
+    async def dispatch(self, update: telebot.types.Update) -> asyncio.Task:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+        date = update_date(update)
+        if date is not None:
+            UPDATE_LAG.observe(max(0.0, time.time() - date))
+        await self._slots.acquire()
+        # Задачи стартуют в порядке создания, а asyncio.Lock пропускает ожидающих по очереди,
+        # поэтому обновления одного чата обрабатываются в порядке поступления
+        task = asyncio.create_task(self._work(update, time.monotonic()))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    # Сколько обновлений ждут своей очереди в чате или ещё обрабатываются
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    # Дождаться обработки уже запущенных обновлений
+    async def join(self, timeout: Optional[float] = None):
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+    async def _work(self, update: telebot.types.Update, queued_at: float):
+        chat_id = update_chat_id(update)
+        chat = self._chats.setdefault(chat_id, [asyncio.Lock(), 0])
+        chat[1] += 1
+        try:
+            async with chat[0]:
+                started = time.monotonic()
+                UPDATE_QUEUE_SECONDS.observe(started - queued_at)
+                self.busy += 1
+                try:
+                    with log_context(chat_id=chat_id, update_id=update.update_id):
+                        try:
+                            await self.process(update)
+                        except Exception:
+                            logger.exception("Exception while processing update %s", update.update_id)
+                finally:
+                    self.busy -= 1
+                    DISPATCHER_BUSY_SECONDS.inc(time.monotonic() - started)
+        finally:
+            chat[1] -= 1
+            if not chat[1]:
+                del self._chats[chat_id]
+            self._slots.release()
+
+
+# Получение обновлений через getUpdates и передача их диспетчеру
+def run_polling(
+    bot: telebot.TeleBot,
+    dispatcher: UpdateDispatcher,
+    stop_event: Optional[threading.Event] = None,
+    timeout: int = 10,
+    long_polling_timeout: int = 5,
+):
+    stop_event = stop_event or threading.Event()
+    offset = None
+    while not stop_event.is_set():
+        try:
+            updates = bot.get_updates(offset=offset, timeout=timeout, long_polling_timeout=long_polling_timeout)
+        except Exception:
+            logger.exception("Exception while getting updates")
+            stop_event.wait(POLLING_ERROR_DELAY)
+            continue
+
+        for update in updates:
+            dispatcher.dispatch(update)
+            offset = update.update_id + 1
+
+
+# То же для движка asyncio (bot - telebot.async_telebot.AsyncTeleBot)
+async def run_async_polling(
+    bot,
+    dispatcher: AsyncUpdateDispatcher,
+    stop_event: Optional[threading.Event] = None,
+    timeout: int = 10,
+    long_polling_timeout: int = 5,
+):
+    stop_event = stop_event or threading.Event()
+    offset = None
+    while not stop_event.is_set():
+        try:
+            # У AsyncTeleBot timeout - время long polling, а request_timeout - таймаут HTTP-запроса
+            updates = await bot.get_updates(offset=offset, timeout=long_polling_timeout, request_timeout=timeout)
+        except Exception:
+            logger.exception("Exception while getting updates")
+            await asyncio.sleep(POLLING_ERROR_DELAY)
+            continue
+
+        for update in updates:
+            await dispatcher.dispatch(update)
+            offset = update.update_id + 1
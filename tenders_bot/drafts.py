@@ -0,0 +1,141 @@
+# Черновики формы обратной связи (незаполненные Feedback с submitted=False)
+# Пока пользователь заполняет форму, черновик живёт в ограниченном кэше по chat_id, а в базу пишутся
+# только изменённые поля и только когда это нужно. Целиком черновик сохраняется при отправке.
+# Строка черновика в базе переиспользуется при следующем заполнении формы, а не удаляется
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+from django.utils import timezone
+
+from tenders_bot.models import Feedback
+from tenders_bot.settings import FEEDBACK_DRAFT_CACHE_SIZE, FEEDBACK_DRAFT_WRITE_BEHIND
+
+logger = logging.getLogger(__name__)
+
+# Поля, которые сбрасываются при повторном использовании строки черновика
+FORM_FIELDS = (
+    "telegram_sent_message_id",
+    "telegram_username",
+    "telegram_first_name",
+    "telegram_last_name",
+    "name",
+    "contact_number",
+    "email",
+    "company",
+    "inn",
+    "text",
+    "comment",
+)
+
+
+class DraftCache:
+    # write_behind=False - каждое изменение сразу пишется в базу (нужно, если процессов бота несколько)
+    def __init__(self, max_size: int = FEEDBACK_DRAFT_CACHE_SIZE, write_behind: bool = FEEDBACK_DRAFT_WRITE_BEHIND):
+        self.max_size = max_size
+        self.write_behind = write_behind
+        self._drafts = OrderedDict()  # chat_id -> (черновик, множество изменённых полей)
+        self._lock = threading.Lock()
+
+    # Начать заполнение формы: переиспользуем существующий черновик чата или создаём новый
+    def start(self, chat_id, feedback_type: Feedback.FeedbackType, first_field: str) -> Feedback:
+        self.discard(chat_id)
+        drafts = list(Feedback.objects.filter(telegram_chat_id=chat_id, submitted=False).order_by("-id"))
+        if not drafts:
+            feedback = Feedback.objects.create(telegram_chat_id=chat_id, type=feedback_type, next_field=first_field)
+        else:
+            feedback, duplicates = drafts[0], drafts[1:]
+            if duplicates:
+                Feedback.objects.filter(pk__in=[d.pk for d in duplicates]).delete()
+            feedback.uploaded_files.all().delete()
+            for field in FORM_FIELDS:
+                setattr(feedback, field, None)
+            feedback.type = feedback_type
+            feedback.next_field = first_field
+            feedback.processed = False
+            feedback.created_at = timezone.now()
+            feedback.save(update_fields=FORM_FIELDS + ("type", "next_field", "processed", "created_at"))
+
+        self._put(chat_id, feedback, set())
+        return feedback
+
+    # Текущий черновик чата (из кэша, а если его там нет - из базы)
+    def get(self, chat_id) -> Feedback:
+        with self._lock:
+            item = self._drafts.get(chat_id)
+            if item is not None:
+                self._drafts.move_to_end(chat_id)
+                return item[0]
+
+        feedback = Feedback.objects.filter(telegram_chat_id=chat_id, submitted=False).order_by("-id").first()
+        if feedback is None:
+            raise Feedback.DoesNotExist(f"No feedback draft for chat {chat_id}")
+        self._put(chat_id, feedback, set())
+        return feedback
+
+    # Отметить поля черновика изменёнными
+    def mark_changed(self, feedback: Feedback, *fields):
+        with self._lock:
+            item = self._drafts.get(feedback.telegram_chat_id)
+            if item is not None and item[0] is feedback:
+                item[1].update(fields)
+                return
+        # Черновика нет в кэше (вытеснен) - пишем сразу
+        feedback.save(update_fields=fields)
+
+    # Записать изменённые поля в базу, если кэш работает без отложенной записи
+    def checkpoint(self, feedback: Feedback):
+        if self.write_behind:
+            return
+        self._save_changed(feedback)
+
+    # Сохранить черновик целиком (при отправке формы) и убрать его из кэша
+    def flush(self, feedback: Feedback):
+        feedback.save()
+        self.discard(feedback.telegram_chat_id)
+
+    # Записать несохранённые изменения всех черновиков (при остановке бота); include - отбор по chat_id
+    # (черновик, который ещё меняет поток обработки, сохранять нельзя)
+    def flush_all(self, include: Callable[[int], bool] = None) -> int:
+        with self._lock:
+            items = []
+            for chat_id, (feedback, fields) in self._drafts.items():
+                if fields and (include is None or include(chat_id)):
+                    items.append((feedback, tuple(fields)))
+                    fields.clear()
+        for feedback, fields in items:
+            feedback.save(update_fields=fields)
+        return len(items)
+
+    # Убрать черновик из кэша без записи
+    def discard(self, chat_id):
+        with self._lock:
+            self._drafts.pop(chat_id, None)
+
+    def __len__(self):
+        return len(self._drafts)
+
+    def _save_changed(self, feedback: Feedback):
+        with self._lock:
+            item = self._drafts.get(feedback.telegram_chat_id)
+            if item is None or not item[1]:
+                return
+            fields = tuple(item[1])
+            item[1].clear()
+        feedback.save(update_fields=fields)
+
+    def _put(self, chat_id, feedback: Feedback, changed: set):
+        evicted = []
+        with self._lock:
+            self._drafts[chat_id] = (feedback, changed)
+            self._drafts.move_to_end(chat_id)
+            while len(self._drafts) > self.max_size:
+                evicted.append(self._drafts.popitem(last=False)[1])
+        # Вытесненные черновики с несохранёнными изменениями записываем в базу
+        for draft, fields in evicted:
+            if fields:
+                draft.save(update_fields=tuple(fields))
+
+
+drafts = DraftCache()
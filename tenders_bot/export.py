@@ -0,0 +1,145 @@
+# Выгрузка обращений для отчётности (CSV, а при установленном openpyxl - XLSX)
+# Строки читаются из базы пачками через iterator() и сразу пишутся в ответ/файл,
+# поэтому память не растёт с числом обращений
+import csv
+import tempfile
+from typing import Iterable, Iterator
+
+from django.db.models import Prefetch
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.timezone import localtime
+
+from tenders_bot.models import Feedback, UserUploadedFile
+from tenders_bot.settings import ID_FORMAT
+
+try:
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+except ImportError:  # XLSX необязателен, CSV работает всегда
+    openpyxl = None
+
+CHUNK_SIZE = 2000
+# Excel в русской локали ожидает ";" и узнаёт UTF-8 по BOM
+CSV_DELIMITER = ";"
+CSV_BOM = "\ufeff"
+# Текст пользователя, который Excel принял бы за формулу (CSV injection), в CSV начинаем с "'"
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+COLUMNS = (
+    "Номер обращения",
+    "Дата и время",
+    "Тип запроса",
+    "Компания",
+    "ИНН",
+    "ФИО",
+    "Номер телефона",
+    "Email",
+    "Имя пользователя в Telegram",
+    "Текст обращения",
+    "Обработано",
+    "Комментарий",
+    "Вложенные файлы",
+)
+
+
+# Обращения в порядке номеров, с именами вложений (подгружаются на каждую пачку одним запросом)
+def export_queryset(queryset) -> Iterator[Feedback]:
+    files = Prefetch("uploaded_files", queryset=UserUploadedFile.objects.only("id", "feedback_id", "file", "name"))
+    # defer(None) снимает отложенные поля, с которыми queryset мог прийти из списка в админке
+    queryset = queryset.order_by("id").defer(None).defer("search_vector").prefetch_related(files)
+    return queryset.iterator(chunk_size=CHUNK_SIZE)
+
+
+def feedback_row(feedback: Feedback) -> list:
+    return [
+        ID_FORMAT.format(id=feedback.id),
+        localtime(feedback.created_at).strftime("%d.%m.%Y %H:%M"),
+        feedback.get_type_display(),
+        feedback.company or "",
+        feedback.inn or "",
+        feedback.name or "",
+        feedback.contact_number or "",
+        feedback.email or "",
+        feedback.telegram_username or "",
+        feedback.text or "",
+        "да" if feedback.processed else "нет",
+        feedback.comment or "",
+        ", ".join(f.display_name for f in feedback.uploaded_files.all()),
+    ]
+
+
+def export_rows(queryset) -> Iterator[list]:
+    yield list(COLUMNS)
+    for feedback in export_queryset(queryset):
+        yield feedback_row(feedback)
+
+
+def escape_formula(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_row(row: list) -> list:
+    return [escape_formula(value) for value in row]
+
+
+# Файлоподобный объект, который возвращает записанную строку вместо того, чтобы её хранить
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows: Iterable[list]) -> Iterator[str]:
+    writer = csv.writer(_Echo(), delimiter=CSV_DELIMITER)
+    yield CSV_BOM
+    for row in rows:
+        yield writer.writerow(csv_row(row))
+
+
+# Записать выгрузку в открытый текстовый файл, возвращает число обращений
+def write_csv(queryset, output) -> int:
+    writer = csv.writer(output, delimiter=CSV_DELIMITER)
+    output.write(CSV_BOM)
+    count = 0
+    for count, row in enumerate(export_rows(queryset)):
+        writer.writerow(csv_row(row))
+    return count
+
+
+# В режиме write_only openpyxl не держит лист в памяти, строки сразу уходят во временный файл
+def write_xlsx(queryset, output) -> int:
+    if openpyxl is None:
+        raise RuntimeError("XLSX export requires openpyxl")
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Обращения")
+    count = 0
+    for count, row in enumerate(export_rows(queryset)):
+        sheet.append(xlsx_row(sheet, row))
+    workbook.save(output)
+    return count
+
+
+# В XLSX текст явно помечаем строкой: openpyxl записал бы значение, начинающееся с "=", как формулу
+def xlsx_row(sheet, row: list) -> list:
+    cells = []
+    for value in row:
+        cell = WriteOnlyCell(sheet, value)
+        if isinstance(value, str):
+            cell.data_type = "s"
+        cells.append(cell)
+    return cells
+
+
+def csv_response(queryset, file_name: str) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(csv_lines(export_rows(queryset)), content_type="text/csv; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="{file_name}"'
+    return response
+
+
+# XLSX - это zip-архив, который записывается целиком в конце, поэтому собираем его во временном файле
+def xlsx_response(queryset, file_name: str) -> FileResponse:
+    output = tempfile.TemporaryFile()
+    write_xlsx(queryset, output)
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename=file_name)
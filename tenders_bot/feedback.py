@@ -1,22 +1,30 @@
 # Модуль обработки обратной связи в чат-боте
-# отвечает за: сбор информации от пользователя, загрузку файлов, сохранение в базу и отправку email
+# отвечает за: сбор информации от пользователя, загрузку файлов, сохранение в базу и постановку email в очередь
 import logging
 import os
-from io import BytesIO
 
 import telebot # библиотека для работы с Telegram Bot API
-from django.core.files import File
-from django.core.mail import EmailMessage, get_connection
-from django.utils.formats import localize
-from django.utils.timezone import localtime
+from django.db import transaction
+from django.db.models import Sum
 from telebot.apihelper import ApiTelegramException
 
 # Импорт моделей Django
-from tenders_bot.models import Feedback, UserUploadedFile
+from tenders_bot.models import Feedback
+# Очередь писем
+from tenders_bot.outbox import enqueue_feedback_email
 # Импорт настроек
-from tenders_bot.settings import DEFAULT_FROM_EMAIL, ID_FORMAT, MAIL_FEEDBACK_TO, MAX_FILE_SIZE_MB, MAX_TOTAL_SIZE_MB
-# Импорт экземпляра бота и глобального состояния пользователя
-from tenders_bot.telegram import bot, finish_input, user_states
+from tenders_bot.settings import ID_FORMAT, MAX_FILE_SIZE_MB, MAX_TOTAL_SIZE_MB
+# Потоковое скачивание присланных файлов и хранение их по содержимому
+from tenders_bot.blobs import attach_blob, attach_download, blob_extension, find_blob
+from tenders_bot.uploads import FileTooLarge, telegram_file_url
+from tenders_bot.uploads import download as download_file
+# Метрики обработчиков
+from tenders_bot.metrics import observe_handler
+# Кэш черновиков формы
+from tenders_bot.drafts import drafts
+# Импорт экземпляра бота и хранилища состояний пользователей
+from tenders_bot.telegram import bot, finish_input, sender
+from tenders_bot.user_state import user_states
 
 logger = logging.getLogger(__name__)
 
@@ -41,17 +49,10 @@ type_to_fields = {
 def feedback_start(chat_id, _):
     _feedback_start(chat_id, _, Feedback.FeedbackType.GENERAL)
 
-# Функция запуска ввода, создаем объект Feedback и запускаем ввод
+# Функция запуска ввода, берём черновик Feedback (старый переиспользуется) и запускаем ввод
 def _feedback_start(chat_id, _, feedback_type: Feedback.FeedbackType):
-    # удаляем незавершенные обращения
-    existing_feedbacks = Feedback.objects.filter(telegram_chat_id=chat_id, submitted=False)
-    existing_feedbacks.delete()
-
-    # Создаём новое обращение
-    new_feedback = Feedback.objects.create(
-        telegram_chat_id=chat_id, type=feedback_type, next_field=type_to_fields[feedback_type][0]
-    )
-    user_states[chat_id].entering_feedback = True # отмечаем, что пользователь в режиме ввода
+    new_feedback = drafts.start(chat_id, feedback_type, type_to_fields[feedback_type][0])
+    user_states.update(chat_id, entering_feedback=True) # отмечаем, что пользователь в режиме ввода
 
     # Показываем первое поле пользователю
     request_next_input(new_feedback)
@@ -61,7 +62,7 @@ def request_next_input(feedback):
     try:
         #  Удаляем предыдущие кнопки (если были)
         if feedback.telegram_sent_message_id:
-            bot.edit_message_reply_markup(feedback.telegram_chat_id, feedback.telegram_sent_message_id)
+            sender.edit_message_reply_markup(feedback.telegram_chat_id, feedback.telegram_sent_message_id)
     except ApiTelegramException as e:
         logger.exception("Exception while editing message")
 
@@ -76,179 +77,164 @@ def request_next_input(feedback):
         markup.add(telebot.types.InlineKeyboardButton("Отправить", callback_data=f"submit_feedback"))
 
     # Отправляем сообщение с запросом на ввод поля
-    message = bot.send_message(feedback.telegram_chat_id, messages[field], reply_markup=markup)
+    message = sender.send_message(feedback.telegram_chat_id, messages[field], reply_markup=markup)
 
-    # Сохраняем ID отправленного сообщения, чтобы потом его редактировать
+    # Запоминаем ID отправленного сообщения, чтобы потом его редактировать
     feedback.telegram_sent_message_id = message.id
-    feedback.save()
+    drafts.mark_changed(feedback, "telegram_sent_message_id")
+    drafts.checkpoint(feedback)
+
+# Находится ли пользователь в режиме ввода обращения
+def is_entering_feedback(chat_id) -> bool:
+    state = user_states.get(chat_id)
+    return state is not None and state.entering_feedback
 
 # Обработка пользовательского ввода (текста, файлы)
 @bot.message_handler(
-    func=lambda message: message.chat.id in user_states and user_states[message.chat.id].entering_feedback,
+    func=lambda message: is_entering_feedback(message.chat.id),
     content_types=["text", "document", "photo"],
 )
+@observe_handler
 def feedback_process_input(message):
-    feedback = Feedback.objects.get(telegram_chat_id=message.chat.id, submitted=False)
+    feedback = drafts.get(message.chat.id)
     field = feedback.next_field
 
-    # Сохраняем информацию о пользователе Telegram, если ещё не сохранена
+    # Запоминаем информацию о пользователе Telegram, если ещё не сохранена
     if feedback.telegram_username is None:
         feedback.telegram_username = message.from_user.username
         feedback.telegram_first_name = message.from_user.first_name
         feedback.telegram_last_name = message.from_user.last_name
+        drafts.mark_changed(feedback, "telegram_username", "telegram_first_name", "telegram_last_name")
 
     # Обработка файлов
     if field == "files":
         if message.document:
-            feedback_process_file(message.document.file_id, message.document.file_name, message.chat.id)
+            document = message.document
+            feedback_process_file(document.file_id, document.file_name, message.chat.id, document.file_unique_id)
 
         if message.photo:
             photo_size = message.photo[-1]
-            feedback_process_file(photo_size.file_id, photo_size.file_id, message.chat.id)
+            feedback_process_file(photo_size.file_id, photo_size.file_id, message.chat.id, photo_size.file_unique_id)
 
         if message.caption or message.text:
-            bot.send_message(message.chat.id, "На этом этапе можно загрузить только файлы, текст записан не будет.")
+            sender.send_message(message.chat.id, "На этом этапе можно загрузить только файлы, текст записан не будет.")
     else:
         # Не разрешаем загружать файлы на этапе ввода текста
         if message.document or message.photo:
             if "files" in type_to_fields[feedback.type]:
-                bot.send_message(
+                sender.send_message(
                     message.chat.id,
                     "Файлы можно будет прикрепить в конце обращения, пока что можно ввести только текст.",
                 )
             else:
-                bot.send_message(message.chat.id, 'Файлы можно прикрепить только в разделе "Обратная связь"')
+                sender.send_message(message.chat.id, 'Файлы можно прикрепить только в разделе "Обратная связь"')
         else:
             # Сохраняем введённое значение
             next_field_index = type_to_fields[feedback.type].index(field) + 1
             if next_field_index < len(type_to_fields[feedback.type]):
                 setattr(feedback, field, message.text)
                 feedback.next_field = type_to_fields[feedback.type][next_field_index]
+                drafts.mark_changed(feedback, field, "next_field")
             else:
-                bot.send_message(message.chat.id, "Дополнить обращение уже нельзя, можно только отправить новое.")
+                sender.send_message(message.chat.id, "Дополнить обращение уже нельзя, можно только отправить новое.")
 
-    feedback.save()
     request_next_input(feedback)
 
+# Суммарный размер файлов обращения (одним запросом, без обращения к диску)
+def uploaded_files_size(feedback) -> int:
+    return feedback.uploaded_files.aggregate(total=Sum("size"))["total"] or 0
+
 # Обработка одного загруженного файла
-def feedback_process_file(telegram_file_id, file_name, chat_id):
-    file_info = bot.get_file(telegram_file_id)
-    extension = os.path.splitext(file_info.file_path)[-1]
+# file_unique_id одинаков у одного и того же файла во всех чатах: если такой файл уже присылали,
+# берём сохранённое содержимое и не обращаемся к Telegram
+def feedback_process_file(telegram_file_id, file_name, chat_id, file_unique_id=None):
+    file_info = None
+    blob = find_blob(file_unique_id)
+    if blob is not None:
+        extension = blob_extension(blob)
+        file_size_in_bytes = blob.size
+    else:
+        file_info = bot.get_file(telegram_file_id)
+        extension = os.path.splitext(file_info.file_path)[-1]
+        file_size_in_bytes = file_info.file_size
     file_name = os.path.splitext(file_name)[0]
     file_name = file_name + extension
 
     # Запрещаем исполнимые файлы для безопасности
     if extension == ".exe" or extension == ".bat" or extension == ".com" or extension == ".cmd":
-        bot.send_message(
+        sender.send_message(
             chat_id,
             f"Файл с таким расширением расширением не допустим"
         )
         return
-    file_size_in_bytes = file_info.file_size
+    too_large_message = (
+        f"Файл под названием {file_name} не может быть загружен,"
+        f" т.к. его размер превышает {MAX_FILE_SIZE_MB}Мб."
+    )
     if file_size_in_bytes > MAX_FILE_SIZE_MB * 1024 * 1024:
-        bot.send_message(
-            chat_id,
-            f"Файл под названием {file_name} не может быть загружен,"
-            f" т.к. его размер превышает {MAX_FILE_SIZE_MB}Мб.",
-        )
+        sender.send_message(chat_id, too_large_message)
     else:
-        feedback = Feedback.objects.get(telegram_chat_id=chat_id, submitted=False)
-        existing_files_size = sum(f.file.size for f in feedback.uploaded_files.all())
-        if existing_files_size + file_size_in_bytes > MAX_TOTAL_SIZE_MB * 1024 * 1024:
-            bot.send_message(chat_id, f"Все файлы в обращении не могут превышать {MAX_TOTAL_SIZE_MB}Мб.")
+        feedback = drafts.get(chat_id)
+        total_left = MAX_TOTAL_SIZE_MB * 1024 * 1024 - uploaded_files_size(feedback)
+        total_too_large_message = f"Все файлы в обращении не могут превышать {MAX_TOTAL_SIZE_MB}Мб."
+        if file_size_in_bytes > total_left:
+            sender.send_message(chat_id, total_too_large_message)
         else:
-            uploaded_file_bytes = bot.download_file(file_info.file_path)
-            uploaded_file = File(BytesIO(uploaded_file_bytes), name=file_name)
-            UserUploadedFile.objects.create(file=uploaded_file, feedback=feedback)
-            bot.send_message(chat_id, f"Ваш файл {file_name} добавлен к обращению.")
-
-# Завершаем ввод, сохраняем и отправляем письмо
+            uploaded_file = attach_blob(blob, feedback, file_name) if blob is not None else None
+            if uploaded_file is None:
+                # Скачиваем потоком; лимиты проверяются ещё раз по фактически полученным байтам
+                file_info = file_info or bot.get_file(telegram_file_id)
+                max_size = min(MAX_FILE_SIZE_MB * 1024 * 1024, total_left)
+                try:
+                    download = download_file(telegram_file_url(bot.token, file_info.file_path), max_size=max_size)
+                except FileTooLarge:
+                    # Сообщаем о том лимите, в который файл не уложился
+                    if max_size < MAX_FILE_SIZE_MB * 1024 * 1024:
+                        sender.send_message(chat_id, total_too_large_message)
+                    else:
+                        sender.send_message(chat_id, too_large_message)
+                    return
+                with download.file:
+                    attach_download(download, feedback, file_name, extension, file_unique_id)
+            sender.send_message(chat_id, f"Ваш файл {file_name} добавлен к обращению.")
+
+# Завершаем ввод, сохраняем и ставим письмо в очередь (отправит tenders_bot.outbox)
 def feedback_finish(feedback):
-    feedback.submitted = True
-    feedback.save()
+    with transaction.atomic():
+        feedback.submitted = True
+        drafts.flush(feedback)  # черновик сохраняется целиком
+        feedback.update_search_vector()
+        enqueue_feedback_email(feedback)
 
-    message = bot.send_message(feedback.telegram_chat_id, "Подождите немного, отправляем ваше обращение...")
     feedback_id = ID_FORMAT.format(id=feedback.id)
-    try:
-        email_feedback(feedback)
-    except Exception as e:
-        logger.exception("Exception while sending mail")
-
-    bot.edit_message_text(
-        f"Спасибо, ваш запрос принят!\nНомер обращения: {feedback_id}",
-        message.chat.id,
-        message.id,
-    )
-    logger.info(f"Accepted feedback {feedback_id}")
+    sender.send_message(feedback.telegram_chat_id, f"Спасибо, ваш запрос принят!\nНомер обращения: {feedback_id}")
+    logger.info("Accepted feedback %s", feedback_id)
 
-    user_states[feedback.telegram_chat_id].entering_feedback = False
     finish_input(feedback.telegram_chat_id)
 
 # Обрабатываем нажатие на кнопку "Отмена" ввода
 @bot.callback_query_handler(func=lambda call: call.data == "cancel_feedback")
+@observe_handler
 def feedback_cancel(call):
-    feedback = Feedback.objects.get(telegram_chat_id=call.message.chat.id, submitted=False)
+    chat_id = call.message.chat.id
     try:
-        bot.edit_message_reply_markup(call.message.chat.id, call.message.id)
+        sender.edit_message_reply_markup(chat_id, call.message.id)
     except ApiTelegramException as e:
         logger.exception("Exception while editing message")
-    bot.send_message(call.message.chat.id, "Отправка обращения отменена")
+    sender.send_message(chat_id, "Отправка обращения отменена")
 
-    user_states[feedback.telegram_chat_id].entering_feedback = False
-    finish_input(feedback.telegram_chat_id)
+    # Несохранённые изменения не нужны: строка черновика переиспользуется при следующем заполнении
+    drafts.discard(chat_id)
+    finish_input(chat_id)
 
 # Подтверждение и отправка формы
 @bot.callback_query_handler(func=lambda call: call.data == "submit_feedback")
+@observe_handler
 def feedback_submit(call):
-    feedback = Feedback.objects.get(telegram_chat_id=call.message.chat.id, submitted=False)
+    feedback = drafts.get(call.message.chat.id)
     try:
-        bot.edit_message_reply_markup(feedback.telegram_chat_id, feedback.telegram_sent_message_id)
+        sender.edit_message_reply_markup(feedback.telegram_chat_id, feedback.telegram_sent_message_id)
     except ApiTelegramException as e:
         logger.exception("Exception while editing message")
 
     feedback_finish(feedback)
-
-# Функция отправки письма на шаблону
-def email_feedback(feedback: Feedback):
-    str_id = ID_FORMAT.format(id=feedback.id)
-
-    feedback_str = f"""
-Пришло обращение из телеграм бота департамента тендеров и закупок.
-
-Номер обращения: {str_id}.
-Дата и время обращения: {localize(localtime(feedback.created_at))}
-
-Название компании: {feedback.company}
-ИНН: {feedback.inn}
-ФИО: {feedback.name}
-Номер телефона: {feedback.contact_number}
-Электронная почта: {feedback.email}
-
-Текст сообщения:
-{feedback.text}
-"""
-    # Добавляем список файлов (если есть)
-    uploaded_files = feedback.uploaded_files.all()
-    if uploaded_files:
-        feedback_str = feedback_str + "\nВложенные файлы:\n- "
-        feedback_str = feedback_str + "\n- ".join(
-            os.path.basename(uploaded_file.file.name) for uploaded_file in feedback.uploaded_files.all()
-        )
-    logger.debug("Sending email")
-    connection = get_connection(timeout=10)
-    logger.debug("Established connection")
-    mail = EmailMessage(
-        f"Запрос из Telegram-бота: {str_id}",
-        feedback_str,
-        DEFAULT_FROM_EMAIL,
-        MAIL_FEEDBACK_TO,
-        connection=connection
-    )
-    for uploaded_file in feedback.uploaded_files.all():
-        with uploaded_file.file.open('rb') as file:
-            mail.attach(os.path.basename(uploaded_file.file.name), file.read())
-
-    logger.debug("Created email")
-
-    mail.send()
-    logger.debug("Sent email")
\ No newline at end of file
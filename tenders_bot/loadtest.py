@@ -0,0 +1,438 @@
+# Нагрузочное тестирование бота
+# Поднимаем локальный HTTP-сервер, который притворяется Telegram Bot API (getUpdates, sendMessage,
+# sendDocument, editMessage*, deleteMessage, getFile и скачивание файлов), направляем на него telebot
+# и запускаем N имитируемых пользователей: они ходят по дереву узлов и заполняют форму обратной связи
+# с вложением. Обновления обрабатывает настоящий стек бота (диспетчер, обработчики, ORM, хранилище).
+# Запуск: python manage.py loadtest (см. tenders_bot/management/commands/loadtest.py)
+import itertools
+import json
+import logging
+import math
+import queue
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+from django.db import connection
+from telebot import apihelper
+
+logger = logging.getLogger(__name__)
+
+# Чаты имитируемых пользователей начинаются отсюда, чтобы не пересекаться с настоящими (как и настоящие
+# ID чатов, не помещаются в 32 бита - поэтому Feedback.telegram_chat_id хранится в bigint)
+CHAT_ID_BASE = 9_000_000_000
+
+
+# Процентиль методом ближайшего ранга (values - отсортированный список)
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(values)))
+    return values[rank - 1]
+
+
+# ----------- Fake Bot API ----------- #
+class FakeBotApi:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.server = ThreadingHTTPServer((host, port), _FakeBotApiHandler)
+        self.server.daemon_threads = True
+        self.server.api = self
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self.calls: Dict[str, int] = {}  # сколько раз вызван каждый метод
+        self.files: Dict[str, bytes] = {}  # file_id -> содержимое
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._inboxes: Dict[int, queue.Queue] = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.1}, name="fake-bot-api", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # Направить telebot на этот сервер; возвращает прежние адреса для restore_urls
+    def patch_urls(self):
+        previous = (apihelper.API_URL, apihelper.FILE_URL)
+        apihelper.API_URL = self.url + "/bot{0}/{1}"
+        apihelper.FILE_URL = self.url + "/file/bot{0}/{1}"
+        return previous
+
+    @staticmethod
+    def restore_urls(previous):
+        apihelper.API_URL, apihelper.FILE_URL = previous
+
+    # ----- сторона пользователя ----- #
+    def push_update(self, **fields) -> int:
+        with self._cond:
+            update_id = next(self._update_ids)
+            self._updates.append({"update_id": update_id, **fields})
+            self._cond.notify_all()
+        return update_id
+
+    def add_file(self, content: bytes) -> str:
+        file_id = f"user-file-{next(self._file_ids)}"
+        self.files[file_id] = content
+        return file_id
+
+    # Сообщения, которые бот отправил в чат
+    def inbox(self, chat_id: int) -> queue.Queue:
+        with self._cond:
+            return self._inboxes.setdefault(chat_id, queue.Queue())
+
+    # ----- сторона бота ----- #
+    def get_updates(self, offset: int, timeout: float):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            return self._updates[:100]
+
+    def call(self, method: str, params: dict):
+        with self._cond:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == "getUpdates":
+            return self.get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0))
+        if method in ("sendMessage", "sendDocument"):
+            return self._send(method, params)
+        if method == "getFile":
+            file_id = params["file_id"]
+            content = self.files.get(file_id, b"")
+            return {
+                "file_id": file_id, "file_unique_id": file_id, "file_size": len(content),
+                "file_path": f"documents/{file_id}.pdf",
+            }
+        # editMessageText, editMessageReplyMarkup, deleteMessage, deleteWebhook, answerCallbackQuery ...
+        return True
+
+    def _send(self, method, params):
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+        }
+        if method == "sendMessage":
+            message["text"] = params.get("text", "")
+        else:
+            file_id = params.get("document") or f"bot-file-{next(self._file_ids)}"
+            message["document"] = {"file_id": file_id, "file_unique_id": file_id}
+        if params.get("reply_markup"):
+            message["reply_markup"] = json.loads(params["reply_markup"])
+        self.inbox(chat_id).put((time.monotonic(), message))
+        return message
+
+    def download(self, file_path: str) -> Optional[bytes]:
+        file_id = file_path.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+        return self.files.get(file_id)
+
+
+class _FakeBotApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        api = self.server.api
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+        # Тело (multipart с загружаемым файлом) читаем целиком и не разбираем: боту важен только ответ
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+
+        parts = url.path.strip("/").split("/")
+        if parts[0] == "file":
+            content = api.download("/".join(parts[2:]))
+            if content is None:
+                return self._reply(404, b"")
+            return self._reply(200, content, "application/octet-stream")
+
+        try:
+            result = api.call(parts[1], params)
+            body = {"ok": True, "result": result}
+        except Exception as e:
+            logger.exception("Fake Bot API failed on %s", self.path)
+            body = {"ok": False, "error_code": 400, "description": str(e)}
+        self._reply(200, json.dumps(body).encode(), "application/json")
+
+    def _reply(self, status, body, content_type="text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# ----------- Измерение обработки обновлений ----------- #
+class UpdateStats:
+    def __init__(self):
+        self.latencies = []  # секунды на обработку обновления
+        self.queries = []  # SQL-запросов на обновление
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    # Обёртка над функцией обработки обновления для диспетчера
+    def measure(self, process):
+        def measured(update):
+            counter = [0]
+
+            def count(execute, sql, params, many, context):
+                counter[0] += 1
+                return execute(sql, params, many, context)
+
+            started = time.perf_counter()
+            failed = False
+            try:
+                with connection.execute_wrapper(count):
+                    process(update)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self.latencies.append(elapsed)
+                    self.queries.append(counter[0])
+                    self.errors += failed
+
+        return measured
+
+
+# ----------- Имитация пользователя ----------- #
+class SimulatedUser:
+    def __init__(self, api: FakeBotApi, chat_id: int, options: dict, rng: random.Random):
+        self.api = api
+        self.chat_id = chat_id
+        self.options = options
+        self.rng = rng
+        self.user = {"id": chat_id, "is_bot": False, "first_name": "Load", "last_name": str(chat_id),
+                     "username": f"load{chat_id}"}
+        self.chat = {"id": chat_id, "type": "private"}
+        self.message_ids = itertools.count(1)
+        self.response_times = []  # от отправки обновления до ответа бота с клавиатурой
+        self.timeouts = 0
+        self.feedback_submitted = 0
+
+    def run(self, deadline: float):
+        while time.monotonic() < deadline:
+            menu = self.send_text("/start")
+            if menu is None:
+                continue
+            for _ in range(self.rng.randint(1, self.options["max_depth"])):
+                menu = self.click_random(menu)
+                if menu is None or time.monotonic() >= deadline:
+                    break
+            if menu is not None and self.rng.random() < self.options["feedback_share"]:
+                self.fill_feedback()
+
+    # ----- действия ----- #
+    def send_text(self, text):
+        return self._act(message=self._message(text=text))
+
+    def send_document(self, file_name, content):
+        file_id = self.api.add_file(content)
+        document = {"file_id": file_id, "file_unique_id": file_id, "file_name": file_name, "file_size": len(content)}
+        return self._act(message=self._message(document=document))
+
+    def click(self, message, data):
+        return self._act(callback_query={
+            "id": f"{self.chat_id}-{next(self.message_ids)}",
+            "from": self.user,
+            "chat_instance": str(self.chat_id),
+            "message": message,
+            "data": data,
+        })
+
+    def click_random(self, menu):
+        buttons = [button for row in menu["reply_markup"]["inline_keyboard"] for button in row]
+        return self.click(menu, self.rng.choice(buttons)["callback_data"])
+
+    def fill_feedback(self):
+        from tenders_bot.feedback import messages
+
+        feedback_node_id = self.options["feedback_node_id"]
+        if feedback_node_id is None:
+            return
+        prompt = self.click(self._menu_stub(), f"nav:{feedback_node_id}|f")
+        answers = {text: field for field, text in messages.items()}
+        while prompt is not None:
+            field = answers.get(prompt.get("text"))
+            if field is None:
+                return  # форма закончилась или бот ответил неожиданно
+            if field == "files":
+                for number in range(self.options["attachments"]):
+                    content = self.rng.randbytes(self.options["attachment_size"])
+                    self.send_document(f"attachment{number}.pdf", content)
+                if self.click(prompt, "submit_feedback") is not None:
+                    self.feedback_submitted += 1
+                return
+            prompt = self.send_text(f"{field} of {self.chat_id}")
+
+    # ----- служебное ----- #
+    def _message(self, **fields):
+        return {"message_id": next(self.message_ids), "date": int(time.time()), "chat": self.chat,
+                "from": self.user, **fields}
+
+    # Сообщение бота, на кнопку которого "нажимают", когда переходят к форме напрямую
+    def _menu_stub(self):
+        return {"message_id": next(self.message_ids), "date": int(time.time()), "chat": self.chat, "text": "menu"}
+
+    # Отправить обновление и дождаться ответа бота с клавиатурой (меню или поле формы)
+    def _act(self, **fields):
+        time.sleep(self.rng.uniform(0, 2 * self.options["think_time"]))
+        inbox = self.api.inbox(self.chat_id)
+        sent_at = time.monotonic()
+        self.api.push_update(**fields)
+        timeout = self.options["response_timeout"]
+        while True:
+            try:
+                received_at, message = inbox.get(timeout=max(0.0, sent_at + timeout - time.monotonic()))
+            except queue.Empty:
+                self.timeouts += 1
+                return None
+            if "reply_markup" in message:
+                self.response_times.append(received_at - sent_at)
+                return message
+
+
+# ----------- Запуск ----------- #
+def run_load_test(
+    users: int = 10,
+    duration: float = 60,
+    think_time: float = 0.5,
+    feedback_share: float = 0.3,
+    attachments: int = 1,
+    attachment_size: int = 100 * 1024,
+    max_depth: int = 3,
+    response_timeout: float = 30,
+    rate_limits: bool = False,
+    keep_data: bool = False,
+    seed: Optional[int] = None,
+) -> dict:
+    from tenders_bot.dispatcher import UpdateDispatcher, run_polling
+    from tenders_bot.node_tree import get_node_tree
+    from tenders_bot.outbound import scheduler
+    from tenders_bot.settings import TELEBOT_NUM_THREADS, UPDATE_QUEUE_SIZE
+    from tenders_bot.telegram import bot, process_update
+
+    tree = get_node_tree()
+    feedback_node_id = next((node.id for node in tree if node.input_function == "feedback"), None)
+    options = {
+        "think_time": think_time, "feedback_share": feedback_share, "attachments": attachments,
+        "attachment_size": attachment_size, "max_depth": max_depth, "response_timeout": response_timeout,
+        "feedback_node_id": feedback_node_id,
+    }
+
+    api = FakeBotApi()
+    api.start()
+    previous_urls = api.patch_urls()
+    previous_rates = scheduler.rates()
+    if not rate_limits:
+        # Меряем сам бот, а не лимиты Telegram
+        scheduler.set_rates(global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+
+    stats = UpdateStats()
+    dispatcher = UpdateDispatcher(stats.measure(process_update), num_workers=TELEBOT_NUM_THREADS)
+    stop_polling = threading.Event()
+    polling = threading.Thread(
+        target=run_polling, args=(bot, dispatcher, stop_polling), kwargs={"long_polling_timeout": 1}, daemon=True
+    )
+
+    rng = random.Random(seed)
+    simulated = [
+        SimulatedUser(api, CHAT_ID_BASE + number, options, random.Random(rng.random())) for number in range(users)
+    ]
+    started = time.monotonic()
+    deadline = started + duration
+    threads = [threading.Thread(target=user.run, args=(deadline,), daemon=True) for user in simulated]
+    try:
+        polling.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stop_polling.set()
+        polling.join()
+        dispatcher.join()
+        elapsed = time.monotonic() - started
+    finally:
+        stop_polling.set()
+        dispatcher.stop(timeout=5)
+        FakeBotApi.restore_urls(previous_urls)
+        scheduler.set_rates(**previous_rates)
+        api.stop()
+        if not keep_data:
+            cleanup([user.chat_id for user in simulated])
+
+    latencies = sorted(stats.latencies)
+    queries = sorted(stats.queries)
+    response_times = sorted(itertools.chain.from_iterable(user.response_times for user in simulated))
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        "users": users,
+        "duration_s": round(elapsed, 2),
+        "workers": TELEBOT_NUM_THREADS,
+        "queue_size": UPDATE_QUEUE_SIZE,
+        "rate_limits": rate_limits,
+        "updates": len(latencies),
+        "errors": stats.errors,
+        "timeouts": sum(user.timeouts for user in simulated),
+        "feedback_submitted": sum(user.feedback_submitted for user in simulated),
+        "throughput_updates_per_s": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(latencies[-1] if latencies else None),
+        },
+        "response_time_ms": {
+            "p50": ms(percentile(response_times, 50)),
+            "p95": ms(percentile(response_times, 95)),
+            "p99": ms(percentile(response_times, 99)),
+        },
+        "db_queries_per_update": {
+            "mean": round(sum(queries) / len(queries), 2) if queries else None,
+            "p95": percentile(queries, 95),
+            "max": queries[-1] if queries else None,
+        },
+        "api_calls": dict(sorted(api.calls.items())),
+    }
+
+
+# Удаляем всё, что создали имитируемые пользователи
+def cleanup(chat_ids):
+    from tenders_bot.drafts import drafts
+    from tenders_bot.models import Feedback
+    from tenders_bot.user_state import user_states
+
+    # Файлы удалятся после коммита (см. tenders_bot.retention), общее с другими обращениями содержимое останется
+    Feedback.objects.filter(telegram_chat_id__in=chat_ids).delete()
+    for chat_id in chat_ids:
+        drafts.discard(chat_id)
+        user_states.delete(chat_id)
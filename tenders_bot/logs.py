@@ -0,0 +1,135 @@
+# Логирование без задержек на горячем пути
+# Обработчик лишь кладёт запись в очередь (QueueingHandler), форматирование и запись в поток выполняет
+# отдельный поток QueueListener. Если очередь переполнена, запись выбрасывается, а не блокирует обработчик.
+# Записи одного шаблона ниже WARNING ограничиваются по частоте (RateLimitFilter) - поэтому логируем
+# лениво, logger.info("Sent %s emails", n): шаблон сообщения служит ключом, а строка собирается только
+# для тех записей, что пройдут по уровню. К записям добавляется контекст обновления (chat_id,
+# update_id, handler), который выставляют диспетчер и observe_handler через log_context
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+_context: ContextVar[dict] = ContextVar("log_context", default={})
+
+# Сколько записей выброшено: переполнение очереди и ограничение частоты
+dropped = {"queue_full": 0, "rate_limited": 0}
+
+
+# Добавить поля к контексту записей на время блока (вложенные блоки дополняют контекст)
+@contextmanager
+def log_context(**fields):
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        record.context = _context.get()
+        return True
+
+
+# Не больше rate записей в секунду (с запасом burst) на каждый шаблон сообщения. Предупреждения и
+# ошибки не ограничиваются. Сколько записей пропущено, сообщается в поле suppressed следующей записи
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate: float = 10, burst: float = 20, max_keys: int = 1000):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}  # (логгер, шаблон) -> [токены, время пополнения, пропущено]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._buckets.clear()
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                dropped["rate_limited"] += 1
+                return False
+            bucket[0] -= 1
+            record.suppressed, bucket[2] = bucket[2], 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+            **getattr(record, "context", {}),
+        }
+        if getattr(record, "suppressed", 0):
+            data["suppressed"] = record.suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+# Обработчик для dictConfig: записи уходят в очередь, в поток stream (или в файл filename с ротацией
+# по max_bytes) их пишет поток-слушатель. Форматтер и уровень, заданные в конфигурации, применяются при записи
+class QueueingHandler(QueueHandler):
+    def __init__(self, stream=None, queue_size: int = 10000, filename=None, max_bytes: int = 0, backup_count: int = 0):
+        super().__init__(queue.Queue(queue_size))
+        if filename:
+            os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+            self.target = RotatingFileHandler(
+                filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True
+            )
+        else:
+            self.target = logging.StreamHandler(stream)
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    # Сообщение собираем в вызывающем потоке (аргументы могут измениться после вызова логгера),
+    # трассировку исключения - тоже, чтобы не держать в очереди ссылки на кадры стека
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped["queue_full"] += 1
+
+    # Дописать то, что уже в очереди (при остановке процесса logging.shutdown закрывает обработчики)
+    def close(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+        self.target.close()
+        super().close()
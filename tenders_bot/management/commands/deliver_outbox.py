@@ -0,0 +1,32 @@
+# Отдельный процесс отправки писем из очереди OutboxEmail
+# python manage.py deliver_outbox [--once]
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from tenders_bot.outbox import deliver_batch, run_outbox_worker
+from tenders_bot.settings import OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL
+from tenders_bot.smtp_pool import smtp_pool
+
+
+class Command(BaseCommand):
+    help = "Отправляет письма из очереди обращений"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Отправить одну пачку писем и завершиться")
+        parser.add_argument("--batch-size", type=int, default=OUTBOX_BATCH_SIZE)
+        parser.add_argument("--interval", type=float, default=OUTBOX_POLL_INTERVAL)
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            sent = deliver_batch(options["batch_size"])
+            smtp_pool.close_all()
+            self.stdout.write(f"Sent {sent} emails")
+            return
+
+        # Завершаемся по Ctrl+C / SIGTERM после текущей пачки
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+        signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+        run_outbox_worker(stop_event, options["interval"], options["batch_size"])
@@ -0,0 +1,55 @@
+# Выгрузка отправленных обращений за период
+# python manage.py export_feedback --from 2026-01-01 --to 2026-03-31 --output feedback.csv
+import datetime
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from tenders_bot import export
+from tenders_bot.models import Feedback
+
+
+def parse_date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date {value}, expected YYYY-MM-DD")
+
+
+class Command(BaseCommand):
+    help = "Выгружает обращения за период в CSV или XLSX"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="date_from", type=parse_date, help="Начало периода включительно")
+        parser.add_argument("--to", dest="date_to", type=parse_date, help="Конец периода включительно")
+        parser.add_argument("--format", choices=["csv", "xlsx"], default="csv")
+        parser.add_argument("--output", help="Файл для выгрузки (по умолчанию CSV пишется в stdout)")
+        parser.add_argument("--unprocessed", action="store_true", help="Только необработанные обращения")
+
+    def handle(self, *args, **options):
+        queryset = Feedback.objects.filter(submitted=True)
+        # Границы периода - в часовом поясе проекта
+        if options["date_from"]:
+            start = datetime.datetime.combine(options["date_from"], datetime.time.min)
+            queryset = queryset.filter(created_at__gte=timezone.make_aware(start))
+        if options["date_to"]:
+            end = datetime.datetime.combine(options["date_to"] + datetime.timedelta(days=1), datetime.time.min)
+            queryset = queryset.filter(created_at__lt=timezone.make_aware(end))
+        if options["unprocessed"]:
+            queryset = queryset.filter(processed=False)
+
+        if options["format"] == "xlsx":
+            if export.openpyxl is None:
+                raise CommandError("XLSX export requires openpyxl, install it or use --format csv")
+            if not options["output"]:
+                raise CommandError("--output is required for XLSX")
+            with open(options["output"], "wb") as output:
+                count = export.write_xlsx(queryset, output)
+        elif options["output"]:
+            with open(options["output"], "w", encoding="utf-8", newline="") as output:
+                count = export.write_csv(queryset, output)
+        else:
+            count = export.write_csv(queryset, sys.stdout)
+
+        self.stderr.write(f"Exported {count} feedback")
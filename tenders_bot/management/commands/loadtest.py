@@ -0,0 +1,44 @@
+# Нагрузочный тест бота на локальном имитаторе Telegram Bot API
+# python manage.py loadtest --users 50 --duration 120 --output loadtest.json
+# Имитируемые пользователи пишут в ту же базу и хранилище, что и бот, поэтому запускать на стенде, а не в проде
+import json
+
+from django.core.management.base import BaseCommand
+
+from tenders_bot.loadtest import run_load_test
+
+
+class Command(BaseCommand):
+    help = "Нагрузочный тест: имитируемые пользователи ходят по дереву и заполняют обращения"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10, help="Сколько пользователей одновременно")
+        parser.add_argument("--duration", type=float, default=60, help="Длительность, секунд")
+        parser.add_argument("--think-time", type=float, default=0.5, help="Средняя пауза пользователя, секунд")
+        parser.add_argument("--feedback-share", type=float, default=0.3, help="Доля сессий с обращением")
+        parser.add_argument("--attachments", type=int, default=1, help="Файлов в обращении")
+        parser.add_argument("--attachment-kb", type=int, default=100, help="Размер файла, Кб")
+        parser.add_argument("--max-depth", type=int, default=3, help="Сколько кнопок нажимать за сессию")
+        parser.add_argument("--rate-limits", action="store_true", help="Соблюдать лимиты исходящих сообщений")
+        parser.add_argument("--keep-data", action="store_true", help="Не удалять созданные обращения")
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument("--output", default=None, help="Файл для результата в JSON")
+
+    def handle(self, *args, **options):
+        result = run_load_test(
+            users=options["users"],
+            duration=options["duration"],
+            think_time=options["think_time"],
+            feedback_share=options["feedback_share"],
+            attachments=options["attachments"],
+            attachment_size=options["attachment_kb"] * 1024,
+            max_depth=options["max_depth"],
+            rate_limits=options["rate_limits"],
+            keep_data=options["keep_data"],
+            seed=options["seed"],
+        )
+        report = json.dumps(result, indent=2, ensure_ascii=False)
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                output.write(report)
+        self.stdout.write(report)
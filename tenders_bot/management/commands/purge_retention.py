@@ -0,0 +1,49 @@
+# Удаление брошенных черновиков, старых вложений, истёкших состояний пользователей и файлов без строки в базе
+# python manage.py purge_retention --dry-run
+# Запускать по расписанию (cron/systemd timer), например раз в сутки
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+
+from tenders_bot import retention
+from tenders_bot.settings import ATTACHMENT_RETENTION_DAYS, DRAFT_RETENTION_DAYS, RETENTION_BATCH_SIZE, USER_STATE_TTL
+
+
+class Command(BaseCommand):
+    help = "Удаляет неотправленные черновики и вложения старше срока хранения вместе с файлами"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Только посчитать, ничего не удаляя")
+        parser.add_argument("--draft-days", type=int, default=DRAFT_RETENTION_DAYS)
+        parser.add_argument(
+            "--attachment-days", type=int, default=ATTACHMENT_RETENTION_DAYS, help="0 - вложения не удалять"
+        )
+        parser.add_argument("--orphans", action="store_true", help="Удалить файлы загрузок, которых нет в базе")
+        parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        self.dry_run = dry_run = options["dry_run"]
+        batch_size = options["batch_size"]
+        total = 0
+
+        if options["draft_days"] > 0:
+            cutoff = now - timedelta(days=options["draft_days"])
+            total += self.report("drafts", retention.purge_drafts(cutoff, batch_size, dry_run))
+        if options["attachment_days"] > 0:
+            cutoff = now - timedelta(days=options["attachment_days"])
+            total += self.report("attachments", retention.purge_attachments(cutoff, batch_size, dry_run))
+        cutoff = now - timedelta(seconds=USER_STATE_TTL)
+        total += self.report("chat states", retention.purge_chat_states(cutoff, batch_size, dry_run))
+        if options["orphans"]:
+            total += self.report("orphan files", retention.purge_orphan_files(batch_size, dry_run))
+
+        verb = "Would reclaim" if dry_run else "Reclaimed"
+        self.stdout.write(f"{verb} {filesizeformat(total)} ({total} bytes)")
+
+    def report(self, what, result: retention.PurgeResult) -> int:
+        verb = "Would delete" if self.dry_run else "Deleted"
+        self.stdout.write(f"{verb} {result.rows} {what} ({result.files} files, {filesizeformat(result.bytes)})")
+        return result.bytes
@@ -0,0 +1,87 @@
+# Запуск Telegram-бота отдельным процессом, без веб-сервера
+# python manage.py runbot [--with-outbox]
+# Для работы вместе с runserver выставить TELEGRAM_BOT_IN_RUNSERVER=False, чтобы бот не запускался дважды
+import logging
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from tenders_bot.settings import TELEGRAM_BOT_ENGINE, TELEGRAM_BOT_MODE
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Запускает Telegram-бота в режиме polling"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--with-outbox", action="store_true", help="Отправлять письма из очереди в этом же процессе",
+        )
+        parser.add_argument(
+            "--drain-timeout", type=float, default=30,
+            help="Сколько секунд при остановке ждать обработки уже полученных обновлений",
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if TELEGRAM_BOT_MODE != "polling":
+            raise CommandError("runbot works only with TELEGRAM_BOT_MODE=polling, webhook updates are served by Django")
+
+        # Бот создаётся при импорте модуля, поэтому импортируем его только здесь, а не в веб-процессах
+        from tenders_bot.apps import setup_node_tree
+        from tenders_bot.drafts import drafts
+        from tenders_bot.outbox import run_outbox_worker
+        from tenders_bot.telegram import dispatcher, telegram_bot_main
+
+        polling_kwargs = {}
+        if TELEGRAM_BOT_ENGINE == "asyncio":
+            from tenders_bot.async_bot import AsyncTeleBot, telegram_bot_main_async
+
+            if AsyncTeleBot is None:
+                raise CommandError("TELEGRAM_BOT_ENGINE=asyncio requires aiohttp: pip install -r requirements-async.txt or use threads")
+            telegram_bot_main = telegram_bot_main_async
+            polling_kwargs["drain_timeout"] = options["drain_timeout"]
+        elif TELEGRAM_BOT_ENGINE != "threads":
+            raise CommandError(f"Unknown TELEGRAM_BOT_ENGINE: {TELEGRAM_BOT_ENGINE}")
+
+        setup_node_tree(fix_paths=False)  # только чтение: пути поддерживает Node.save
+
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+        signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+
+        threads = [
+            threading.Thread(
+                target=telegram_bot_main, kwargs={"stop_event": stop_event, **polling_kwargs}, name="polling"
+            )
+        ]
+        if options["with_outbox"]:
+            threads.append(threading.Thread(target=run_outbox_worker, args=(stop_event,), name="outbox"))
+        for thread in threads:
+            thread.start()
+        dispatcher.start()
+        logger.info("Bot started in %.2fs", time.monotonic() - started)
+
+        # Ждём сигнала в главном потоке (обработчики сигналов выполняются только в нём)
+        while not stop_event.wait(1):
+            pass
+
+        logger.info("Stopping bot, waiting for in-flight updates")
+        for thread in threads:
+            thread.join()
+        running = dispatcher.stop(timeout=options["drain_timeout"])
+        if running:
+            # Эти потоки ещё меняют черновики своих чатов: сохранять их сейчас нельзя, изменения теряются
+            logger.error(
+                "%s dispatcher threads did not stop in %ss, drafts of their chats are not saved",
+                len(running), options["drain_timeout"],
+            )
+        saved = drafts.flush_all(lambda chat_id: dispatcher.chat_shard(chat_id) not in running)
+        if saved:
+            logger.info("Saved %s feedback drafts", saved)
+        connections.close_all()
+        logger.info("Bot stopped")
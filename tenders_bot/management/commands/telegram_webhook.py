@@ -0,0 +1,38 @@
+# Установка и снятие webhook в Telegram
+# python manage.py telegram_webhook set     - Telegram начнёт присылать обновления на TELEGRAM_WEBHOOK_URL
+# python manage.py telegram_webhook delete  - вернуться к режиму polling
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from tenders_bot.settings import TELEBOT_NUM_THREADS, TELEGRAM_WEBHOOK_SECRET, TELEGRAM_WEBHOOK_URL
+
+
+class Command(BaseCommand):
+    help = "Устанавливает или снимает webhook Telegram-бота"
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["set", "delete", "info"])
+        parser.add_argument(
+            "--max-connections", type=int, default=TELEBOT_NUM_THREADS,
+            help="Сколько одновременных соединений Telegram может открыть к webhook",
+        )
+
+    def handle(self, *args, **options):
+        from tenders_bot.telegram import bot
+
+        if options["action"] == "delete":
+            bot.remove_webhook()
+            self.stdout.write("Webhook removed")
+        elif options["action"] == "info":
+            self.stdout.write(str(bot.get_webhook_info().__dict__))
+        else:
+            if not TELEGRAM_WEBHOOK_URL or not TELEGRAM_WEBHOOK_SECRET:
+                raise CommandError("TELEGRAM_WEBHOOK_URL and TELEGRAM_WEBHOOK_SECRET must be set")
+            url = TELEGRAM_WEBHOOK_URL.rstrip("/") + reverse("telegram_webhook")
+            bot.set_webhook(
+                url,
+                secret_token=TELEGRAM_WEBHOOK_SECRET,
+                max_connections=options["max_connections"],
+                allowed_updates=["message", "callback_query"],
+            )
+            self.stdout.write(f"Webhook set to {url}")
@@ -0,0 +1,127 @@
+# Раздача файлов из MEDIA_ROOT (вложения обращений, файлы узлов) только сотрудникам
+# Django проверяет права и условные заголовки (ETag/Last-Modified), а сами байты по возможности
+# отдаёт веб-сервер: nginx по X-Accel-Redirect, Apache/lighttpd по X-Sendfile. Без веб-сервера
+# файл отдаётся через FileResponse: WSGI-сервер с wsgi.file_wrapper (gunicorn, uWSGI) передаёт его
+# через sendfile без копирования в Python. Поддерживается запрос диапазона байт (Range)
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from tenders_bot.settings import MEDIA_ACCEL_PREFIX, MEDIA_ROOT, MEDIA_SERVER
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+# Содержимое загрузок хранится по sha256 (см. tenders_bot.blobs) и под тем же именем не меняется
+IMMUTABLE_PREFIX = "user_uploads/blobs/"
+
+
+# Файл, из которого читается только диапазон байт. fileno() нужен wsgi.file_wrapper для sendfile:
+# он начинает с текущей позиции файла и передаёт столько байт, сколько указано в Content-Length
+class _FileRange:
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.name = file.name
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+# Диапазон из заголовка Range: (начало, длина), None - отдать файл целиком, ValueError - диапазон
+# за пределами файла. Несколько диапазонов сразу не поддерживаем и отдаём файл целиком
+def parse_range(header, size):
+    match = RANGE_PATTERN.match(header or "")
+    if match is None or match.groups() == ("", ""):
+        return None
+    start, end = match.groups()
+    if start == "":  # последние N байт
+        length = min(int(end), size)
+        if length == 0:
+            raise ValueError(f"Range {header} is not satisfiable for {size} bytes")
+        return size - length, length
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or end < start:
+        raise ValueError(f"Range {header} is not satisfiable for {size} bytes")
+    return start, end - start + 1
+
+
+def _etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+@require_safe
+@staff_member_required
+def media_view(request, path):
+    try:
+        full_path = safe_join(MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (OSError, SuspiciousFileOperation):  # SuspiciousFileOperation - путь за пределами MEDIA_ROOT
+        raise Http404("File not found")
+    if not os.path.isfile(full_path):
+        raise Http404("File not found")
+
+    etag = _etag(stat)
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _file_response(request, path, full_path, stat.st_size, etag, last_modified)
+    response.headers.setdefault("ETag", etag)
+    response.headers.setdefault("Last-Modified", http_date(last_modified))
+    if path.startswith(IMMUTABLE_PREFIX):
+        patch_cache_control(response, private=True, max_age=365 * 24 * 60 * 60, immutable=True)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _file_response(request, path, full_path, size, etag, last_modified):
+    if MEDIA_SERVER == "nginx":
+        response = HttpResponse(content_type=mimetypes.guess_type(path)[0] or "application/octet-stream")
+        response["X-Accel-Redirect"] = MEDIA_ACCEL_PREFIX + quote(path)
+        return response
+    if MEDIA_SERVER == "sendfile":
+        response = HttpResponse(content_type=mimetypes.guess_type(path)[0] or "application/octet-stream")
+        response["X-Sendfile"] = full_path
+        return response
+
+    # Диапазон отдаём, только если файл не изменился с тех пор, как клиент получил его начало
+    if_range = request.headers.get("If-Range")
+    byte_range = None
+    if if_range is None or if_range in (etag, http_date(last_modified)):
+        try:
+            byte_range = parse_range(request.headers.get("Range"), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    file = open(full_path, "rb")
+    if byte_range is None:
+        response = FileResponse(file)
+    else:
+        start, length = byte_range
+        response = FileResponse(_FileRange(file, start, length), status=206)
+        response["Content-Length"] = str(length)
+        response["Content-Range"] = f"bytes {start}-{start + length - 1}/{size}"
+    response["Accept-Ranges"] = "bytes"
+    return response
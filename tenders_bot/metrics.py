@@ -0,0 +1,282 @@
+# Метрики бота в формате Prometheus (отдаются по /metrics, см. metrics_view)
+# Своя небольшая реализация без внешних зависимостей: счётчик и гистограмма - это пара
+# словарей под блокировкой, поэтому их можно держать включёнными постоянно.
+# Значения живут в памяти процесса; при нескольких процессах Prometheus опрашивает каждый
+import abc
+import functools
+import hmac
+import inspect
+import ipaddress
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Tuple
+
+from django.http import HttpResponse, HttpResponseForbidden
+
+from tenders_bot.logs import dropped, log_context
+from tenders_bot.settings import METRICS_TOKEN
+from tenders_bot.tracing import CLIENT, span
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин гистограмм по умолчанию, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REGISTRY = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# Значения меток выводятся строками, сортируем так же: метка может быть то числом, то строкой
+def _sort_key(item) -> tuple:
+    return tuple(map(str, item[0]))
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(abc.ABC):
+    type = None
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+    @abc.abstractmethod
+    def samples(self):
+        pass
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items(), key=_sort_key)
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+        self._values: Dict[tuple, list] = {}  # ключ -> [счётчики по корзинам..., сумма, количество]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                item = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            item[index] += 1
+            item[-2] += value
+            item[-1] += 1
+
+    # Замерить время выполнения блока: with HISTOGRAM.time(label=...):
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def count(self, **labels) -> int:
+        item = self._values.get(self._key(labels))
+        return item[-1] if item else 0
+
+    def samples(self):
+        with self._lock:
+            values = sorted(((key, list(item)) for key, item in self._values.items()), key=_sort_key)
+        for key, item in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), item):
+                cumulative += count
+                labels = _format_labels(self.labelnames + ("le",), key + (_format_value(bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(item[-2])}"
+            yield f"{self.name}_count{labels} {item[-1]}"
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+# Значение, которое вычисляется в момент опроса (размер очереди, число состояний и т.п.)
+# callback возвращает число или словарь {кортеж значений меток: число}
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name, help_text, callback: Callable, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.callback = callback
+
+    def samples(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+# ----------- Метрики ----------- #
+HANDLER_SECONDS = Histogram("tenders_bot_handler_seconds", "Handler run time", ("handler",))
+HANDLER_ERRORS = Counter("tenders_bot_handler_errors_total", "Handler exceptions", ("handler",))
+
+UPDATE_SECONDS = Histogram("tenders_bot_update_seconds", "Update processing time")
+UPDATE_DB_QUERIES = Histogram(
+    "tenders_bot_update_db_queries", "DB queries per update", buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+)
+UPDATE_LAG = Histogram(
+    "tenders_bot_update_lag_seconds", "Time from the message date in Telegram to dispatch",
+    buckets=(0.5, 1, 2, 5, 10, 30, 60, 300),
+)
+UPDATE_QUEUE_SECONDS = Histogram("tenders_bot_update_queue_seconds", "Time an update waits in the dispatcher queue")
+
+TELEGRAM_REQUESTS = Counter(
+    "tenders_bot_telegram_requests_total", "Telegram Bot API requests by HTTP status", ("method", "status")
+)
+TELEGRAM_SECONDS = Histogram("tenders_bot_telegram_request_seconds", "Telegram Bot API request time", ("method",))
+TELEGRAM_RETRIES = Counter(
+    "tenders_bot_telegram_retries_total", "Telegram Bot API requests repeated by the transport", ("method", "reason")
+)
+
+SMTP_SECONDS = Histogram("tenders_bot_smtp_send_seconds", "SMTP send time per email")
+SMTP_FAILURES = Counter("tenders_bot_smtp_failures_total", "Emails that failed to send")
+SMTP_CONNECTIONS_OPENED = Counter("tenders_bot_smtp_connections_opened_total", "SMTP connections opened")
+
+DB_CONNECTION_WAIT_SECONDS = Histogram(
+    "tenders_bot_db_connection_wait_seconds", "Time to get a usable DB connection before an update",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 10),
+)
+DB_CONNECTIONS_OPENED = Counter("tenders_bot_db_connections_opened_total", "DB connections opened")
+
+DISPATCHER_BUSY_SECONDS = Counter(
+    "tenders_bot_dispatcher_busy_seconds_total", "Time dispatcher workers spent processing updates"
+)
+LOG_RECORDS_DROPPED = Gauge(
+    "tenders_bot_log_records_dropped", "Log records dropped since start (queue full or rate limited)",
+    lambda: {(reason,): count for reason, count in dropped.items()}, ("reason",),
+)
+
+
+# Декоратор для обработчиков бота: время выполнения и исключения по имени обработчика
+# (обработчики движка asyncio - корутины)
+def observe_handler(func):
+    name = func.__name__
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with log_context(handler=name):
+                    return await func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            with log_context(handler=name):
+                return func(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+    return wrapper
+
+
+# Отправитель запросов для telebot (apihelper.CUSTOM_REQUEST_SENDER), который считает запросы к Bot API
+def instrumented_request_sender(send: Callable) -> Callable:
+    def sender(method, url, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            with span(f"telegram.{api_method}", CLIENT) as current:
+                response = send(method, url, **kwargs)
+                if current is not None:
+                    current.set_attribute("http.status_code", response.status_code)
+        except Exception as e:
+            TELEGRAM_REQUESTS.inc(method=api_method, status=type(e).__name__)
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started, method=api_method)
+        TELEGRAM_REQUESTS.inc(method=api_method, status=str(response.status_code))
+        return response
+
+    return sender
+
+
+# С METRICS_TOKEN - только по токену, без него - сотрудникам и запросам с этой же машины
+def metrics_allowed(request) -> bool:
+    if METRICS_TOKEN:
+        expected = f"Bearer {METRICS_TOKEN}"
+        return hmac.compare_digest(request.headers.get("Authorization", ""), expected)
+    if request.user.is_active and request.user.is_staff:
+        return True
+    try:
+        return ipaddress.ip_address(request.META.get("REMOTE_ADDR", "")).is_loopback
+    except ValueError:
+        return False
+
+
+def metrics_view(request):
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.15 on 2026-10-17 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenders_bot', '0002_alter_feedback_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodeTreeVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-17 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenders_bot', '0003_nodetreeversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='telegram_file_id',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+    ]
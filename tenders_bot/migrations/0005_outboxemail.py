@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-17 20:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenders_bot', '0004_file_telegram_file_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PENDING', 'Ожидает отправки'), ('SENT', 'Отправлено'), ('DEAD', 'Не удалось отправить')], default='PENDING', max_length=20, verbose_name='Статус')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Попыток отправки')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Следующая попытка')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='Последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Поставлено в очередь')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Отправлено')),
+                ('feedback', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='emails', to='tenders_bot.feedback', verbose_name='Обращение')),
+            ],
+            options={
+                'verbose_name': 'письмо',
+                'verbose_name_plural': 'очередь писем',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='tenders_bot_status_c02281_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.15 on 2026-10-17 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenders_bot', '0005_outboxemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatState',
+            fields=[
+                ('chat_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('return_to_node_id', models.BigIntegerField(null=True)),
+                ('entering_feedback', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
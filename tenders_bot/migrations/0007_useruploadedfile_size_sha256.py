@@ -0,0 +1,35 @@
+# Generated by Django 5.1.15 on 2026-10-17 20:02
+
+from django.db import migrations, models
+
+
+# Заполняем размер уже загруженных файлов (отсутствующие на диске файлы считаем нулевыми)
+def fill_sizes(apps, schema_editor):
+    UserUploadedFile = apps.get_model('tenders_bot', 'UserUploadedFile')
+    for uploaded_file in UserUploadedFile.objects.filter(size__isnull=True).iterator():
+        try:
+            uploaded_file.size = uploaded_file.file.size
+        except OSError:
+            uploaded_file.size = 0
+        uploaded_file.save(update_fields=['size'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenders_bot', '0006_chatstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useruploadedfile',
+            name='sha256',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='useruploadedfile',
+            name='size',
+            field=models.PositiveBigIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_sizes, migrations.RunPython.noop),
+    ]
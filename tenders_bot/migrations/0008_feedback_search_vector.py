@@ -0,0 +1,42 @@
+# Generated by Django 5.1.15 on 2026-10-17 20:04
+
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+# GIN-индекс и заполнение индекса для уже отправленных обращений - только в PostgreSQL
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS tenders_bot_feedback_search_gin '
+        'ON tenders_bot_feedback USING gin (search_vector)'
+    )
+    Feedback = apps.get_model('tenders_bot', 'Feedback')
+    Feedback.objects.filter(submitted=True).update(
+        search_vector=SearchVector('company', weight='A', config='russian')
+        + SearchVector('inn', 'name', 'email', 'contact_number', 'telegram_username', weight='B', config='russian')
+        + SearchVector('text', weight='C', config='russian')
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS tenders_bot_feedback_search_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenders_bot', '0007_useruploadedfile_size_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feedback',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
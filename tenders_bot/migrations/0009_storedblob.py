@@ -0,0 +1,36 @@
+# Generated by Django 5.1.15 on 2026-10-17 20:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenders_bot', '0008_feedback_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(upload_to='user_uploads/blobs/')),
+                ('size', models.PositiveBigIntegerField()),
+                ('telegram_file_unique_id', models.CharField(blank=True, db_index=True, max_length=255, null=True)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='useruploadedfile',
+            name='name',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='Имя файла'),
+        ),
+        migrations.AddField(
+            model_name='useruploadedfile',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='uploads', to='tenders_bot.storedblob'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-17 21:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenders_bot', '0009_storedblob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='feedback',
+            name='telegram_chat_id',
+            field=models.BigIntegerField(null=True, verbose_name='ID чата в Telegram'),
+        ),
+    ]
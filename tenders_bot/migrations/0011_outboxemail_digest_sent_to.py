@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-17 21:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenders_bot', '0010_feedback_telegram_chat_id_bigint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxemail',
+            name='digest_sent_to',
+            field=models.JSONField(blank=True, default=list, verbose_name='Дайджест отправлен группам'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.15 on 2026-10-17 21:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenders_bot', '0012_feedback_created_at_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatstate',
+            index=models.Index(fields=['updated_at'], name='tenders_bot_updated_9fa8e5_idx'),
+        ),
+    ]
@@ -1,5 +1,17 @@
 # Импортируем базовый модуль моделей Django
-from django.db import models
+import os
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+
+# Путь узла по пути родителя (None - узел корневой)
+def join_path(parent_path, button_text):
+    if parent_path is None:
+        return button_text
+    return f"{parent_path} – {button_text}"
 
 # Модель Node - узел дерева меню чат-бота
 class Node(models.Model):
@@ -37,29 +49,77 @@ class Node(models.Model):
 
     # Переопределяем метод сохранения модели
     def save(self, *args, **kwargs):
+        is_new = self.pk is None
         self.update_path()
-        super(Node, self).save(*args, **kwargs)
+        with transaction.atomic():
+            super(Node, self).save(*args, **kwargs)
+            # У нового узла потомков нет, у существующего пересчитываем пути всего поддерева
+            if not is_new:
+                Node.recompute_paths(start=self)
 
     # Метод обновления path (используется для отображения структуры дерева)
     def update_path(self):
-        self.path = self.button_text
-        if self.parent_node is not None:
-            self.path = f"{self.parent_node.path} – {self.path}" # рекурсивное построение пути
-
-        # Рекурсивно обновляем путь у всех дочерних узлов
-        if self.pk is not None:
-            for node in self.child_nodes.only("id", "path", "parent_node", "button_text"):
-                node.save(update_fields=["path"])
+        parent_path = self.parent_node.path if self.parent_node is not None else None
+        self.path = join_path(parent_path, self.button_text)
+
+    # Пересчитываем пути в памяти по одной загрузке дерева и записываем изменившиеся одним bulk_update.
+    # start - узел с уже правильным path, от которого пересчитывается поддерево (по умолчанию всё дерево от корней).
+    # Возвращает число изменённых узлов
+    @classmethod
+    def recompute_paths(cls, start=None) -> int:
+        rows = list(cls.objects.order_by().values_list("id", "parent_node_id", "button_text", "path"))
+        children = defaultdict(list)
+        for row in rows:
+            children[row[1]].append(row)
+
+        if start is None:
+            stack = [(row, None) for row in children[None]]
+        else:
+            stack = [(row, start.path) for row in children[start.pk]]
+
+        changed = []
+        visited = set()
+        while stack:
+            (node_id, _, button_text, old_path), parent_path = stack.pop()
+            if node_id in visited:  # защита от циклов в данных
+                continue
+            visited.add(node_id)
+            path = join_path(parent_path, button_text)
+            if path != old_path:
+                changed.append(cls(id=node_id, path=path))
+            stack.extend((child, path) for child in children[node_id])
+
+        if changed:
+            cls.objects.bulk_update(changed, ["path"], batch_size=500)  # bulk_update сам выполняется в транзакции
+        return len(changed)
 
     # Представление узла в админ-панели
     def __str__(self):
         return self.path
 
+# Модель NodeTreeVersion — счётчик версии дерева узлов (одна строка)
+# По нему процессы бота узнают, что дерево изменили в админке, и перестраивают свой снимок
+class NodeTreeVersion(models.Model):
+    version = models.PositiveBigIntegerField(default=0)
+
+# Модель ChatState — состояние пользователя бота (см. tenders_bot.user_state.DatabaseUserStateStore)
+class ChatState(models.Model):
+    class Meta:
+        indexes = [models.Index(fields=["updated_at"])]  # подсчёт живых состояний и удаление истёкших
+
+    chat_id = models.BigIntegerField(primary_key=True)
+    return_to_node_id = models.BigIntegerField(null=True)
+    entering_feedback = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
 # Модель File — прикреплённые файлы к узлам (Node)
 class File(models.Model):
     node = models.ForeignKey(Node, on_delete=models.CASCADE, related_name="files")
     file = models.FileField(upload_to="nodes_content/")
 
+    # file_id, который вернул Telegram после первой загрузки файла; дальше файл отправляется по нему без загрузки
+    telegram_file_id = models.CharField(max_length=255, null=True, blank=True, editable=False)
+
     def __str__(self):
         return self.file.name
 
@@ -69,6 +129,8 @@ class Feedback(models.Model):
     class Meta:
         verbose_name = "обращение"
         verbose_name_plural = "обращения"
+        # Список в админке и переход по его страницам (см. tenders_bot.admin.KeysetChangeList)
+        indexes = [models.Index(fields=["-created_at", "-id"], name="feedback_created_at_id")]
 
     # Варианты типов обращения (оставляем только GENERAL в данном релизе, два других резервные на будущее расширение функционала)
     class FeedbackType(models.TextChoices):
@@ -80,7 +142,8 @@ class Feedback(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Время обращения")
 
     # Telegram ID чата и ID последнего отправленного ботом сообщения
-    telegram_chat_id = models.PositiveIntegerField(null=True, verbose_name="ID чата в Telegram")
+    # ID чатов Telegram не помещаются в 32 бита, у групп они отрицательные
+    telegram_chat_id = models.BigIntegerField(null=True, verbose_name="ID чата в Telegram")
     telegram_sent_message_id = models.PositiveIntegerField(null=True, verbose_name="ID сообщения в Telegram")
 
     # Информация о пользователе Telegram (если доступна)
@@ -115,8 +178,74 @@ class Feedback(models.Model):
     # Следующее поле для ввода в форме (техническое поле, для маршрутизации)
     next_field = models.CharField(max_length=255, null=True)
 
+    # Поисковый индекс для админки (tsvector + GIN, только в PostgreSQL), заполняется при отправке обращения
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # Содержимое поискового индекса: компания важнее остального, затем контакты, затем текст
+    SEARCH_VECTOR = (
+        SearchVector("company", weight="A", config="russian")
+        + SearchVector("inn", "name", "email", "contact_number", "telegram_username", weight="B", config="russian")
+        + SearchVector("text", weight="C", config="russian")
+    )
+
+    # Пересчитать поисковый индекс обращения (в других СУБД поиск идёт по полям напрямую)
+    def update_search_vector(self):
+        if connection.vendor == "postgresql":
+            Feedback.objects.filter(pk=self.pk).update(search_vector=Feedback.SEARCH_VECTOR)
+
+# Модель StoredBlob — содержимое загруженного пользователем файла
+# Одинаковые файлы из разных обращений хранятся на диске один раз (см. tenders_bot.blobs)
+class StoredBlob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to="user_uploads/blobs/")
+    size = models.PositiveBigIntegerField()
+    # file_unique_id из Telegram: по нему повторно присланный файл узнаётся без скачивания
+    telegram_file_unique_id = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+    # Число строк UserUploadedFile, которые ссылаются на содержимое; с последней ссылкой удаляется и файл
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.file.name
+
 # Модель UserUploadedFile — файлы, загруженные пользователем
 # Каждый файл связан с обращением Feedback (один ко многим)
 class UserUploadedFile(models.Model):
     feedback = models.ForeignKey(Feedback, on_delete=models.CASCADE, related_name="uploaded_files")
+    # Для новых загрузок file совпадает с blob.file, у загруженных раньше blob не заполнен
     file = models.FileField(upload_to="user_uploads/")
+    blob = models.ForeignKey(StoredBlob, null=True, blank=True, on_delete=models.PROTECT, related_name="uploads")
+    # Имя файла, под которым его прислал пользователь (имя в хранилище - по содержимому)
+    name = models.CharField(max_length=255, null=True, blank=True, verbose_name="Имя файла")
+    # Размер в байтах и sha256 считаются при загрузке, чтобы не обращаться к файлам на диске
+    size = models.PositiveBigIntegerField(null=True, editable=False)
+    sha256 = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
+    # Имя для письма, выгрузки и админки
+    @property
+    def display_name(self):
+        return self.name or os.path.basename(self.file.name)
+
+# Модель OutboxEmail — очередь писем об обращениях
+# Бот только ставит письмо в очередь, а отправляет его отдельный обработчик (см. tenders_bot.outbox)
+class OutboxEmail(models.Model):
+    class Meta:
+        verbose_name = "письмо"
+        verbose_name_plural = "очередь писем"
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+    class Status(models.TextChoices):
+        PENDING = "PENDING", "Ожидает отправки"
+        SENT = "SENT", "Отправлено"
+        DEAD = "DEAD", "Не удалось отправить"
+
+    feedback = models.ForeignKey(Feedback, on_delete=models.CASCADE, related_name="emails", verbose_name="Обращение")
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING, verbose_name="Статус")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток отправки")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Следующая попытка")
+    last_error = models.TextField(null=True, blank=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Поставлено в очередь")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Отправлено")
+    # Группы получателей (адреса через ","), которым обращение уже ушло в дайджесте: при повторе
+    # дайджест получают только остальные группы
+    digest_sent_to = models.JSONField(default=list, blank=True, verbose_name="Дайджест отправлен группам")
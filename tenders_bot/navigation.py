@@ -0,0 +1,165 @@
+# Навигация по дереву узлов, общая для обоих движков бота
+# Ответ на /start и на нажатие кнопки описан здесь один раз - как генератор шагов: вызвать метод бота,
+# сбросить состояние, загрузить файл, начать ввод данных. Движок на потоках (tenders_bot.telegram)
+# выполняет шаги синхронно, движок на asyncio (tenders_bot.async_bot) - в цикле событий. Результат
+# шага (например, отправленное сообщение) возвращается в генератор, исключение - выбрасывается в нём
+import dataclasses
+import logging
+from typing import Any, Awaitable, Callable, Generator
+
+from telebot.apihelper import ApiTelegramException
+
+from tenders_bot.node_tree import FileSnapshot, NavData, NodeSnapshot, NodeTree
+
+try:
+    from telebot.asyncio_helper import ApiTelegramException as AsyncApiTelegramException
+except ImportError:  # нужен aiohttp, без него работает только движок на потоках
+    AsyncApiTelegramException = ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+Steps = Generator[Any, Any, None]
+
+
+# Вызов метода бота через планировщик исходящих запросов; результат - ответ Telegram
+@dataclasses.dataclass(frozen=True)
+class Call:
+    method: str
+    args: tuple
+    kwargs: dict = dataclasses.field(default_factory=dict)
+
+
+# Сброс состояния пользователя (отсутствие состояния в хранилище и есть начальное состояние)
+@dataclasses.dataclass(frozen=True)
+class ResetState:
+    chat_id: int
+
+
+# Загрузка содержимого файла узла (file_id ещё нет); результат - отправленное сообщение
+@dataclasses.dataclass(frozen=True)
+class UploadFile:
+    chat_id: int
+    file: FileSnapshot
+
+
+# Сохранить file_id загруженного файла, чтобы больше его не загружать
+@dataclasses.dataclass(frozen=True)
+class RememberFileId:
+    file: FileSnapshot
+    telegram_file_id: str
+
+
+# Переход к узлу, где нужно вводить данные (форма работает с базой)
+@dataclasses.dataclass(frozen=True)
+class StartInput:
+    chat_id: int
+    node: NodeSnapshot
+
+
+# Обработка команды /start
+def start_steps(message, tree: NodeTree) -> Steps:
+    logger.info('User entered "start": %s', message.from_user.username)
+    yield from node_steps(message.chat.id, tree.root, False)  # Отправка корневого узла
+
+
+# Обработка навигации по кнопкам (узел ищем в tree, по умолчанию - в актуальном снимке)
+def navigate_steps(call, tree: NodeTree = None) -> Steps:
+    nav_data = NavData.deserialize(call.data, tree)
+    node = nav_data.nav_to_node
+
+    # Для красивого отображения в интерфейсе
+    if nav_data.direction == "f":
+        where_to = node.button_text
+    elif nav_data.direction == "b":
+        where_to = "Назад"
+    else:
+        where_to = "В начало"
+
+    new_text = call.message.text + "\n\n> " + where_to
+    yield Call("edit_message_text", (new_text, call.message.chat.id, call.message.id))
+
+    yield from node_steps(call.message.chat.id, node, only_nav=nav_data.direction != "f")
+
+
+# Отправка узла пользователю (узел берётся из снимка дерева, в базу не ходим)
+def node_steps(chat_id, node: NodeSnapshot, only_nav) -> Steps:
+    yield ResetState(chat_id)
+
+    if not only_nav:
+        if node.text:
+            yield Call("send_message", (chat_id, node.text), {"parse_mode": "HTML", "disable_web_page_preview": True})
+
+        if node.files:
+            yield from files_steps(chat_id, node)
+
+    if node.input_function:
+        yield StartInput(chat_id, node)
+    else:
+        yield from navigation_steps(chat_id, node)
+
+
+# Отправка прикрепленных к узлу файлов
+def files_steps(chat_id, node: NodeSnapshot) -> Steps:
+    message = yield Call("send_message", (chat_id, "Отправляем файлы, подождите немного..."))
+    for file in node.files:
+        yield from file_steps(chat_id, file)
+    message_id = message.id if message else None
+    yield Call("delete_message", (chat_id, message_id))
+
+
+# Отправка одного файла: по сохранённому file_id, а если его нет - загрузкой содержимого
+def file_steps(chat_id, file: FileSnapshot) -> Steps:
+    if file.telegram_file_id:
+        try:
+            yield Call("send_document", (chat_id, file.telegram_file_id))
+            return
+        except (ApiTelegramException, AsyncApiTelegramException):
+            logger.exception("Telegram rejected cached file_id of %s, uploading it again", file.name)
+
+    message = yield UploadFile(chat_id, file)
+    yield RememberFileId(file, message.document.file_id)
+
+
+# Отправка кнопок навигации (клавиатура собрана заранее в снимке дерева)
+def navigation_steps(chat_id, node: NodeSnapshot) -> Steps:
+    if not node.child_ids:
+        if node.parent_id is None:
+            logger.warning("Node %s has neither a parent nor a child node", node.id)
+        else:
+            yield from node_steps(chat_id, node.parent_node, True)
+        return
+
+    yield Call(
+        "send_message", (chat_id, node.nav_text),
+        {"reply_markup": node.markup, "parse_mode": "HTML", "disable_web_page_preview": True},
+    )
+
+
+# Выполнить шаги функцией execute в текущем потоке
+def run_steps(steps: Steps, execute: Callable[[Any], Any]):
+    result = error = None
+    while True:
+        try:
+            step = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration:
+            return
+        result = error = None
+        try:
+            result = execute(step)
+        except Exception as e:
+            error = e
+
+
+# То же в цикле событий: execute - корутина
+async def arun_steps(steps: Steps, execute: Callable[[Any], Awaitable[Any]]):
+    result = error = None
+    while True:
+        try:
+            step = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration:
+            return
+        result = error = None
+        try:
+            result = await execute(step)
+        except Exception as e:
+            error = e
@@ -0,0 +1,262 @@
+# Снимок дерева узлов в памяти процесса
+# Дерево меняется несколько раз в месяц, поэтому бот не ходит в базу на каждое нажатие кнопки:
+# всё дерево (узлы, файлы, связи и готовые клавиатуры) загружается целиком и подменяется атомарно
+from __future__ import annotations
+
+import dataclasses
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+import telebot
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from tenders_bot.apps import TendersConfig
+from tenders_bot.models import File, Node, NodeTreeVersion
+from tenders_bot.settings import NODE_TREE_CHECK_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+# Навигационные данные - сериализация переходов между узлами
+@dataclasses.dataclass
+class NavData:
+    nav_to_node: NodeSnapshot
+    direction: str  # 'r' for root, 'b' for back, 'f' for forward
+    PREFIX = "nav:"
+
+    # Преобразуем объект в строку для callback_data
+    def serialize(self) -> str:
+        return f"{self.PREFIX}{self.nav_to_node.id}|{self.direction}"
+
+    # Обратная операция: из строки получаем NavData (узел ищем в tree, по умолчанию - в актуальном снимке)
+    @staticmethod
+    def deserialize(data: str, tree: Optional[NodeTree] = None):
+        if not NavData.check(data):
+            raise ValueError("Invalid data format, missing 'nav:' prefix")
+
+        content = data[len(NavData.PREFIX) :]
+        parts = content.split("|")
+
+        node = (tree or get_node_tree()).get(int(parts[0]))
+
+        return NavData(nav_to_node=node, direction=parts[1])
+
+    @staticmethod
+    def check(data: str) -> bool:
+        return data.startswith(NavData.PREFIX)
+
+
+# Прикреплённый к узлу файл
+@dataclasses.dataclass(frozen=True)
+class FileSnapshot:
+    id: int
+    name: str  # имя файла в хранилище (как в File.file.name)
+    telegram_file_id: Optional[str] = None  # если файл уже загружался в Telegram
+
+
+# Неизменяемая копия узла
+@dataclasses.dataclass(frozen=True)
+class NodeSnapshot:
+    id: int
+    button_text: Optional[str]
+    text: Optional[str]
+    nav_text: str
+    input_function: Optional[str]
+    path: Optional[str]
+    parent_id: Optional[int]
+    child_ids: Tuple[int, ...]
+    files: Tuple[FileSnapshot, ...]
+    markup: Optional[str]  # заранее собранная клавиатура навигации (JSON), None если дочерних узлов нет
+    tree: NodeTree = dataclasses.field(repr=False, compare=False)
+
+    @property
+    def parent_node(self) -> Optional[NodeSnapshot]:
+        return self.tree.get(self.parent_id) if self.parent_id is not None else None
+
+    @property
+    def child_nodes(self) -> Tuple[NodeSnapshot, ...]:
+        return tuple(self.tree.get(child_id) for child_id in self.child_ids)
+
+
+# Всё дерево целиком, привязанное к версии из NodeTreeVersion
+class NodeTree:
+    def __init__(self, version: int, nodes: Dict[int, NodeSnapshot] = None, root_id: Optional[int] = None):
+        self.version = version
+        self._nodes = nodes or {}
+        self.root_id = root_id
+
+    @property
+    def root(self) -> Optional[NodeSnapshot]:
+        return self._nodes.get(self.root_id)
+
+    def get(self, node_id: int) -> NodeSnapshot:
+        try:
+            return self._nodes[node_id]
+        except KeyError:
+            raise ValueError(f"Node {node_id} does not exist") from None
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __iter__(self):
+        return iter(self._nodes.values())
+
+
+# Собираем клавиатуру навигации для узла
+def _build_markup(child_rows, parent_id, root_id) -> Optional[str]:
+    if not child_rows:
+        return None
+
+    markup = telebot.types.InlineKeyboardMarkup()
+    for child in child_rows:
+        callback_data = f"{NavData.PREFIX}{child['id']}|f"
+        markup.add(telebot.types.InlineKeyboardButton(child["button_text"], callback_data=callback_data))
+
+    # Если родитель есть, то добавляем кнопку Назад
+    if parent_id is not None:
+        markup.add(telebot.types.InlineKeyboardButton("Назад", callback_data=f"{NavData.PREFIX}{parent_id}|b"))
+
+        # Если родитель не корневой узел, то добавляем кнопку "В начало"
+        if parent_id != root_id:
+            markup.add(telebot.types.InlineKeyboardButton("В начало", callback_data=f"{NavData.PREFIX}{root_id}|r"))
+
+    return markup.to_json()
+
+
+# Загружаем дерево из базы двумя запросами и собираем снимок
+def build_node_tree(version: int) -> NodeTree:
+    rows = list(
+        Node.objects.order_by("button_order", "id").values(
+            "id", "button_text", "text", "nav_text", "input_function", "path", "parent_node_id"
+        )
+    )
+    files = defaultdict(list)
+    for file_row in File.objects.order_by("id").values("id", "node_id", "file", "telegram_file_id"):
+        files[file_row["node_id"]].append(
+            FileSnapshot(id=file_row["id"], name=file_row["file"], telegram_file_id=file_row["telegram_file_id"])
+        )
+
+    children = defaultdict(list)
+    root_id = None
+    for row in rows:
+        if row["parent_node_id"] is None:
+            if root_id is None:
+                root_id = row["id"]
+        else:
+            children[row["parent_node_id"]].append(row)
+
+    tree = NodeTree(version)
+    nodes = {}
+    for row in rows:
+        nodes[row["id"]] = NodeSnapshot(
+            id=row["id"],
+            button_text=row["button_text"],
+            text=row["text"],
+            nav_text=row["nav_text"],
+            input_function=row["input_function"],
+            path=row["path"],
+            parent_id=row["parent_node_id"],
+            child_ids=tuple(child["id"] for child in children[row["id"]]),
+            files=tuple(files[row["id"]]),
+            markup=_build_markup(children[row["id"]], row["parent_node_id"], root_id),
+            tree=tree,
+        )
+    tree._nodes = nodes
+    tree.root_id = root_id
+    return tree
+
+
+# Текущая версия дерева в базе
+def current_version() -> int:
+    version = NodeTreeVersion.objects.filter(pk=1).values_list("version", flat=True).first()
+    return version or 0
+
+
+_tree: Optional[NodeTree] = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+# Получить актуальный снимок дерева
+# Версию в базе сверяем не чаще раза в NODE_TREE_CHECK_INTERVAL секунд, поэтому правки
+# из админки подхватываются и другими процессами без перезапуска
+def get_node_tree() -> NodeTree:
+    global _checked_at
+    tree = _tree
+    if tree is not None and time.monotonic() - _checked_at < NODE_TREE_CHECK_INTERVAL:
+        return tree
+
+    with _lock:
+        version = current_version()
+        if _tree is None or _tree.version != version:
+            _swap(build_node_tree(version))
+        _checked_at = time.monotonic()
+        return _tree
+
+
+# То же для корутин: свежий снимок отдаём сразу, сверку версии с базой выполняем в потоке
+async def aget_node_tree() -> NodeTree:
+    tree = _tree
+    if tree is not None and time.monotonic() - _checked_at < NODE_TREE_CHECK_INTERVAL:
+        return tree
+    return await sync_to_async(get_node_tree)()
+
+
+# Атомарно подменяем снимок
+def _swap(tree: NodeTree):
+    global _tree
+    _tree = tree
+    TendersConfig.root_node = tree.root
+    logger.info("Loaded node tree version %s (%s nodes)", tree.version, len(tree))
+
+
+# Повышаем версию дерева и сразу перестраиваем снимок в текущем процессе
+def invalidate_node_tree():
+    global _checked_at
+    updated = NodeTreeVersion.objects.filter(pk=1).update(version=F("version") + 1)
+    if not updated:
+        NodeTreeVersion.objects.get_or_create(pk=1, defaults={"version": 1})
+
+    with _lock:
+        _swap(build_node_tree(current_version()))
+        _checked_at = time.monotonic()
+
+
+# Файл узла загружен в Telegram: подставляем его file_id в текущий снимок. Дерево от этого не меняется,
+# поэтому версию не повышаем и снимок не перестраиваем; другие процессы возьмут file_id из базы
+# при следующей перестройке своего снимка
+def remember_snapshot_file_id(file_pk, file_name, telegram_file_id):
+    with _lock:
+        tree = _tree
+        if tree is None:
+            return
+        for node in tree:
+            if any(file.id == file_pk and file.name == file_name for file in node.files):
+                files = tuple(
+                    dataclasses.replace(file, telegram_file_id=telegram_file_id) if file.id == file_pk else file
+                    for file in node.files
+                )
+                tree._nodes[node.id] = dataclasses.replace(node, files=files)
+                if node.id == tree.root_id:
+                    TendersConfig.root_node = tree.root
+                return
+
+
+# Одно сохранение в админке вызывает много сигналов (узел, его файлы, дочерние узлы),
+# поэтому перестраиваем дерево один раз после коммита транзакции
+@receiver(post_save, sender=Node)
+@receiver(post_delete, sender=Node)
+@receiver(post_save, sender=File)
+@receiver(post_delete, sender=File)
+def on_tree_changed(sender, using=None, **kwargs):
+    connection = transaction.get_connection(using)
+    if any(func is invalidate_node_tree for _, func, _ in connection.run_on_commit):
+        return
+    transaction.on_commit(invalidate_node_tree, using=using)
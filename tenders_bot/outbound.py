@@ -0,0 +1,293 @@
+# Планировщик исходящих запросов к Telegram
+# Telegram ограничивает бота ~30 сообщениями в секунду суммарно и ~1 сообщением в секунду в один чат.
+# Все отправки проходят через OutboundScheduler: он выдаёт разрешения по корзинам токенов (общей и
+# по чату), пропускает ответы пользователям вперёд массовых рассылок и выдерживает retry_after из ответа 429.
+# Движок asyncio ждёт разрешения через acall, не занимая поток, корзины токенов при этом общие
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from telebot.apihelper import ApiTelegramException
+
+from tenders_bot.settings import (
+    OUTBOUND_CHAT_BURST,
+    OUTBOUND_CHAT_RATE,
+    OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_INTERACTIVE_RESERVE,
+    OUTBOUND_MAX_RETRIES,
+)
+from tenders_bot.tracing import CLIENT, span
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: ответы пользователю и массовые рассылки
+INTERACTIVE = 0
+BULK = 1
+
+# Методы, которые создают новое сообщение в чате и поэтому ограничиваются лимитом чата.
+# Редактирование и удаление сообщений учитываются только в общем лимите
+CHAT_LIMITED_METHODS = frozenset({"send_message", "send_document", "send_photo", "send_media_group", "copy_message"})
+
+# Сколько корзин чатов держать, прежде чем выбрасывать неактивные
+MAX_CHAT_BUCKETS = 10000
+
+
+# Корзина токенов: rate токенов в секунду, не больше capacity
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Через сколько секунд в корзине будет need токенов (0 - уже есть)
+    def wait_time(self, now: float, need: float = 1) -> float:
+        self._refill(now)
+        if self.paused_until > now:
+            return self.paused_until - now
+        if self.tokens >= need:
+            return 0.0
+        return (need - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def pause(self, until: float):
+        self.paused_until = max(self.paused_until, until)
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.paused_until <= now
+
+
+# Время ожидания из ответа 429 Too Many Requests (None, если ошибка другая). Подходит и для
+# telebot.asyncio_helper.ApiTelegramException - у неё те же error_code и result_json
+def retry_after(exception: Exception) -> Optional[float]:
+    if getattr(exception, "error_code", None) != 429:
+        return None
+    parameters = (exception.result_json or {}).get("parameters") or {}
+    return float(parameters.get("retry_after", 1))
+
+
+# Позиции файлов среди аргументов запроса (файл или кортеж (имя, файл), как в files у requests), чтобы
+# повтор отправил их с того же места: первая попытка уже дочитала файл до конца. None - файл не перемотать
+def file_positions(values) -> Optional[list]:
+    positions = []
+    for value in values:
+        file = value[1] if isinstance(value, tuple) and len(value) > 1 else value
+        if not hasattr(file, "read"):
+            continue  # строка, байты и file_id отправляются заново как есть
+        try:
+            positions.append((file, file.tell()))
+        except (AttributeError, OSError, ValueError):
+            return None
+    return positions
+
+
+def rewind(positions):
+    for file, position in positions or ():
+        file.seek(position)
+
+
+class OutboundScheduler:
+    def __init__(
+        self,
+        global_rate: float = OUTBOUND_GLOBAL_RATE,
+        chat_rate: float = OUTBOUND_CHAT_RATE,
+        chat_burst: float = OUTBOUND_CHAT_BURST,
+        interactive_reserve: float = OUTBOUND_INTERACTIVE_RESERVE,
+        max_retries: int = OUTBOUND_MAX_RETRIES,
+    ):
+        now = time.monotonic()
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.interactive_reserve = interactive_reserve
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate, now)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._lock = threading.Condition()
+
+        # Метрики
+        self.waiting = {INTERACTIVE: 0, BULK: 0}  # сколько запросов сейчас ждут разрешения
+        self.sent = {INTERACTIVE: 0, BULK: 0}
+        self.delay_total = {INTERACTIVE: 0.0, BULK: 0.0}  # суммарное время ожидания, секунд
+        self.delay_max = {INTERACTIVE: 0.0, BULK: 0.0}
+        self.rate_limited = 0  # сколько раз Telegram ответил 429
+
+    # Выполнить запрос к Telegram с соблюдением лимитов (блокирует вызывающий поток до отправки)
+    def call(self, chat_id, func, *args, priority: int = INTERACTIVE, **kwargs):
+        positions = file_positions([*args, *kwargs.values()])
+        for attempt in range(self.max_retries + 1):
+            with span("telegram.rate_limit_wait"):
+                self._acquire(chat_id, priority)
+            try:
+                return func(*args, **kwargs)
+            except ApiTelegramException as e:
+                delay = retry_after(e)
+                if delay is None or attempt == self.max_retries or positions is None:
+                    raise
+                logger.warning("Telegram rate limit hit for chat %s, retrying after %ss", chat_id, delay)
+                self.pause(chat_id, delay)
+                rewind(positions)
+
+    # То же для корутин (методы AsyncTeleBot): ожидание разрешения не блокирует цикл событий
+    async def acall(self, chat_id, func, *args, priority: int = INTERACTIVE, **kwargs):
+        positions = file_positions([*args, *kwargs.values()])
+        for attempt in range(self.max_retries + 1):
+            with span("telegram.rate_limit_wait"):
+                await self._aacquire(chat_id, priority)
+            try:
+                # Запросы AsyncTeleBot идут мимо CUSTOM_REQUEST_SENDER, поэтому участок запроса - здесь
+                with span(f"telegram.{func.__name__}", CLIENT):
+                    return await func(*args, **kwargs)
+            except Exception as e:
+                delay = retry_after(e)
+                if delay is None or attempt == self.max_retries or positions is None:
+                    raise
+                logger.warning("Telegram rate limit hit for chat %s, retrying after %ss", chat_id, delay)
+                self.pause(chat_id, delay)
+                rewind(positions)
+
+    def rates(self) -> dict:
+        return {"global_rate": self._global.rate, "chat_rate": self.chat_rate, "chat_burst": self.chat_burst}
+
+    # Поменять лимиты на ходу (корзины чатов создаются заново)
+    def set_rates(self, global_rate: float, chat_rate: float, chat_burst: float):
+        with self._lock:
+            self._global = TokenBucket(global_rate, global_rate, time.monotonic())
+            self.chat_rate = chat_rate
+            self.chat_burst = chat_burst
+            self._chats.clear()
+            self._lock.notify_all()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "waiting": dict(self.waiting),
+                "sent": dict(self.sent),
+                "delay_total": dict(self.delay_total),
+                "delay_max": dict(self.delay_max),
+                "rate_limited": self.rate_limited,
+                "chat_buckets": len(self._chats),
+            }
+
+    def _acquire(self, chat_id, priority):
+        started = time.monotonic()
+        need = self._need(priority)
+        with self._lock:
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    wait = self._try_consume(chat_id, need)
+                    if wait <= 0:
+                        break
+                    self._lock.wait(wait)
+            finally:
+                self.waiting[priority] -= 1
+            self._record(priority, time.monotonic() - started)
+
+    async def _aacquire(self, chat_id, priority):
+        started = time.monotonic()
+        need = self._need(priority)
+        with self._lock:
+            self.waiting[priority] += 1
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_consume(chat_id, need)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+        finally:
+            with self._lock:
+                self.waiting[priority] -= 1
+        with self._lock:
+            self._record(priority, time.monotonic() - started)
+
+    # Массовым отправкам оставляем только то, что сверх резерва для ответов пользователям
+    def _need(self, priority) -> float:
+        return 1 if priority == INTERACTIVE else 1 + self.interactive_reserve
+
+    # Взять токены, если они есть (0), иначе вернуть, сколько секунд ждать. Вызывается под self._lock
+    def _try_consume(self, chat_id, need) -> float:
+        now = time.monotonic()
+        chat_bucket = self._chat_bucket(chat_id, now) if chat_id is not None else None
+        wait = self._global.wait_time(now, need)
+        if chat_bucket is not None:
+            wait = max(wait, chat_bucket.wait_time(now))
+        if wait <= 0:
+            self._global.consume()
+            if chat_bucket is not None:
+                chat_bucket.consume()
+        return wait
+
+    def _record(self, priority, delay):
+        self.sent[priority] += 1
+        self.delay_total[priority] += delay
+        self.delay_max[priority] = max(self.delay_max[priority], delay)
+
+    # Telegram ответил 429: не отправлять в чат (или никуда, если chat_id=None) delay секунд
+    def pause(self, chat_id, delay):
+        with self._lock:
+            self.rate_limited += 1
+            until = time.monotonic() + delay
+            if chat_id is None:
+                self._global.pause(until)
+            else:
+                self._chat_bucket(chat_id, time.monotonic()).pause(until)
+            self._lock.notify_all()
+
+    def _chat_bucket(self, chat_id, now) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                # Полные корзины ничем не отличаются от новых, их можно выбросить
+                for idle_chat_id in [c for c, b in self._chats.items() if b.is_idle(now)]:
+                    del self._chats[idle_chat_id]
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+
+# Обёртка над ботом: все методы идут через планировщик, для методов из CHAT_LIMITED_METHODS
+# первый аргумент - chat_id, по нему применяется лимит чата
+class ScheduledBot:
+    def __init__(self, bot, scheduler: OutboundScheduler, priority: int = INTERACTIVE):
+        self._bot = bot
+        self._scheduler = scheduler
+        self._priority = priority
+
+    def __getattr__(self, name):
+        chat_limited = name in CHAT_LIMITED_METHODS
+
+        def scheduled(*args, **kwargs):
+            # Метод берём в момент вызова, чтобы работали подмены в тестах
+            method = getattr(self._bot, name)
+            chat_id = args[0] if chat_limited else None
+            return self._scheduler.call(chat_id, method, *args, priority=self._priority, **kwargs)
+
+        return scheduled
+
+
+# То же для AsyncTeleBot: методы возвращают корутины
+class AsyncScheduledBot(ScheduledBot):
+    def __getattr__(self, name):
+        chat_limited = name in CHAT_LIMITED_METHODS
+
+        async def scheduled(*args, **kwargs):
+            method = getattr(self._bot, name)
+            chat_id = args[0] if chat_limited else None
+            return await self._scheduler.acall(chat_id, method, *args, priority=self._priority, **kwargs)
+
+        return scheduled
+
+
+scheduler = OutboundScheduler()
@@ -0,0 +1,294 @@
+# Очередь писем об обращениях
+# Бот в обработчике только добавляет строку OutboxEmail, а письма отправляет отдельный обработчик:
+# пачками через соединения из общего пула (tenders_bot.smtp_pool), с повторными попытками и пометкой
+# безнадёжных писем; в режиме дайджеста - одним письмом на несколько обращений
+import logging
+import threading
+from datetime import timedelta
+
+from django.core.mail import EmailMessage
+from django.db import close_old_connections, transaction
+from django.db import connection as db_connection  # имя connection в функциях занято SMTP-соединением
+from django.utils import timezone
+from django.utils.formats import localize
+from django.utils.timezone import localtime
+
+from tenders_bot.metrics import SMTP_FAILURES, SMTP_SECONDS
+from tenders_bot.models import Feedback, OutboxEmail
+from tenders_bot.settings import (
+    DEFAULT_FROM_EMAIL,
+    ID_FORMAT,
+    MAIL_FEEDBACK_GROUPS,
+    MAIL_FEEDBACK_TO,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_DIGEST_MAX_BYTES,
+    OUTBOX_DIGEST_WINDOW,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_RETRY_BASE_SECONDS,
+    OUTBOX_RETRY_MAX_SECONDS,
+)
+from tenders_bot.smtp_pool import smtp_pool
+from tenders_bot.tracing import INTERNAL, start_trace, trace_queries
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд письмо считается взятым в работу одним обработчиком (другие его не трогают)
+CLAIM_SECONDS = 5 * 60
+
+
+# Ставим письмо об обращении в очередь
+def enqueue_feedback_email(feedback: Feedback) -> OutboxEmail:
+    return OutboxEmail.objects.create(feedback=feedback)
+
+
+# Текст обращения для письма
+def feedback_text(feedback: Feedback, uploaded_files) -> str:
+    str_id = ID_FORMAT.format(id=feedback.id)
+
+    feedback_str = f"""
+Пришло обращение из телеграм бота департамента тендеров и закупок.
+
+Номер обращения: {str_id}.
+Дата и время обращения: {localize(localtime(feedback.created_at))}
+
+Название компании: {feedback.company}
+ИНН: {feedback.inn}
+ФИО: {feedback.name}
+Номер телефона: {feedback.contact_number}
+Электронная почта: {feedback.email}
+
+Текст сообщения:
+{feedback.text}
+"""
+    # Добавляем список файлов (если есть)
+    if uploaded_files:
+        feedback_str = feedback_str + "\nВложенные файлы:\n- "
+        feedback_str = feedback_str + "\n- ".join(uploaded_file.display_name for uploaded_file in uploaded_files)
+    return feedback_str
+
+
+def _attach_files(mail: EmailMessage, uploaded_files, prefix=""):
+    for uploaded_file in uploaded_files:
+        with uploaded_file.file.open("rb") as file:
+            mail.attach(prefix + uploaded_file.display_name, file.read())
+
+
+# Функция сборки письма по шаблону
+def build_feedback_email(feedback: Feedback, connection=None) -> EmailMessage:
+    uploaded_files = list(feedback.uploaded_files.all())
+    mail = EmailMessage(
+        f"Запрос из Telegram-бота: {ID_FORMAT.format(id=feedback.id)}",
+        feedback_text(feedback, uploaded_files),
+        DEFAULT_FROM_EMAIL,
+        MAIL_FEEDBACK_TO,
+        connection=connection,
+    )
+    _attach_files(mail, uploaded_files)
+    return mail
+
+
+# Одно письмо на несколько обращений; к именам вложений добавляется номер обращения
+def build_digest_email(feedbacks, recipients) -> EmailMessage:
+    ids = [ID_FORMAT.format(id=feedback.id) for feedback in feedbacks]
+    mail = EmailMessage(
+        f"Запросы из Telegram-бота: {', '.join(ids)}",
+        "\n" + "\n\n----------\n".join(
+            feedback_text(feedback, list(feedback.uploaded_files.all())) for feedback in feedbacks
+        ),
+        DEFAULT_FROM_EMAIL,
+        recipients,
+    )
+    for feedback, str_id in zip(feedbacks, ids):
+        _attach_files(mail, list(feedback.uploaded_files.all()), prefix=f"{str_id}_")
+    return mail
+
+
+# Берём в работу пачку писем, которым пора отправляться
+# Срок следующей попытки сдвигаем сразу, поэтому параллельный обработчик эти письма не возьмёт
+def claim_batch(batch_size: int = OUTBOX_BATCH_SIZE):
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True, of=("self",))
+            .select_related("feedback")
+            .prefetch_related("feedback__uploaded_files")
+            .filter(status=OutboxEmail.Status.PENDING, next_attempt_at__lte=now)
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        OutboxEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            next_attempt_at=now + timedelta(seconds=CLAIM_SECONDS)
+        )
+    return emails
+
+
+# Задержка перед следующей попыткой: 30с, 1м, 2м, 4м ... но не больше OUTBOX_RETRY_MAX_SECONDS
+def retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_SECONDS))
+
+
+def _mark_sent(email: OutboxEmail):
+    email.status = OutboxEmail.Status.SENT
+    email.attempts += 1
+    email.sent_at = timezone.now()
+    email.last_error = None
+    email.save(update_fields=["status", "attempts", "sent_at", "last_error", "digest_sent_to"])
+
+
+def _mark_failed(email: OutboxEmail, error: Exception):
+    email.attempts += 1
+    email.last_error = repr(error)
+    if email.attempts >= OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboxEmail.Status.DEAD
+        logger.error("Giving up on email %s after %s attempts", email.pk, email.attempts)
+    else:
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+    email.save(update_fields=["status", "attempts", "last_error", "next_attempt_at", "digest_sent_to"])
+
+
+# Дайджест собирается, когда первому неотправленному письму исполнилось OUTBOX_DIGEST_WINDOW секунд:
+# к этому моменту в очереди накопились все обращения, пришедшие в течение окна
+def claim_digest(batch_size: int = OUTBOX_BATCH_SIZE, window: int = OUTBOX_DIGEST_WINDOW):
+    now = timezone.now()
+    due = OutboxEmail.objects.filter(status=OutboxEmail.Status.PENDING, next_attempt_at__lte=now)
+    if not due.filter(created_at__lte=now - timedelta(seconds=window)).exists():
+        return []
+    return claim_batch(batch_size)
+
+
+# Вернуть взятые в работу письма в очередь без попытки отправки
+def _unclaim(emails):
+    OutboxEmail.objects.filter(pk__in=[email.pk for email in emails]).update(next_attempt_at=timezone.now())
+
+
+# Отправляем одну пачку писем через соединение из пула, возвращаем количество отправленных
+def deliver_batch(batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    if OUTBOX_DIGEST_WINDOW:
+        return deliver_digest(batch_size)
+    emails = claim_batch(batch_size)
+    if not emails:
+        return 0
+
+    connection = _acquire_connection(emails)
+    if connection is None:
+        return 0
+    sent = 0
+    try:
+        for index, email in enumerate(emails):
+            if connection.broken:
+                # Соединение разорвано: остальные письма пачки отправляем через новое
+                smtp_pool.release(connection)
+                connection = _acquire_connection(emails[index:])
+                if connection is None:
+                    break
+            try:
+                with SMTP_SECONDS.time():
+                    connection.send_messages([build_feedback_email(email.feedback)])
+            except Exception as e:
+                SMTP_FAILURES.inc()
+                logger.exception("Exception while sending email %s", email.pk)
+                _mark_failed(email, e)
+            else:
+                _mark_sent(email)
+                sent += 1
+    finally:
+        if connection is not None:
+            smtp_pool.release(connection)
+    logger.info("Sent %s of %s emails", sent, len(emails))
+    return sent
+
+
+# Отправляем накопившиеся обращения одним письмом на каждую группу получателей, возвращаем количество
+# обращений, которые получили все группы. Доставка отслеживается по группам (OutboxEmail.digest_sent_to):
+# если какой-то группе отправить не удалось, при повторе дайджест уйдёт только ей
+def deliver_digest(batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    emails = claim_digest(batch_size, OUTBOX_DIGEST_WINDOW)
+    if not emails:
+        return 0
+
+    # Вложения всех обращений идут в одно письмо, поэтому ограничиваем их суммарный размер
+    included, size = [], 0
+    for email in emails:
+        files_size = sum(f.size or 0 for f in email.feedback.uploaded_files.all())
+        if included and size + files_size > OUTBOX_DIGEST_MAX_BYTES:
+            break
+        included.append(email)
+        size += files_size
+    _unclaim(emails[len(included):])
+
+    connection = None
+    errors = {}  # письмо -> ошибка отправки какой-либо группе
+    try:
+        for recipients in MAIL_FEEDBACK_GROUPS:
+            group = ",".join(recipients)
+            pending = [email for email in included if group not in email.digest_sent_to]
+            if not pending:
+                continue
+            try:
+                if connection is None or connection.broken:
+                    if connection is not None:
+                        smtp_pool.release(connection)
+                        connection = None
+                    connection = smtp_pool.acquire()
+                with SMTP_SECONDS.time():
+                    connection.send_messages([build_digest_email([email.feedback for email in pending], recipients)])
+            except Exception as e:
+                SMTP_FAILURES.inc(len(pending))
+                logger.exception("Exception while sending digest of %s emails to %s", len(pending), group)
+                for email in pending:
+                    errors[email.pk] = e
+            else:
+                for email in pending:
+                    email.digest_sent_to.append(group)
+    finally:
+        if connection is not None:
+            smtp_pool.release(connection)
+
+    sent = 0
+    for email in included:
+        if email.pk in errors:
+            _mark_failed(email, errors[email.pk])
+        else:
+            _mark_sent(email)
+            sent += 1
+    logger.info("Sent digest of %s of %s emails", sent, len(included))
+    return sent
+
+
+# Не удалось даже подключиться к SMTP - все письма пачки откладываем
+def _acquire_connection(emails):
+    try:
+        return smtp_pool.acquire()
+    except Exception as e:
+        logger.exception("Exception while opening SMTP connection")
+        SMTP_FAILURES.inc(len(emails))
+        for email in emails:
+            _mark_failed(email, e)
+        return None
+
+
+# Основной цикл обработчика: отправляем пачки, пока есть что отправлять, затем ждём
+def run_outbox_worker(
+    stop_event: threading.Event = None,
+    poll_interval: float = OUTBOX_POLL_INTERVAL,
+    batch_size: int = OUTBOX_BATCH_SIZE,
+):
+    stop_event = stop_event or threading.Event()
+    logger.info("Outbox worker started")
+    while not stop_event.is_set():
+        close_old_connections()
+        try:
+            with (
+                start_trace("outbox.deliver", INTERNAL) as trace,
+                db_connection.execute_wrapper(trace_queries),
+            ):
+                delivered = deliver_batch(batch_size)
+                if trace is not None and not delivered:
+                    trace.keep = False  # пустой опрос очереди сохранять незачем
+        except Exception:
+            logger.exception("Exception in outbox worker")
+            delivered = 0
+        if not delivered:
+            stop_event.wait(poll_interval)
+    smtp_pool.close_all()
+    logger.info("Outbox worker stopped")
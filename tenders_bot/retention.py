@@ -0,0 +1,214 @@
+# Очистка старых данных: брошенные черновики обращений, вложения давно отправленных обращений и истёкшие
+# состояния пользователей в базе
+# Удаляем пачками по первичному ключу, каждая пачка - в своей короткой транзакции, поэтому строки
+# не блокируются надолго. Файлы с диска удаляются после коммита, в нескольких потоках
+import dataclasses
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import islice
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from tenders_bot.blobs import release_blob
+from tenders_bot.models import ChatState, Feedback, OutboxEmail, StoredBlob, UserUploadedFile
+from tenders_bot.settings import RETENTION_BATCH_SIZE, STORAGE_DELETE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_DIRECTORY = "user_uploads"
+# Файлы без строки в базе моложе этого срока не трогаем: строка создаётся после записи файла
+ORPHAN_MIN_AGE = timedelta(days=1)
+
+
+@dataclasses.dataclass
+class PurgeResult:
+    rows: int = 0  # удалено строк (черновиков, вложений или файлов без строки)
+    files: int = 0  # из них вложений
+    # Размер удалённых вложений в байтах; содержимое, на которое ещё ссылаются другие обращения,
+    # остаётся на диске (см. tenders_bot.blobs), поэтому на диске освобождается не больше этого
+    bytes: int = 0
+
+
+# Удаляем файлы из хранилища в несколько потоков, возвращаем число неудавшихся удалений
+def delete_stored_files(names, workers: int = STORAGE_DELETE_WORKERS) -> int:
+    if not names:
+        return 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_delete_stored_file, names)).count(False)
+
+
+def _delete_stored_file(name) -> bool:
+    try:
+        default_storage.delete(name)
+    except Exception:
+        logger.exception("Exception while deleting stored file %s", name)
+        return False
+    return True
+
+
+# Удалить файл из хранилища, только если транзакция закоммитится
+# (при откате строка вернётся и должна указывать на существующий файл). На каждый файл - своя задача
+# on_commit, поэтому при откате точки сохранения Django отбрасывает задачи её файлов вместе с ней
+def delete_file_on_commit(name, using=None):
+    transaction.on_commit(functools.partial(_delete_committed_file, name), using=using)
+
+
+# Пачки, которые собирают удаляемые файлы потока, чтобы удалить их вместе в несколько потоков
+_collecting = threading.local()
+
+
+def _delete_committed_file(name):
+    names = getattr(_collecting, "names", None)
+    if names is not None:
+        names.append(name)
+    else:
+        _delete_stored_file(name)
+
+
+# Файлы, чьи строки удалены в транзакциях внутри блока, удаляются из хранилища одной пачкой при выходе
+@contextmanager
+def collect_file_deletions():
+    if getattr(_collecting, "names", None) is not None:
+        yield  # файлы соберёт внешний блок
+        return
+    names = _collecting.names = []
+    try:
+        yield
+    finally:
+        _collecting.names = None
+        failed = delete_stored_files(names)
+        if failed:
+            logger.error("Failed to delete %s of %s stored files", failed, len(names))
+
+
+# Строки вложений удаляются и напрямую, и каскадом вместе с обращением. Общее содержимое
+# (tenders_bot.blobs) удаляется с последней ссылкой, файл загрузки без блоба - сразу
+@receiver(post_delete, sender=UserUploadedFile)
+def on_uploaded_file_deleted(sender, instance, using=None, **kwargs):
+    if instance.blob_id is not None:
+        release_blob(instance.blob_id, using)
+    elif instance.file.name:
+        delete_file_on_commit(instance.file.name, using)
+
+
+@receiver(post_delete, sender=StoredBlob)
+def on_blob_deleted(sender, instance, using=None, **kwargs):
+    delete_file_on_commit(instance.file.name, using)
+
+
+# Черновики, которые не отправили и создали раньше срока хранения (время последнего изменения
+# черновика не хранится, поэтому срок отсчитывается от создания)
+def stale_drafts(cutoff):
+    return Feedback.objects.filter(submitted=False, created_at__lt=cutoff)
+
+
+# Вложения отправленных обращений старше срока хранения; пока письмо об обращении
+# не отправлено, вложения нужны для него
+def expired_attachments(cutoff):
+    return (
+        UserUploadedFile.objects.filter(feedback__submitted=True, feedback__created_at__lt=cutoff)
+        .exclude(feedback__emails__status=OutboxEmail.Status.PENDING)
+    )
+
+
+def _total_size(queryset) -> int:
+    return queryset.aggregate(total=Sum("size"))["total"] or 0
+
+
+# Удаляем строки queryset пачками, пока они не кончатся
+def _purge(queryset, files_of, batch_size) -> PurgeResult:
+    result = PurgeResult()
+    while True:
+        pks = list(queryset.order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return result
+        with collect_file_deletions(), transaction.atomic():
+            files = files_of(pks)
+            result.files += files.count()
+            result.bytes += _total_size(files)
+            queryset.model.objects.filter(pk__in=pks).delete()
+        result.rows += len(pks)
+        logger.info("Purged %s %s", result.rows, queryset.model._meta.verbose_name_plural)
+
+
+def purge_drafts(cutoff, batch_size: int = RETENTION_BATCH_SIZE, dry_run: bool = False) -> PurgeResult:
+    drafts = stale_drafts(cutoff)
+    if dry_run:
+        files = UserUploadedFile.objects.filter(feedback__in=drafts)
+        return PurgeResult(rows=drafts.count(), files=files.count(), bytes=_total_size(files))
+    return _purge(drafts, lambda pks: UserUploadedFile.objects.filter(feedback__in=pks), batch_size)
+
+
+def purge_attachments(cutoff, batch_size: int = RETENTION_BATCH_SIZE, dry_run: bool = False) -> PurgeResult:
+    attachments = expired_attachments(cutoff)
+    if dry_run:
+        count = attachments.count()
+        return PurgeResult(rows=count, files=count, bytes=_total_size(attachments))
+    return _purge(attachments, lambda pks: UserUploadedFile.objects.filter(pk__in=pks), batch_size)
+
+
+# Состояния пользователей (USER_STATE_BACKEND="database"), не менявшиеся дольше их срока: при чтении они
+# уже считаются отсутствующими, а строки остаются
+def expired_chat_states(cutoff):
+    return ChatState.objects.filter(updated_at__lt=cutoff)
+
+
+def purge_chat_states(cutoff, batch_size: int = RETENTION_BATCH_SIZE, dry_run: bool = False) -> PurgeResult:
+    states = expired_chat_states(cutoff)
+    if dry_run:
+        return PurgeResult(rows=states.count())
+    return _purge(states, lambda pks: UserUploadedFile.objects.none(), batch_size)
+
+
+# Все файлы папки загрузок, включая подпапки содержимого (user_uploads/blobs/xx/...)
+def _walk(directory):
+    directories, file_names = default_storage.listdir(directory)
+    for name in file_names:
+        yield f"{directory}/{name}"
+    for name in directories:
+        yield from _walk(f"{directory}/{name}")
+
+
+# Файлы в папке загрузок, на которые нет ни вложения, ни блоба (например, оставшиеся от удалений до
+# появления этой очистки или от сбоя между записью содержимого и созданием StoredBlob). Имена
+# сверяются с базой пачками
+def orphan_files(batch_size: int = RETENTION_BATCH_SIZE, min_age: timedelta = ORPHAN_MIN_AGE):
+    if not default_storage.exists(UPLOADS_DIRECTORY):
+        return
+    cutoff = timezone.now() - min_age
+    files = _walk(UPLOADS_DIRECTORY)
+    while names := list(islice(files, batch_size)):
+        known = set(UserUploadedFile.objects.filter(file__in=names).values_list("file", flat=True))
+        known.update(StoredBlob.objects.filter(file__in=names).values_list("file", flat=True))
+        for name in names:
+            if name not in known and default_storage.get_modified_time(name) < cutoff:
+                yield name
+
+
+def purge_orphan_files(batch_size: int = RETENTION_BATCH_SIZE, dry_run: bool = False) -> PurgeResult:
+    result = PurgeResult()
+    batch = []
+    for name in orphan_files(batch_size):
+        result.rows += 1
+        result.bytes += default_storage.size(name)
+        batch.append(name)
+        if len(batch) >= batch_size:
+            result.files += _delete_orphans(batch, dry_run)
+            batch = []
+    result.files += _delete_orphans(batch, dry_run)
+    return result
+
+
+def _delete_orphans(names, dry_run) -> int:
+    if dry_run:
+        return len(names)
+    return len(names) - delete_stored_files(names)
@@ -17,7 +17,7 @@ SECRET_KEY = env_or_err("SECRET_KEY")
 
 # В продакшене отключить отладку
 DEBUG = True
-ALLOWED_HOSTS = ["127.0.0.1", "localhost"]
+ALLOWED_HOSTS = ["127.0.0.1", "localhost"] + [host for host in env_or_err("ALLOWED_HOSTS", "").split(",") if host]
 
 # Установленные приложения проекта
 INSTALLED_APPS = [
@@ -58,7 +58,10 @@ DATABASES = {
             "options": f'-c search_path="{env_or_err("DATABASE_SCHEMA")}" -c statement_timeout=30000',
             "connect_timeout": 10,
         },
-        "CONN_MAX_AGE": 0,
+        # Соединение переиспользуется до CONN_MAX_AGE секунд (в потоках бота - см. tenders_bot.db),
+        # перед повторным использованием проверяется запросом SELECT 1
+        "CONN_MAX_AGE": int(env_or_err("DATABASE_CONN_MAX_AGE", 300)),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
@@ -106,6 +109,11 @@ STATIC_URL = "/static/"
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "files")
+# Кто передаёт медиафайлы после проверки прав в tenders_bot.media: "" - сам Django (FileResponse),
+# "nginx" - nginx по заголовку X-Accel-Redirect (нужен internal location MEDIA_ACCEL_PREFIX с alias на MEDIA_ROOT),
+# "sendfile" - Apache (mod_xsendfile) или lighttpd по заголовку X-Sendfile
+MEDIA_SERVER = env_or_err("MEDIA_SERVER", "")
+MEDIA_ACCEL_PREFIX = env_or_err("MEDIA_ACCEL_PREFIX", "/protected-media/")
 
 # Настройки email
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
@@ -116,7 +124,32 @@ EMAIL_USE_TLS = env_or_err("EMAIL_USE_TLS", True, True)
 EMAIL_HOST_USER = env_or_err("EMAIL_HOST_USER", "")
 EMAIL_HOST_PASSWORD = env_or_err("EMAIL_HOST_PASSWORD", "")
 DEFAULT_FROM_EMAIL = env_or_err("DEFAULT_FROM_EMAIL")
-MAIL_FEEDBACK_TO = env_or_err("MAIL_FEEDBACK_TO").split(",")
+# Получатели писем об обращениях: адреса через ",". Группы получателей разделяются ";",
+# в режиме дайджеста каждая группа получает своё письмо
+MAIL_FEEDBACK_GROUPS = [group.split(",") for group in env_or_err("MAIL_FEEDBACK_TO").split(";")]
+MAIL_FEEDBACK_TO = [address for group in MAIL_FEEDBACK_GROUPS for address in group]
+EMAIL_TIMEOUT = 10
+# Пул SMTP-соединений (см. tenders_bot.smtp_pool): сколько соединений держать открытыми, после скольких
+# секунд простоя проверять соединение перед отправкой, когда закрывать простаивающее и сколько писем
+# отправлять за одну сессию
+SMTP_POOL_SIZE = int(env_or_err("SMTP_POOL_SIZE", 2))
+SMTP_POOL_CHECK_AFTER = 30
+SMTP_POOL_MAX_IDLE = 240
+SMTP_POOL_MAX_MESSAGES = 100
+# Очередь писем: сколько писем отправлять за одно SMTP-соединение, как часто проверять очередь
+# и как откладывать повторные попытки (экспоненциально, от BASE до MAX секунд)
+OUTBOX_BATCH_SIZE = int(env_or_err("OUTBOX_BATCH_SIZE", 20))
+OUTBOX_POLL_INTERVAL = float(env_or_err("OUTBOX_POLL_INTERVAL", 5))
+OUTBOX_RETRY_BASE_SECONDS = 30
+OUTBOX_RETRY_MAX_SECONDS = 3600
+OUTBOX_MAX_ATTEMPTS = int(env_or_err("OUTBOX_MAX_ATTEMPTS", 10))
+# Режим дайджеста: обращения, пришедшие в течение окна (в секундах) после первого неотправленного,
+# уходят одним письмом на группу получателей (0 - письмо на каждое обращение). Вложения дайджеста
+# ограничены по размеру, не поместившиеся обращения уйдут следующим письмом
+OUTBOX_DIGEST_WINDOW = int(env_or_err("OUTBOX_DIGEST_WINDOW", 0))
+OUTBOX_DIGEST_MAX_BYTES = 20 * 1024 * 1024
+# Запускать обработчик очереди в процессе бота (иначе нужен отдельный manage.py deliver_outbox)
+OUTBOX_WORKER_IN_PROCESS = env_or_err("OUTBOX_WORKER_IN_PROCESS", True, True)
 
 # Ограничения на подгружаемые файлы
 MAX_FILE_SIZE_MB = 3  # MB
@@ -124,14 +157,87 @@ MAX_TOTAL_SIZE_MB = 15  # MB
 # Доп настройки
 ID_FORMAT = "GKE-{id}"
 TELEGRAM_TOKEN = env_or_err("TELEGRAM_TOKEN")
+# Число потоков обработки обновлений: чаты распределяются между ними, один чат - всегда один поток
 TELEBOT_NUM_THREADS = int(env_or_err("TELEBOT_NUM_THREADS", 10))
+UPDATE_QUEUE_SIZE = int(env_or_err("UPDATE_QUEUE_SIZE", 100))  # очередь обновлений одного потока
+# Движок обработки обновлений: "threads" (потоки диспетчера) или "asyncio" (корутины поверх
+# telebot.async_telebot с одной keep-alive сессией aiohttp, нужен aiohttp из requirements-async.txt; см. tenders_bot.async_bot)
+TELEGRAM_BOT_ENGINE = env_or_err("TELEGRAM_BOT_ENGINE", "threads")
+ASYNC_MAX_CONCURRENT_UPDATES = int(env_or_err("ASYNC_MAX_CONCURRENT_UPDATES", 1000))  # обновлений в работе одновременно
+ASYNC_HTTP_CONNECTIONS = int(env_or_err("ASYNC_HTTP_CONNECTIONS", 50))  # соединений к Bot API в сессии aiohttp
+# Режим получения обновлений: "polling" (бот сам опрашивает Telegram) или "webhook"
+# (Telegram присылает обновления на публичный адрес TELEGRAM_WEBHOOK_URL + /telegram/webhook/,
+# их принимает Django, см. tenders_bot.webhook и manage.py telegram_webhook set)
+TELEGRAM_BOT_MODE = env_or_err("TELEGRAM_BOT_MODE", "polling")
+# Запускать ли polling внутри manage.py runserver. Если бот работает отдельным сервисом
+# (manage.py runbot), выключить, иначе два процесса будут опрашивать Telegram одновременно
+TELEGRAM_BOT_IN_RUNSERVER = env_or_err("TELEGRAM_BOT_IN_RUNSERVER", True, True)
+TELEGRAM_WEBHOOK_URL = env_or_err("TELEGRAM_WEBHOOK_URL", "")
+TELEGRAM_WEBHOOK_SECRET = env_or_err("TELEGRAM_WEBHOOK_SECRET", "")
+# Лимиты исходящих сообщений (см. tenders_bot.outbound): общий в секунду, на один чат в секунду с запасом
+# на короткий всплеск, резерв общего лимита под ответы пользователям, который не трогают массовые рассылки
+OUTBOUND_GLOBAL_RATE = float(env_or_err("OUTBOUND_GLOBAL_RATE", 30))
+OUTBOUND_CHAT_RATE = float(env_or_err("OUTBOUND_CHAT_RATE", 1))
+OUTBOUND_CHAT_BURST = 3
+OUTBOUND_INTERACTIVE_RESERVE = 5
+OUTBOUND_MAX_RETRIES = 3  # сколько раз повторять запрос после ответа 429
+# Служебный чат, куда новые файлы узлов заранее загружаются из админки (пусто - не загружать)
+TELEGRAM_STORAGE_CHAT_ID = env_or_err("TELEGRAM_STORAGE_CHAT_ID", "")
+# Транспорт запросов к Bot API (см. tenders_bot.transport): соединений в пуле keep-alive, таймауты
+# в секундах (чтение ответа: обычные методы и методы с загрузкой файлов/скачивание файлов), повторы
+# после сбоев с экспоненциальной паузой со случайным разбросом. 429 с retry_after не дольше
+# TELEGRAM_MAX_RETRY_AFTER выдерживается здесь же, более долгий - отдаётся планировщику
+TELEGRAM_POOL_SIZE = int(env_or_err("TELEGRAM_POOL_SIZE", 20))
+TELEGRAM_CONNECT_TIMEOUT = 5
+TELEGRAM_READ_TIMEOUT = float(env_or_err("TELEGRAM_READ_TIMEOUT", 10))
+TELEGRAM_UPLOAD_TIMEOUT = float(env_or_err("TELEGRAM_UPLOAD_TIMEOUT", 120))
+TELEGRAM_RETRIES = 3
+TELEGRAM_RETRY_BACKOFF = 0.5  # первая пауза (до разброса), дальше удваивается
+TELEGRAM_RETRY_BACKOFF_MAX = 8
+TELEGRAM_MAX_RETRY_AFTER = 10
+# Где хранить состояния пользователей: "local" - в памяти процесса, "database" - в базе (для нескольких процессов)
+USER_STATE_BACKEND = env_or_err("USER_STATE_BACKEND", "local")
+USER_STATE_MAX_SIZE = int(env_or_err("USER_STATE_MAX_SIZE", 10000))  # максимум чатов в памяти процесса
+USER_STATE_TTL = 24 * 60 * 60  # сколько секунд хранится состояние неактивного чата
+# Черновики формы обратной связи держатся в памяти и пишутся в базу отложенно. Если процессов бота
+# несколько (USER_STATE_BACKEND="database"), изменённые поля пишутся сразу
+FEEDBACK_DRAFT_CACHE_SIZE = int(env_or_err("FEEDBACK_DRAFT_CACHE_SIZE", 1000))
+FEEDBACK_DRAFT_WRITE_BEHIND = env_or_err("FEEDBACK_DRAFT_WRITE_BEHIND", USER_STATE_BACKEND == "local", True)
+# Как часто (в секундах) сверять версию снимка дерева узлов с базой
+NODE_TREE_CHECK_INTERVAL = float(env_or_err("NODE_TREE_CHECK_INTERVAL", 5))
+# Если задан, /metrics отдаётся только с заголовком "Authorization: Bearer <METRICS_TOKEN>",
+# иначе - только сотрудникам и запросам с localhost
+METRICS_TOKEN = env_or_err("METRICS_TOKEN", "")
+# Сроки хранения в днях для manage.py purge_retention: неотправленных черновиков и вложений
+# отправленных обращений (0 - вложения не удалять)
+DRAFT_RETENTION_DAYS = int(env_or_err("DRAFT_RETENTION_DAYS", 30))
+ATTACHMENT_RETENTION_DAYS = int(env_or_err("ATTACHMENT_RETENTION_DAYS", 0))
+RETENTION_BATCH_SIZE = 500  # строк за одну транзакцию
+STORAGE_DELETE_WORKERS = 4  # потоков удаления файлов из хранилища
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-# Логирование (поставить на INFO - уровень логирования, отключит DEBUG)
-LOG_LEVEL = "DEBUG"
+# Трассировка обновлений (см. tenders_bot.tracing): файл трасс (пусто - трассировка выключена),
+# с какой длительности трасса считается медленной и сохраняется всегда, какую долю остальных сохранять
+TRACE_FILE = env_or_err("TRACE_FILE", "")
+TRACE_SLOW_THRESHOLD = float(env_or_err("TRACE_SLOW_THRESHOLD", 1))  # секунд
+TRACE_SAMPLE_RATE = float(env_or_err("TRACE_SAMPLE_RATE", 0.01))
+TRACE_MAX_SPANS = 500  # участков в одной трассе
+TRACE_FILE_MAX_BYTES = 50 * 1024 * 1024
+TRACE_FILE_BACKUPS = 5
+
+# Логирование (см. tenders_bot.logs): LOG_LEVEL - общий уровень, LOG_LEVELS - уровни отдельных
+# логгеров через запятую ("tenders_bot.outbound=DEBUG,django.db.backends=INFO"), LOG_FORMAT - "json"
+# (по строке JSON на запись) или "text". Записи одного шаблона ниже WARNING - не больше LOG_RATE_LIMIT в секунду
+LOG_LEVEL = env_or_err("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = {
+    name.strip(): level.strip().upper()
+    for name, level in (item.split("=", 1) for item in env_or_err("LOG_LEVELS", "").split(",") if "=" in item)
+}
+LOG_FORMAT = env_or_err("LOG_FORMAT", "json")
+LOG_RATE_LIMIT = float(env_or_err("LOG_RATE_LIMIT", 10))  # 0 - не ограничивать
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -144,13 +250,29 @@ LOGGING = {
             "format": "[{asctime}::{name}::{levelname}] {message}",
             "style": "{",
         },
+        "json": {"()": "tenders_bot.logs.JsonFormatter"},
+        "message": {"format": "{message}", "style": "{"},
+    },
+    "filters": {
+        "context": {"()": "tenders_bot.logs.ContextFilter"},
+        "rate_limit": {"()": "tenders_bot.logs.RateLimitFilter", "rate": LOG_RATE_LIMIT, "burst": 2 * LOG_RATE_LIMIT},
     },
     "handlers": {
         "console": {
-            "level": LOG_LEVEL,
-            "class": "logging.StreamHandler",
-            "formatter": "simple",
+            "level": "DEBUG",  # уровни задаются логгерам, чтобы работали уровни из LOG_LEVELS
+            "class": "tenders_bot.logs.QueueingHandler",
+            "formatter": "json" if LOG_FORMAT == "json" else "simple",
+            "filters": ["context", "rate_limit"],
         },
+        **({
+            "traces": {
+                "class": "tenders_bot.logs.QueueingHandler",
+                "filename": TRACE_FILE,
+                "max_bytes": TRACE_FILE_MAX_BYTES,
+                "backup_count": TRACE_FILE_BACKUPS,
+                "formatter": "message",
+            },
+        } if TRACE_FILE else {}),
     },
     "loggers": {
         "": {"handlers": ["console"], "level": LOG_LEVEL, "propagate": False},
@@ -173,5 +295,14 @@ LOGGING = {
             "level": LOG_LEVEL,
             "propagate": False,
         },
+        "tenders_bot.traces": {
+            "handlers": ["traces"] if TRACE_FILE else [],
+            "level": "INFO",
+            "propagate": False,
+        },
+        **{
+            name: {"handlers": ["console"], "level": level, "propagate": False}
+            for name, level in LOG_LEVELS.items()
+        },
     },
-}
\ No newline at end of file
+}
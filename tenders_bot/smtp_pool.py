@@ -0,0 +1,151 @@
+# Пул SMTP-соединений, общий для всех отправителей писем в процессе
+# Соединение (TLS и авторизация) открывается один раз и переиспользуется между пачками писем.
+# Перед выдачей простоявшее соединение проверяется командой NOOP; долго простоявшие и отправившие
+# слишком много писем соединения закрываются, сломанные при отправке - выбрасываются
+import logging
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.mail import get_connection
+
+from tenders_bot.metrics import SMTP_CONNECTIONS_OPENED, Gauge
+from tenders_bot.settings import (
+    EMAIL_TIMEOUT,
+    SMTP_POOL_CHECK_AFTER,
+    SMTP_POOL_MAX_IDLE,
+    SMTP_POOL_MAX_MESSAGES,
+    SMTP_POOL_SIZE,
+)
+from tenders_bot.tracing import CLIENT, span
+
+logger = logging.getLogger(__name__)
+
+
+class PooledConnection:
+    def __init__(self, backend):
+        self.backend = backend  # EmailBackend
+        self.last_used = time.monotonic()
+        self.messages = 0
+        self.broken = False
+
+    def send_messages(self, messages) -> int:
+        try:
+            with span("smtp.send", CLIENT, {"smtp.messages": len(messages)}):
+                sent = self.backend.send_messages(messages)
+        except Exception as e:
+            # Отказ сервера принять конкретное письмо соединение не ломает, остальные ошибки
+            # (разрыв, таймаут, 421 - сервер закрывает сессию) - ломают
+            self.broken = (
+                not isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused))
+                or getattr(e, "smtp_code", None) == 421
+            )
+            raise
+        self.messages += len(messages)
+        return sent
+
+
+class SMTPConnectionPool:
+    def __init__(
+        self,
+        size: int = SMTP_POOL_SIZE,
+        check_after: float = SMTP_POOL_CHECK_AFTER,
+        max_idle: float = SMTP_POOL_MAX_IDLE,
+        max_messages: int = SMTP_POOL_MAX_MESSAGES,
+        timeout: float = EMAIL_TIMEOUT,
+    ):
+        self.size = size
+        self.check_after = check_after
+        self.max_idle = max_idle
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self._idle = []  # свободные соединения, последним - самое свежее
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)  # не больше size соединений одновременно
+
+    # Взять рабочее соединение из пула (или открыть новое). Ошибка открытия пробрасывается
+    def acquire(self) -> PooledConnection:
+        self._slots.acquire()
+        try:
+            return self._take()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    # Вернуть соединение; сломавшееся при отправке закрывается, а не возвращается в пул
+    def release(self, pooled: PooledConnection):
+        try:
+            self._give_back(pooled)
+        finally:
+            self._slots.release()
+
+    # То же на время блока with
+    @contextmanager
+    def connection(self):
+        pooled = self.acquire()
+        try:
+            yield pooled
+        finally:
+            self.release(pooled)
+
+    @property
+    def idle(self) -> int:
+        with self._lock:
+            return len(self._idle)
+
+    # Закрыть все свободные соединения (при остановке процесса)
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            self._close(pooled)
+
+    def _take(self) -> PooledConnection:
+        while True:
+            with self._lock:
+                pooled = self._idle.pop() if self._idle else None
+            if pooled is None:
+                return self._open()
+            if self._is_alive(pooled):
+                return pooled
+            self._close(pooled)
+
+    def _give_back(self, pooled: PooledConnection):
+        pooled.last_used = time.monotonic()
+        if pooled.broken or pooled.messages >= self.max_messages:
+            self._close(pooled)
+            return
+        with self._lock:
+            self._idle.append(pooled)
+
+    def _open(self) -> PooledConnection:
+        backend = get_connection(timeout=self.timeout)
+        with span("smtp.connect", CLIENT):
+            backend.open()
+        SMTP_CONNECTIONS_OPENED.inc()
+        return PooledConnection(backend)
+
+    def _is_alive(self, pooled: PooledConnection) -> bool:
+        idle = time.monotonic() - pooled.last_used
+        if idle > self.max_idle:
+            return False
+        smtp = getattr(pooled.backend, "connection", None)  # smtplib.SMTP у SMTP-бэкенда
+        if idle < self.check_after or smtp is None:
+            return True
+        try:
+            return smtp.noop()[0] == 250
+        except Exception:
+            logger.info("Pooled SMTP connection is dead, reconnecting")
+            return False
+
+    def _close(self, pooled: PooledConnection):
+        try:
+            pooled.backend.close()
+        except Exception:
+            logger.exception("Exception while closing SMTP connection")
+
+
+smtp_pool = SMTPConnectionPool()
+
+Gauge("tenders_bot_smtp_idle_connections", "Idle connections in the SMTP pool", lambda: smtp_pool.idle)
@@ -1,148 +1,167 @@
 from __future__ import annotations
 
-import dataclasses
 import logging
-from typing import Dict
 
 import telebot
 from django.conf import settings
-
-from tenders_bot.apps import TendersConfig
-from tenders_bot.models import Node
-from tenders_bot.settings import TELEBOT_NUM_THREADS
+from django.core.files.storage import default_storage
+from django.db import connection, connections
+from telebot import apihelper
+
+from tenders_bot.db import managed_connection
+from tenders_bot.dispatcher import UpdateDispatcher, run_polling, update_chat_id
+from tenders_bot.metrics import (
+    UPDATE_DB_QUERIES,
+    UPDATE_SECONDS,
+    Gauge,
+    observe_handler,
+)
+from tenders_bot.models import File
+from tenders_bot.navigation import (
+    Call,
+    RememberFileId,
+    ResetState,
+    StartInput,
+    UploadFile,
+    file_steps,
+    navigate_steps,
+    navigation_steps,
+    node_steps,
+    run_steps,
+    start_steps,
+)
+from tenders_bot.node_tree import FileSnapshot, NavData, NodeSnapshot, get_node_tree, remember_snapshot_file_id
+from tenders_bot.outbound import BULK, ScheduledBot, scheduler
+from tenders_bot.settings import TELEBOT_NUM_THREADS, TELEGRAM_STORAGE_CHAT_ID
+from tenders_bot.tracing import start_trace, trace_queries
+from tenders_bot.transport import transport
+from tenders_bot.user_state import UserState, user_states
 
 logger = logging.getLogger(__name__)
 
-# Создаем экземпляр бота
-bot = telebot.TeleBot(settings.TELEGRAM_TOKEN, num_threads=TELEBOT_NUM_THREADS)
-
-# Функция запуска бота
-def telegram_bot_main(thread_patch_function=None):
+# Запросы к Bot API идут через свой транспорт: пул соединений, таймауты по методу, повторы после сбоев,
+# замер времени и кодов ответа
+apihelper.CUSTOM_REQUEST_SENDER = transport.request
+
+# Создаем экземпляр бота. Обработчики вызываются в потоках диспетчера, поэтому свой пул потоков боту не нужен
+bot = telebot.TeleBot(settings.TELEGRAM_TOKEN, threaded=False)
+# Все отправки в чаты идут через планировщик с учётом лимитов Telegram
+sender = ScheduledBot(bot, scheduler)
+bulk_sender = ScheduledBot(bot, scheduler, BULK)  # фоновые отправки уступают ответам пользователям
+
+
+# Обработка одного обновления всеми зарегистрированными обработчиками
+def process_update(update: telebot.types.Update):
+    from tenders_bot import feedback  # noqa: F401 регистрирует обработчики формы обратной связи
+
+    queries = 0
+
+    def count_queries(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    attributes = {"telegram.update_id": update.update_id, "telegram.chat_id": update_chat_id(update)}
+    try:
+        with (
+            UPDATE_SECONDS.time(),
+            start_trace("telegram.update", attributes=attributes),
+            managed_connection(),
+            connection.execute_wrapper(count_queries),
+            connection.execute_wrapper(trace_queries),
+        ):
+            bot.process_new_updates([update])
+    finally:
+        UPDATE_DB_QUERIES.observe(queries)
+
+
+# Обновления одного чата обрабатываются по порядку, разных чатов - параллельно
+dispatcher = UpdateDispatcher(process_update, num_workers=TELEBOT_NUM_THREADS)
+
+# Метрики, которые считаются в момент опроса /metrics
+Gauge("tenders_bot_dispatcher_workers", "Dispatcher worker threads", lambda: dispatcher.num_workers)
+Gauge("tenders_bot_dispatcher_busy_workers", "Dispatcher workers processing an update now", lambda: dispatcher.busy)
+Gauge("tenders_bot_dispatcher_queued_updates", "Updates waiting in dispatcher queues", lambda: sum(dispatcher.queue_sizes()))
+Gauge("tenders_bot_user_states", "Stored user states", lambda: len(user_states))
+Gauge(
+    "tenders_bot_outbound_waiting", "Outbound Telegram calls waiting for a rate limit token",
+    lambda: {(priority,): count for priority, count in scheduler.stats()["waiting"].items()}, ("priority",),
+)
+Gauge("tenders_bot_outbound_rate_limited", "Telegram 429 responses", lambda: scheduler.stats()["rate_limited"])
+
+# Функция запуска бота в режиме polling
+# stop_event - остановить опрос (уже полученные обновления дорабатывает диспетчер)
+def telegram_bot_main(thread_patch_function=None, stop_event=None):
     if thread_patch_function is not None:
         thread_patch_function()
-    bot.infinity_polling(long_polling_timeout=5, timeout=10)  # запускается бот в бесконечный цикл
-
+    bot.remove_webhook()  # пока webhook установлен, Telegram не отдаёт обновления через getUpdates
+    run_polling(bot, dispatcher, stop_event, timeout=10, long_polling_timeout=5)  # запускается бот в бесконечный цикл
 
-# Глобальный словарь состояний по chat_id
-user_states: Dict[str, UserState] = {}
 
-# Класс состояний пользователя
-@dataclasses.dataclass
-class UserState:
-    return_to_node: Node = None
-    entering_feedback: bool = True
-
-# Сброс состояния пользователя
+# Сброс состояния пользователя (отсутствие состояния в хранилище и есть начальное состояние)
 def reset_state(chat_id):
-    user_states[chat_id] = UserState()
-
-
-# Навигационные данные - сериализация переходов между узлами
-@dataclasses.dataclass
-class NavData:
-    nav_to_node: Node
-    direction: str  # 'r' for root, 'b' for back, 'f' for forward
-    PREFIX = "nav:"
-
-    # Преобразуем объект в строку для callback_data
-    def serialize(self) -> str:
-        return f"{self.PREFIX}{self.nav_to_node.id}|{self.direction}"
-
-    # Обратная операция: из строки получаем NavData
-    @staticmethod
-    def deserialize(data: str):
-        if not NavData.check(data):
-            raise ValueError("Invalid data format, missing 'nav:' prefix")
-
-        content = data[len(NavData.PREFIX) :]
-        parts = content.split("|")
+    user_states.delete(chat_id)
 
-        node = Node.objects.get(id=int(parts[0]))
 
-        return NavData(nav_to_node=node, direction=parts[1])
+# Выполнить шаг навигации (tenders_bot.navigation) в потоке обработчика
+def execute_step(step):
+    if isinstance(step, Call):
+        return getattr(sender, step.method)(*step.args, **step.kwargs)
+    if isinstance(step, ResetState):
+        return reset_state(step.chat_id)
+    if isinstance(step, UploadFile):
+        with default_storage.open(step.file.name, "rb") as content:
+            return sender.send_document(step.chat_id, content)
+    if isinstance(step, RememberFileId):
+        return remember_file_id(step.file.id, step.file.name, step.telegram_file_id)
+    if isinstance(step, StartInput):
+        return process_input_node(step.chat_id, step.node)
+    raise TypeError(f"Unknown navigation step {step!r}")
 
-    @staticmethod
-    def check(data: str) -> bool:
-        return data.startswith(NavData.PREFIX)
 
 # Обработка команды /start
 @bot.message_handler(commands=["start"])
+@observe_handler
 def start(message):
-    logger.info(f'User entered "start": {message.from_user.username}')
-    send_node(message.chat.id, TendersConfig.root_node, False)  # Отправка корневого узла
-
-# Отправка узла пользователю
-def send_node(chat_id, node, only_nav):
-    node.refresh_from_db() # Обновляем данные узла
-    reset_state(chat_id) # Сбрасываем состояние пользователя
-
-    if not only_nav:
-        if node.text:
-            bot.send_message(chat_id, node.text, parse_mode="HTML", disable_web_page_preview=True)
-
-        if len(node.files.all()) != 0:
-            send_files(chat_id, node)
-
-    if node.input_function:
-        process_input_node(chat_id, node)
-    else:
-        send_navigation(chat_id, node)
-
-# Отправка прикрепленных к узлу файлов
-def send_files(chat_id, node):
-    message = bot.send_message(chat_id, "Отправляем файлы, подождите немного...")
-    for file in node.files.all():
-        bot.send_document(chat_id, file.file)
-    message_id = message.id if message else None
-    bot.delete_message(chat_id, message_id)
-
-# Отправка кнопок навигации
-def send_navigation(chat_id, node):
-    markup = telebot.types.InlineKeyboardMarkup()
-    child_nodes = node.child_nodes.all()
-
-    if len(child_nodes) == 0:
-        if node.parent_node is None:
-            logger.warning(f"Node {node.id} has neither a parent nor a child node")
-        else:
-            send_node(chat_id, node.parent_node, True)
-        return
-
-# Добавляем кнопки для дочерних узлов
-    for child_node in child_nodes:
-        nav_data = NavData(nav_to_node=child_node, direction="f")
-        markup.add(telebot.types.InlineKeyboardButton(child_node.button_text, callback_data=nav_data.serialize()))
-
-# Если родитель есть, то добавляем кнопку Назад
-    if node.parent_node:
-        back_nav_data = NavData(nav_to_node=node.parent_node, direction="b")
-        markup.add(telebot.types.InlineKeyboardButton("Назад", callback_data=back_nav_data.serialize()))
-
-# Если родитель не корневой узел, то добавляем кнопку "В начало"
-        if node.parent_node != TendersConfig.root_node:
-            to_root_nav_data = NavData(nav_to_node=TendersConfig.root_node, direction="r")
-            markup.add(telebot.types.InlineKeyboardButton("В начало", callback_data=to_root_nav_data.serialize()))
-
-    bot.send_message(chat_id, node.nav_text, reply_markup=markup, parse_mode="HTML", disable_web_page_preview=True)
+    run_steps(start_steps(message, get_node_tree()), execute_step)
+
+# Отправка узла пользователю (узел берётся из снимка дерева, в базу не ходим)
+def send_node(chat_id, node: NodeSnapshot, only_nav):
+    run_steps(node_steps(chat_id, node, only_nav), execute_step)
+
+# Отправка одного файла: по сохранённому file_id, а если его нет - загрузкой содержимого
+def send_node_file(chat_id, file: FileSnapshot):
+    run_steps(file_steps(chat_id, file), execute_step)
+
+# Сохраняем file_id загруженного файла, чтобы больше его не загружать
+def remember_file_id(file_pk, file_name, telegram_file_id):
+    # Если файл успели заменить в админке, его новое содержимое с этим file_id не совпадает
+    updated = File.objects.filter(pk=file_pk, file=file_name).update(telegram_file_id=telegram_file_id)
+    if updated:
+        remember_snapshot_file_id(file_pk, file_name, telegram_file_id)
+
+# Заранее загружаем новые файлы узлов в служебный чат, чтобы ни один пользователь не ждал загрузки
+def prewarm_files(file_pks):
+    try:
+        for file in File.objects.filter(pk__in=file_pks, telegram_file_id__isnull=True):
+            with file.file.open("rb") as content:
+                message = bulk_sender.send_document(TELEGRAM_STORAGE_CHAT_ID, content)
+            remember_file_id(file.pk, file.file.name, message.document.file_id)
+            logger.info("Uploaded %s to the storage chat", file.file.name)
+    except Exception:
+        logger.exception("Exception while uploading files to the storage chat")
+    finally:
+        connections.close_all()  # функция выполняется в отдельном потоке
+
+# Отправка кнопок навигации (клавиатура собрана заранее в снимке дерева)
+def send_navigation(chat_id, node: NodeSnapshot):
+    run_steps(navigation_steps(chat_id, node), execute_step)
 
 # Обработка навигации по кнопкам
 @bot.callback_query_handler(func=lambda call: NavData.check(call.data))
+@observe_handler
 def navigate(call):
-    nav_data = NavData.deserialize(call.data)
-    node = nav_data.nav_to_node
-
-    # Для красивого отображения в интерфейсе
-    if nav_data.direction == "f":
-        where_to = node.button_text
-    elif nav_data.direction == "b":
-        where_to = "Назад"
-    else:
-        where_to = "В начало"
-
-    new_text = call.message.text + "\n\n> " + where_to
-    bot.edit_message_text(new_text, call.message.chat.id, call.message.id)
-
-    send_node(call.message.chat.id, node, only_nav=nav_data.direction != "f")
+    run_steps(navigate_steps(call), execute_step)
 
 
 # Обработка узлов где нужно вводить данные
@@ -154,12 +173,16 @@ def process_input_node(chat_id, node):
         "feedback": feedback_start,
     }
     if node.input_function in input_functions:
-        user_states[chat_id].return_to_node = node
+        user_states.set(chat_id, UserState(return_to_node_id=node.id))
         input_functions[node.input_function](chat_id, node)
     else:
         raise ValueError("There is a node in the database, for which input function does not exist.")
 
 # Завершение ввода данных — возврат к навигации
 def finish_input(chat_id):
-    node = user_states[chat_id].return_to_node
-    send_navigation(chat_id, node)
\ No newline at end of file
+    state = user_states.update(chat_id, entering_feedback=False)
+    tree = get_node_tree()  # за время ввода дерево могли изменить
+    if state.return_to_node_id is None:
+        send_navigation(chat_id, tree.root)  # состояние истекло - возвращаем в начало
+    else:
+        send_navigation(chat_id, tree.get(state.return_to_node_id))
\ No newline at end of file
@@ -0,0 +1,99 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from tenders_bot.admin import FeedbackAdmin, parse_feedback_id
+from tenders_bot.models import Feedback, File, Node, UserUploadedFile
+
+
+class TestFeedbackAdminSearch(TestCase):
+
+    def setUp(self):
+        self.admin = FeedbackAdmin(Feedback, AdminSite())
+        self.request = RequestFactory().get("/admin/tenders_bot/feedback/")
+        self.first = Feedback.objects.create(company="ООО Ромашка", text="Поставка бетона", submitted=True)
+        self.second = Feedback.objects.create(company="ИП Иванов", text="Реклама", submitted=True)
+
+    def search(self, term):
+        queryset, may_have_duplicates = self.admin.get_search_results(self.request, Feedback.objects.all(), term)
+        self.assertFalse(may_have_duplicates)
+        return list(queryset)
+
+    def test_parse_feedback_id(self):
+        self.assertEqual(parse_feedback_id("GKE-123"), 123)
+        self.assertEqual(parse_feedback_id("gke-7"), 7)
+        self.assertIsNone(parse_feedback_id("42"))
+        self.assertIsNone(parse_feedback_id("GKE-"))
+        self.assertIsNone(parse_feedback_id("Ромашка 1"))
+
+    def test_formatted_id_is_primary_key_lookup(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.search(f"GKE-{self.second.pk}"), [self.second])
+
+    def test_bare_number_matches_id_or_text(self):
+        third = Feedback.objects.create(company="ООО Прогресс", inn="7701234567", submitted=True)
+        self.assertEqual(self.search("7701234567"), [third])
+        self.assertIn(self.second, self.search(str(self.second.pk)))
+
+    def test_text_search_fallback(self):
+        self.assertEqual(self.search("Ромашка"), [self.first])
+        self.assertEqual(self.search("  "), [self.first, self.second])
+
+
+class TestChangelistQueryBudget(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(user)
+
+    def create_feedback(self, count):
+        for i in range(count):
+            feedback = Feedback.objects.create(company=f"Компания {i}", text="Длинный запрос " * 50, submitted=True)
+            UserUploadedFile.objects.create(feedback=feedback, file=f"user_uploads/{i}.pdf", size=1)
+
+    def create_nodes(self, count):
+        root = Node.objects.create(button_text="Root")
+        for i in range(count):
+            node = Node.objects.create(button_text=f"Node {i}", parent_node=root)
+            File.objects.create(node=node, file=f"nodes_content/{i}.pdf")
+
+    def assert_budget(self, url, create, budget):
+        # Число запросов не зависит от числа строк на странице
+        for rows in (3, 30):
+            create(rows)
+            with self.assertNumQueries(budget):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_feedback_changelist(self):
+        self.assert_budget(reverse("admin:tenders_bot_feedback_changelist"), self.create_feedback, 4)
+
+    def test_node_changelist(self):
+        self.assert_budget(reverse("admin:tenders_bot_node_changelist"), self.create_nodes, 5)
+
+    def test_feedback_keyset_pages(self):
+        self.create_feedback(5)
+        first_id, second_id, third_id = Feedback.objects.order_by("id").values_list("id", flat=True)[:3]
+        # Строку черновика переиспользовали: id маленький, а обращение самое новое. У двух обращений
+        # одинаковое время создания - порядок между ними задаёт id
+        Feedback.objects.filter(pk=first_id).update(created_at=timezone.now() + timedelta(minutes=1))
+        Feedback.objects.filter(pk=third_id).update(created_at=Feedback.objects.get(pk=second_id).created_at)
+        ids = list(Feedback.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+        self.assertEqual(ids[0], first_id)
+        url = reverse("admin:tenders_bot_feedback_changelist")
+
+        with patch.object(FeedbackAdmin, "list_per_page", 2):
+            first = self.client.get(url)
+            self.assertEqual([obj.pk for obj in first.context["cl"].result_list], ids[:2])
+            second = self.client.get(url + first.context["cl"].next_page_url)
+            third = self.client.get(url + second.context["cl"].next_page_url)
+
+        self.assertEqual([obj.pk for obj in second.context["cl"].result_list], ids[2:4])
+        self.assertEqual([obj.pk for obj in third.context["cl"].result_list], ids[4:])
+        self.assertContains(second, "Дальше")
+        self.assertEqual(second.context["cl"].result_list[0].uploaded_files_count, 1)
@@ -1,51 +1,119 @@
+import asyncio
+import threading
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
+import telebot
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
 
-from tenders_bot.telegram import NavData, navigate, send_node
+from tenders_bot import async_bot
+from tenders_bot.admin import FileInlineForm
+from tenders_bot.models import File, Node, NodeTreeVersion
+from tenders_bot.navigation import StartInput
+from tenders_bot.node_tree import build_node_tree, get_node_tree, invalidate_node_tree
+from tenders_bot.telegram import NavData, navigate, send_node, send_node_file
 
 
 class TestTelegramBot(TestCase):
 
+    def setUp(self):
+        # Небольшое дерево: корень -> раздел -> подраздел
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.root = Node.objects.create(button_text="Root", nav_text="Root nav")
+            self.section = Node.objects.create(button_text="Section", text="Section text", parent_node=self.root)
+            self.leaf = Node.objects.create(button_text="Leaf", text="Test node", parent_node=self.section)
+            File.objects.create(node=self.leaf, file="nodes_content/test_file.pdf")
+        self.assertEqual(len(callbacks), 1)  # дерево перестраивается один раз на транзакцию
+        self.tree = build_node_tree(version=1)
+
     @patch('tenders_bot.telegram.bot.send_message')
     @patch('tenders_bot.telegram.reset_state')
-    @patch('tenders_bot.models.Node')
-    def test_send_node_with_text(self, mock_node, mock_reset_state, mock_send_message):
-        # Mock node with text, no files, and no input function
-        mock_node_instance = MagicMock()
-        mock_node_instance.text = "Test node"
-        mock_node_instance.files.all.return_value = []
-        mock_node_instance.child_nodes.all.return_value = []
-        mock_node_instance.input_function = None
+    def test_send_node_with_text(self, mock_reset_state, mock_send_message):
+        node = self.tree.get(self.section.id)
 
         # Call function to test
-        send_node(12345, mock_node_instance, only_nav=False)
+        with self.assertNumQueries(0):
+            send_node(12345, node, only_nav=False)
 
         # Assertions
         mock_reset_state.assert_called_once_with(12345)  # Ensure state is reset
-        mock_send_message.assert_called_once_with(12345, "Test node", parse_mode="HTML", disable_web_page_preview=True)
+        mock_send_message.assert_any_call(12345, "Section text", parse_mode="HTML", disable_web_page_preview=True)
+        mock_send_message.assert_called_with(
+            12345, "-", reply_markup=node.markup, parse_mode="HTML", disable_web_page_preview=True
+        )
 
+    @patch('tenders_bot.telegram.default_storage.open')
+    @patch('tenders_bot.telegram.bot.delete_message')
     @patch('tenders_bot.telegram.bot.send_document')
     @patch('tenders_bot.telegram.bot.send_message')
-    @patch('tenders_bot.models.Node')
-    def test_send_node_with_files(self, mock_node, mock_send_message, mock_send_document):
-        # Mock node with files
-        mock_node_instance = MagicMock()
-        mock_file = MagicMock()
-        mock_file.file = "test_file"
-        mock_node_instance.files.all.return_value = [mock_file]
+    def test_send_node_with_files(self, mock_send_message, mock_send_document, mock_delete_message, mock_open):
+        mock_send_document.return_value.document.file_id = "telegram-file-id"
+        tree = get_node_tree()
 
         # Call function to test
-        send_node(12345, mock_node_instance, only_nav=False)
+        send_node(12345, tree.get(self.leaf.id), only_nav=False)
 
         # Assertions
         mock_send_message.assert_any_call(12345, "Отправляем файлы, подождите немного...")
-        mock_send_document.assert_called_with(12345, "test_file")  # Ensure file is sent
+        mock_open.assert_called_once_with("nodes_content/test_file.pdf", "rb")
+        mock_send_document.assert_called_with(12345, mock_open.return_value.__enter__.return_value)
+        self.assertEqual(File.objects.get(node=self.leaf).telegram_file_id, "telegram-file-id")
+        # file_id подставлен в текущий снимок, дерево не перестраивалось
+        self.assertIs(get_node_tree(), tree)
+        self.assertEqual(tree.version, NodeTreeVersion.objects.get(pk=1).version)
+        self.assertEqual(tree.get(self.leaf.id).files[0].telegram_file_id, "telegram-file-id")
+
+    @patch('tenders_bot.telegram.default_storage.open')
+    @patch('tenders_bot.telegram.bot.send_document')
+    def test_send_file_by_cached_file_id(self, mock_send_document, mock_open):
+        File.objects.filter(node=self.leaf).update(telegram_file_id="telegram-file-id")
+        file = build_node_tree(version=2).get(self.leaf.id).files[0]
+
+        send_node_file(12345, file)
+
+        mock_send_document.assert_called_once_with(12345, "telegram-file-id")
+        mock_open.assert_not_called()
+
+    def test_replacing_file_resets_file_id(self):
+        file = File.objects.get(node=self.leaf)
+        file.telegram_file_id = "telegram-file-id"
+        file.save()
+
+        form = FileInlineForm(
+            data={}, files={"file": SimpleUploadedFile("new.pdf", b"new content")}, instance=file
+        )
+        self.assertTrue(form.is_valid())
+        with patch.object(file.file.field.storage, "save", return_value="nodes_content/new.pdf"):
+            form.save()
+        file.refresh_from_db()
+        self.assertIsNone(file.telegram_file_id)
 
+    def test_tree_snapshot_links(self):
+        leaf = self.tree.get(self.leaf.id)
+        self.assertEqual(self.tree.root.id, self.root.id)
+        self.assertEqual(leaf.parent_node.id, self.section.id)
+        self.assertEqual([n.id for n in self.tree.root.child_nodes], [self.section.id])
+        self.assertIsNone(leaf.markup)
+        self.assertIn('"callback_data": "nav:%d|b"' % self.root.id, self.tree.get(self.section.id).markup)
+
+    def test_tree_rebuilt_on_version_change(self):
+        Node.objects.filter(pk=self.leaf.pk).update(text="Changed")
+        invalidate_node_tree()
+        version = NodeTreeVersion.objects.get(pk=1).version
+        tree = get_node_tree()
+        self.assertEqual(tree.version, version)
+        self.assertEqual(tree.get(self.leaf.id).text, "Changed")
+
+        # Другой процесс поменял версию - снимок перестраивается при следующей сверке
+        NodeTreeVersion.objects.filter(pk=1).update(version=version + 1)
+        with patch('tenders_bot.node_tree._checked_at', 0.0):
+            self.assertEqual(get_node_tree().version, version + 1)
+
+    @patch('tenders_bot.navigation.node_steps', return_value=iter(()))
     @patch('tenders_bot.telegram.NavData.deserialize')
     @patch('tenders_bot.telegram.bot.edit_message_text')
-    def test_navigate_forward(self, mock_edit_message_text, mock_deserialize):
+    def test_navigate_forward(self, mock_edit_message_text, mock_deserialize, mock_node_steps):
         # Mocking NavData and its output
         mock_nav_data = MagicMock()
         mock_nav_data.nav_to_node = MagicMock()
@@ -68,9 +136,10 @@ class TestTelegramBot(TestCase):
             "Original Text\n\n> Forward", 12345, 6789
         )
 
+    @patch('tenders_bot.navigation.node_steps', return_value=iter(()))
     @patch('tenders_bot.telegram.NavData.deserialize')
     @patch('tenders_bot.telegram.bot.edit_message_text')
-    def test_navigate_back(self, mock_edit_message_text, mock_deserialize):
+    def test_navigate_back(self, mock_edit_message_text, mock_deserialize, mock_node_steps):
         # Mocking NavData and its output
         mock_nav_data = MagicMock()
         mock_nav_data.nav_to_node = MagicMock()
@@ -104,18 +173,20 @@ class TestTelegramBot(TestCase):
         self.assertEqual(serialized, expected)  # Ensure correct serialization format
 
     def test_navdata_deserialize_valid_data(self):
-        # Setup mock node object
-        mock_node = MagicMock()
-        with patch('tenders_bot.models.Node.objects.get') as mock_get:
-            mock_get.return_value = mock_node
-
+        with patch('tenders_bot.node_tree.get_node_tree', return_value=self.tree):
             # Test valid data
-            data = "nav:123|f"
+            data = f"nav:{self.leaf.id}|f"
             nav_data = NavData.deserialize(data)
 
-            self.assertEqual(nav_data.nav_to_node, mock_node)
+            self.assertEqual(nav_data.nav_to_node, self.tree.get(self.leaf.id))
             self.assertEqual(nav_data.direction, "f")
 
+    def test_navdata_deserialize_from_given_tree(self):
+        with patch('tenders_bot.node_tree.get_node_tree') as mock_get_node_tree:
+            nav_data = NavData.deserialize(f"nav:{self.leaf.id}|b", self.tree)
+        mock_get_node_tree.assert_not_called()
+        self.assertEqual(nav_data.nav_to_node, self.tree.get(self.leaf.id))
+
     def test_navdata_deserialize_invalid_data(self):
         # Test invalid data
         with self.assertRaises(ValueError):
@@ -127,5 +198,93 @@ class TestTelegramBot(TestCase):
         self.assertFalse(NavData.check("invalid"))
 
 
+class TestAsyncEngine(TestCase):
+
+    def setUp(self):
+        self.root = Node.objects.create(button_text="Root", nav_text="Root nav")
+        self.section = Node.objects.create(button_text="Section", text="Section text", parent_node=self.root)
+        self.form = Node.objects.create(button_text="Form", input_function="feedback", parent_node=self.root)
+        self.tree = build_node_tree(version=1)
+
+    def update(self, **fields):
+        return telebot.types.Update.de_json({"update_id": 1, **fields})
+
+    def callback(self, data):
+        chat = {"id": 42, "type": "private"}
+        return self.update(callback_query={
+            "id": "1", "chat_instance": "1", "data": data, "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+            "message": {"message_id": 5, "date": 1, "chat": chat, "text": "menu"},  # date 0 - недоступное сообщение
+        })
+
+    def message(self, text):
+        chat = {"id": 42, "type": "private"}
+        return self.update(message={
+            "message_id": 5, "date": 0, "chat": chat, "from": {"id": 42, "is_bot": False, "first_name": "Test"}, "text": text,
+        })
+
+    def test_routing(self):
+        self.assertTrue(async_bot.handled_natively(self.message("/start"), self.tree))
+        self.assertTrue(async_bot.handled_natively(self.callback(f"nav:{self.section.id}|f"), self.tree))
+        # Форма ввода и прочие сообщения обрабатываются синхронными обработчиками в потоках
+        self.assertFalse(async_bot.handled_natively(self.callback(f"nav:{self.form.id}|f"), self.tree))
+        self.assertFalse(async_bot.handled_natively(self.message("Текст обращения"), self.tree))
+
+    def test_navigate(self):
+        sender = AsyncMock()
+        with patch('tenders_bot.async_bot.async_sender', sender):
+            asyncio.run(async_bot.navigate(self.callback(f"nav:{self.section.id}|f").callback_query, self.tree))
+
+        sender.edit_message_text.assert_awaited_once_with("menu\n\n> Section", 42, 5)
+        sender.send_message.assert_any_await(42, "Section text", parse_mode="HTML", disable_web_page_preview=True)
+        node = self.tree.root  # у раздела нет дочерних узлов - показываем навигацию родителя
+        sender.send_message.assert_awaited_with(
+            42, node.nav_text, reply_markup=node.markup, parse_mode="HTML", disable_web_page_preview=True
+        )
+
+    def test_database_steps_of_different_chats_run_concurrently(self):
+        # Начало ввода в каждом чате ждёт, пока его начнёт и другой чат - если шаги с базой идут
+        # по очереди в одном потоке, ожидание не дождётся
+        both_started = threading.Barrier(2, timeout=5)
+        node = self.tree.get(self.form.id)
+
+        async def start_both():
+            await asyncio.gather(*(async_bot.execute_step(StartInput(chat_id, node)) for chat_id in (1, 2)))
+
+        with patch('tenders_bot.async_bot.process_input_node', side_effect=lambda *args: both_started.wait()):
+            asyncio.run(start_both())
+
+
+class TestNodePaths(TestCase):
+
+    def setUp(self):
+        self.root = Node.objects.create(button_text="Root")
+        self.section = Node.objects.create(button_text="Section", parent_node=self.root)
+        self.leaves = [
+            Node.objects.create(button_text=f"Leaf {i}", parent_node=self.section) for i in range(5)
+        ]
+        self.deep = Node.objects.create(button_text="Deep", parent_node=self.leaves[0])
+
+    def test_paths(self):
+        self.assertEqual(Node.objects.get(pk=self.deep.pk).path, "Root – Section – Leaf 0 – Deep")
+
+    def test_rename_updates_subtree_in_bulk(self):
+        self.section.button_text = "Renamed"
+        # Сохранение, загрузка дерева и один bulk_update вне зависимости от размера поддерева (+ savepoint)
+        with self.assertNumQueries(5):
+            with self.captureOnCommitCallbacks():
+                self.section.save()
+
+        self.assertEqual(Node.objects.get(pk=self.leaves[3].pk).path, "Root – Renamed – Leaf 3")
+        self.assertEqual(Node.objects.get(pk=self.deep.pk).path, "Root – Renamed – Leaf 0 – Deep")
+
+    def test_recompute_skips_consistent_tree(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(Node.recompute_paths(), 0)
+
+        Node.objects.filter(pk=self.deep.pk).update(path="stale")
+        self.assertEqual(Node.recompute_paths(), 1)
+        self.assertEqual(Node.objects.get(pk=self.deep.pk).path, "Root – Section – Leaf 0 – Deep")
+
+
 if __name__ == '__main__':
     unittest.main()
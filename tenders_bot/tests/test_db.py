@@ -0,0 +1,38 @@
+from unittest.mock import MagicMock, patch
+
+from django.test import SimpleTestCase
+
+from tenders_bot.db import managed_connection
+from tenders_bot.metrics import DB_CONNECTION_WAIT_SECONDS
+
+
+class TestManagedConnection(SimpleTestCase):
+
+    def setUp(self):
+        self.connection = MagicMock()
+        patcher = patch('tenders_bot.db.connections', {"default": self.connection})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('tenders_bot.db.close_old_connections')
+        self.close_old_connections = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def observed(self):
+        return DB_CONNECTION_WAIT_SECONDS._values.get((), [0, 0])[-1]
+
+    def test_connection_checked_before_update(self):
+        before = self.observed()
+        with managed_connection() as connection:
+            self.assertIs(connection, self.connection)
+            # Соединение готово до обработчиков: истёкшие закрыты, простоявшее проверено
+            self.close_old_connections.assert_called_once_with()
+            self.connection.close_if_health_check_failed.assert_called_once_with()
+            self.connection.ensure_connection.assert_called_once_with()
+        self.assertEqual(self.close_old_connections.call_count, 2)
+        self.assertEqual(self.observed(), before + 1)
+
+    def test_broken_connection_closed_after_failed_update(self):
+        with self.assertRaises(RuntimeError):
+            with managed_connection():
+                raise RuntimeError("handler failed")
+        self.assertEqual(self.close_old_connections.call_count, 2)
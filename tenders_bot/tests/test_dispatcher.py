@@ -0,0 +1,217 @@
+import asyncio
+import threading
+import time
+
+import telebot
+from django.test import SimpleTestCase
+
+from tenders_bot.dispatcher import AsyncUpdateDispatcher, UpdateDispatcher, run_async_polling, run_polling, update_chat_id
+
+
+def message_update(update_id, chat_id, text="text"):
+    return telebot.types.Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    })
+
+
+def callback_update(update_id, chat_id):
+    return telebot.types.Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": "1",
+            "data": "nav",
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+            "message": {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": "menu"},
+        },
+    })
+
+
+class TestUpdateDispatcher(SimpleTestCase):
+
+    def make_dispatcher(self, process, num_workers=4):
+        dispatcher = UpdateDispatcher(process, num_workers=num_workers)
+        self.addCleanup(dispatcher.stop, 5)
+        return dispatcher
+
+    def test_chat_id(self):
+        self.assertEqual(update_chat_id(message_update(1, 42)), 42)
+        self.assertEqual(update_chat_id(callback_update(1, -100500)), -100500)
+        self.assertIsNone(update_chat_id(telebot.types.Update.de_json({"update_id": 1})))
+
+    def test_same_chat_in_order_and_not_concurrent(self):
+        processed = []
+        running = set()
+        overlaps = []
+
+        def process(update):
+            chat_id = update_chat_id(update)
+            if chat_id in running:
+                overlaps.append(update.update_id)
+            running.add(chat_id)
+            time.sleep(0.001)
+            processed.append((chat_id, update.update_id))
+            running.discard(chat_id)
+
+        dispatcher = self.make_dispatcher(process)
+        for update_id in range(40):
+            dispatcher.dispatch(message_update(update_id, update_id % 5))
+        dispatcher.join()
+
+        self.assertEqual(overlaps, [])
+        for chat_id in range(5):
+            ids = [update_id for c, update_id in processed if c == chat_id]
+            self.assertEqual(ids, sorted(ids))
+            self.assertEqual(len(ids), 8)
+
+    def test_chats_processed_in_parallel(self):
+        # Обработчик первого чата ждёт, пока не будет обработан второй - без параллельности тест зависнет
+        second_done = threading.Event()
+
+        def process(update):
+            if update_chat_id(update) == 1:
+                self.assertTrue(second_done.wait(5))
+            else:
+                second_done.set()
+
+        dispatcher = self.make_dispatcher(process, num_workers=2)
+        first = dispatcher.dispatch(message_update(1, 1))
+        dispatcher.dispatch(message_update(2, 2))
+
+        first.result(5)
+
+    def test_exception_does_not_stop_worker(self):
+        def process(update):
+            if update.update_id == 1:
+                raise RuntimeError("handler failed")
+
+        dispatcher = self.make_dispatcher(process, num_workers=1)
+        failed = dispatcher.dispatch(message_update(1, 1))
+        ok = dispatcher.dispatch(message_update(2, 1))
+
+        self.assertIsNone(ok.result(5))
+        self.assertIsInstance(failed.exception(5), RuntimeError)
+
+    def test_stop_reports_busy_workers(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def process(update):
+            if update_chat_id(update) == 1:
+                release.wait(5)
+
+        dispatcher = self.make_dispatcher(process, num_workers=2)
+        dispatcher.dispatch(message_update(1, 1))
+        dispatcher.dispatch(message_update(2, 2)).result(5)
+
+        self.assertEqual(dispatcher.stop(timeout=0.1), {dispatcher.chat_shard(1)})
+
+    def test_polling_advances_offset(self):
+        stop = threading.Event()
+        offsets = []
+
+        class FakeBot:
+            def get_updates(self, offset, timeout, long_polling_timeout):
+                offsets.append(offset)
+                if len(offsets) == 1:
+                    return [message_update(7, 1), message_update(8, 2)]
+                stop.set()
+                return []
+
+        dispatched = []
+        dispatcher = self.make_dispatcher(lambda update: dispatched.append(update.update_id))
+        run_polling(FakeBot(), dispatcher, stop)
+        dispatcher.join()
+
+        self.assertEqual(offsets, [None, 9])
+        self.assertEqual(sorted(dispatched), [7, 8])
+
+
+class TestAsyncUpdateDispatcher(SimpleTestCase):
+
+    def test_same_chat_in_order_and_not_concurrent(self):
+        processed = []
+        running = set()
+        overlaps = []
+
+        async def process(update):
+            chat_id = update_chat_id(update)
+            if chat_id in running:
+                overlaps.append(update.update_id)
+            running.add(chat_id)
+            await asyncio.sleep(0.001 * (update.update_id % 3))
+            processed.append((chat_id, update.update_id))
+            running.discard(chat_id)
+
+        async def run():
+            dispatcher = AsyncUpdateDispatcher(process, max_concurrent=8)
+            for update_id in range(40):
+                await dispatcher.dispatch(message_update(update_id, update_id % 5))
+            await dispatcher.join(5)
+            return dispatcher
+
+        dispatcher = asyncio.run(run())
+
+        self.assertEqual(overlaps, [])
+        for chat_id in range(5):
+            ids = [update_id for c, update_id in processed if c == chat_id]
+            self.assertEqual(ids, sorted(ids))
+            self.assertEqual(len(ids), 8)
+        self.assertEqual((dispatcher.busy, dispatcher.pending(), dispatcher._chats), (0, 0, {}))
+
+    def test_backpressure_and_failures(self):
+        in_progress = []
+        peak = []
+
+        async def process(update):
+            in_progress.append(update.update_id)
+            peak.append(len(in_progress))
+            await asyncio.sleep(0.001)
+            in_progress.remove(update.update_id)
+            if update.update_id == 1:
+                raise RuntimeError("handler failed")
+
+        async def run():
+            dispatcher = AsyncUpdateDispatcher(process, max_concurrent=2)
+            tasks = [await dispatcher.dispatch(message_update(update_id, update_id)) for update_id in range(6)]
+            await dispatcher.join(5)
+            return tasks
+
+        tasks = asyncio.run(run())
+
+        self.assertEqual(max(peak), 2)
+        self.assertTrue(all(task.done() and task.exception() is None for task in tasks))
+
+    def test_polling_advances_offset(self):
+        stop = threading.Event()
+        offsets = []
+
+        class FakeBot:
+            async def get_updates(self, offset, timeout, request_timeout):
+                offsets.append(offset)
+                if len(offsets) == 1:
+                    return [message_update(7, 1), message_update(8, 2)]
+                stop.set()
+                return []
+
+        dispatched = []
+
+        async def process(update):
+            dispatched.append(update.update_id)
+
+        async def run():
+            dispatcher = AsyncUpdateDispatcher(process)
+            await run_async_polling(FakeBot(), dispatcher, stop)
+            await dispatcher.join(5)
+
+        asyncio.run(run())
+
+        self.assertEqual(offsets, [None, 9])
+        self.assertEqual(sorted(dispatched), [7, 8])
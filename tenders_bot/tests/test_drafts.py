@@ -0,0 +1,84 @@
+from unittest.mock import MagicMock, patch
+
+from django.test import TestCase
+
+from tenders_bot.drafts import DraftCache
+from tenders_bot.feedback import _feedback_start, feedback_process_input
+from tenders_bot.models import Feedback, UserUploadedFile
+
+
+def text_message(text, chat_id=12345):
+    message = MagicMock()
+    message.chat.id = chat_id
+    message.text = text
+    message.document = None
+    message.photo = None
+    message.from_user.username = "supplier"
+    message.from_user.first_name = "Иван"
+    message.from_user.last_name = None
+    return message
+
+
+@patch('tenders_bot.feedback.bot.edit_message_reply_markup')
+@patch('tenders_bot.feedback.bot.send_message', return_value=MagicMock(id=777))
+class TestFeedbackDrafts(TestCase):
+
+    def setUp(self):
+        self.drafts = DraftCache(write_behind=True)
+        patcher = patch('tenders_bot.feedback.drafts', self.drafts)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_draft_row_reused(self, mock_send_message, mock_edit):
+        old = Feedback.objects.create(telegram_chat_id=12345, company="Old company", next_field="text")
+        UserUploadedFile.objects.create(feedback=old, file="user_uploads/old.pdf", size=1)
+
+        _feedback_start(12345, None, Feedback.FeedbackType.GENERAL)
+
+        draft = Feedback.objects.get(telegram_chat_id=12345, submitted=False)
+        self.assertEqual(draft.pk, old.pk)
+        self.assertIsNone(draft.company)
+        self.assertEqual(draft.next_field, "company")
+        self.assertFalse(draft.uploaded_files.exists())
+
+    def test_input_is_written_behind(self, mock_send_message, mock_edit):
+        _feedback_start(12345, None, Feedback.FeedbackType.GENERAL)
+
+        with self.assertNumQueries(0):
+            feedback_process_input(text_message("ООО Ромашка"))
+            feedback_process_input(text_message("7700000000"))
+
+        draft = self.drafts.get(12345)
+        self.assertEqual((draft.company, draft.inn, draft.next_field), ("ООО Ромашка", "7700000000", "name"))
+        self.assertEqual(draft.telegram_sent_message_id, 777)
+        # В базе черновик пока не менялся
+        self.assertIsNone(Feedback.objects.get(pk=draft.pk).company)
+
+        self.drafts.flush(draft)
+        self.assertEqual(Feedback.objects.get(pk=draft.pk).inn, "7700000000")
+
+    def test_checkpoint_writes_only_changed_fields(self, mock_send_message, mock_edit):
+        self.drafts.write_behind = False
+        _feedback_start(12345, None, Feedback.FeedbackType.GENERAL)
+
+        with self.assertNumQueries(1):  # один UPDATE только изменённых полей
+            feedback_process_input(text_message("ООО Ромашка"))
+
+        self.assertEqual(Feedback.objects.get(telegram_chat_id=12345).company, "ООО Ромашка")
+
+    def test_flush_all_on_shutdown(self, mock_send_message, mock_edit):
+        _feedback_start(12345, None, Feedback.FeedbackType.GENERAL)
+        feedback_process_input(text_message("ООО Ромашка"))
+
+        self.assertEqual(self.drafts.flush_all(), 1)
+        self.assertEqual(Feedback.objects.get(telegram_chat_id=12345).company, "ООО Ромашка")
+        self.assertEqual(self.drafts.flush_all(), 0)  # повторно писать нечего
+
+    def test_flush_all_skips_busy_chats(self, mock_send_message, mock_edit):
+        _feedback_start(12345, None, Feedback.FeedbackType.GENERAL)
+        feedback_process_input(text_message("ООО Ромашка"))
+
+        # Поток чата не остановился - его черновик не трогаем, изменения остаются в кэше
+        self.assertEqual(self.drafts.flush_all(lambda chat_id: chat_id != 12345), 0)
+        self.assertIsNone(Feedback.objects.get(telegram_chat_id=12345).company)
+        self.assertEqual(self.drafts.flush_all(), 1)
@@ -0,0 +1,84 @@
+import csv
+import io
+import os
+import tempfile
+from unittest import skipIf
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from tenders_bot.export import CSV_BOM, CSV_DELIMITER, openpyxl, write_csv, write_xlsx
+from tenders_bot.models import Feedback, UserUploadedFile
+
+
+class TestFeedbackExport(TestCase):
+
+    def setUp(self):
+        self.first = Feedback.objects.create(company="ООО Ромашка", text="Поставка; бетона\nсрочно", submitted=True)
+        UserUploadedFile.objects.create(feedback=self.first, file="user_uploads/price.pdf", size=1)
+        UserUploadedFile.objects.create(feedback=self.first, file="user_uploads/card.docx", size=1)
+        self.second = Feedback.objects.create(company="ИП Иванов", submitted=True)
+        Feedback.objects.create(company="Черновик", submitted=False)
+
+    def read(self, content):
+        self.assertTrue(content.startswith(CSV_BOM))
+        return list(csv.reader(io.StringIO(content[len(CSV_BOM):]), delimiter=CSV_DELIMITER))
+
+    def test_write_csv(self):
+        output = io.StringIO()
+        # Обращения, вложения одной пачкой
+        with self.assertNumQueries(2):
+            count = write_csv(Feedback.objects.filter(submitted=True), output)
+
+        rows = self.read(output.getvalue())
+        self.assertEqual(count, 2)
+        self.assertEqual(rows[0][0], "Номер обращения")
+        self.assertEqual(rows[1][0], f"GKE-{self.first.pk}")
+        self.assertEqual(rows[1][9], "Поставка; бетона\nсрочно")
+        self.assertEqual(rows[1][-1], "price.pdf, card.docx")
+        self.assertEqual(rows[2][-1], "")
+
+    def test_formulas_escaped(self):
+        self.second.company = '=HYPERLINK("http://example.com","Открыть")'
+        self.second.comment = "@SUM(A1)"
+        self.second.save()
+        output = io.StringIO()
+        write_csv(Feedback.objects.filter(pk=self.second.pk), output)
+
+        row = self.read(output.getvalue())[1]
+        self.assertEqual(row[3], '\'=HYPERLINK("http://example.com","Открыть")')
+        self.assertEqual(row[11], "'@SUM(A1)")
+
+    @skipIf(openpyxl is None, "openpyxl is not installed")
+    def test_write_xlsx(self):
+        self.second.company = "=1+1"
+        self.second.save()
+        output = io.BytesIO()
+        count = write_xlsx(Feedback.objects.filter(submitted=True), output)
+
+        output.seek(0)
+        rows = list(openpyxl.load_workbook(output).active.iter_rows())
+        self.assertEqual(count, 2)
+        self.assertEqual(rows[1][0].value, f"GKE-{self.first.pk}")
+        self.assertEqual((rows[2][3].value, rows[2][3].data_type), ("=1+1", "s"))
+
+    def test_command_exports_submitted_only(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "feedback.csv")
+            call_command("export_feedback", "--output", path, stderr=io.StringIO())
+            with open(path, encoding="utf-8") as file:
+                rows = self.read(file.read())
+        self.assertEqual([row[3] for row in rows[1:]], ["ООО Ромашка", "ИП Иванов"])
+
+    def test_admin_action_streams_selected(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+        response = self.client.post(reverse("admin:tenders_bot_feedback_changelist"), {
+            "action": "export_csv",
+            "_selected_action": [self.second.pk],
+        })
+
+        self.assertTrue(response.streaming)
+        rows = self.read(b"".join(response.streaming_content).decode("utf-8"))
+        self.assertEqual([row[0] for row in rows[1:]], [f"GKE-{self.second.pk}"])
@@ -0,0 +1,66 @@
+import telebot
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from tenders_bot.loadtest import FakeBotApi, percentile, run_load_test
+from tenders_bot.models import Feedback, Node
+from tenders_bot.node_tree import invalidate_node_tree
+
+
+class TestFakeBotApi(SimpleTestCase):
+
+    def setUp(self):
+        self.api = FakeBotApi()
+        self.api.start()
+        self.addCleanup(self.api.stop)
+        previous = self.api.patch_urls()
+        self.addCleanup(FakeBotApi.restore_urls, previous)
+        self.bot = telebot.TeleBot("1:test", threaded=False)
+
+    def test_updates_and_messages(self):
+        self.api.push_update(message={
+            "message_id": 1, "date": 0, "chat": {"id": 5, "type": "private"}, "text": "/start",
+        })
+        updates = self.bot.get_updates(timeout=5, long_polling_timeout=1)
+        self.assertEqual([update.message.text for update in updates], ["/start"])
+        self.assertEqual(self.bot.get_updates(offset=updates[-1].update_id + 1, timeout=5, long_polling_timeout=1), [])
+
+        markup = telebot.types.InlineKeyboardMarkup()
+        markup.add(telebot.types.InlineKeyboardButton("Раздел", callback_data="nav:2|f"))
+        sent = self.bot.send_message(5, "Меню", reply_markup=markup)
+        _, received = self.api.inbox(5).get(timeout=1)
+        self.assertEqual(received["message_id"], sent.id)
+        self.assertEqual(received["reply_markup"]["inline_keyboard"][0][0]["callback_data"], "nav:2|f")
+
+    def test_file_download(self):
+        file_id = self.api.add_file(b"content")
+        file_info = self.bot.get_file(file_id)
+        self.assertEqual(file_info.file_size, 7)
+        self.assertEqual(self.bot.download_file(file_info.file_path), b"content")
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertIsNone(percentile([], 50))
+
+
+# Короткий прогон на настоящем стеке бота
+@override_settings(MEDIA_ROOT="/tmp/tenders_bot_loadtest_media")
+class TestLoadTest(TransactionTestCase):
+
+    def test_run(self):
+        root = Node.objects.create(button_text="Root", nav_text="Root nav")
+        section = Node.objects.create(button_text="Section", text="Section text", parent_node=root)
+        Node.objects.create(button_text="Leaf", text="Leaf text", parent_node=section)
+        Node.objects.create(button_text="Feedback", input_function="feedback", parent_node=root)
+        invalidate_node_tree()
+
+        result = run_load_test(users=2, duration=1, think_time=0, feedback_share=1, attachment_size=1024, seed=1)
+
+        self.assertGreater(result["updates"], 0)
+        self.assertEqual(result["errors"], 0)
+        self.assertEqual(result["timeouts"], 0)
+        self.assertGreater(result["feedback_submitted"], 0)
+        self.assertIsNotNone(result["latency_ms"]["p99"])
+        self.assertGreater(result["db_queries_per_update"]["mean"], 0)
+        self.assertFalse(Feedback.objects.exists())  # данные имитируемых пользователей удалены
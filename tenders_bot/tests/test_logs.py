@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from tenders_bot.logs import ContextFilter, JsonFormatter, QueueingHandler, RateLimitFilter, dropped, log_context
+
+
+class TestLogs(SimpleTestCase):
+
+    def make_logger(self, *filters):
+        stream = StringIO()
+        handler = QueueingHandler(stream)
+        handler.setFormatter(JsonFormatter())
+        handler.addFilter(ContextFilter())
+        for log_filter in filters:
+            handler.addFilter(log_filter)
+        logger = logging.getLogger("tenders_bot.tests.logs")
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(handler.close)
+        return logger, handler, stream
+
+    def records(self, handler, stream):
+        handler.listener.stop()  # дожидаемся записи всей очереди
+        handler.listener.start()
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    def test_json_with_update_context(self):
+        logger, handler, stream = self.make_logger()
+        payload = {"step": 1}
+        with log_context(chat_id=42, update_id=7), log_context(handler="start"):
+            logger.info("Payload %s", payload)
+            payload["step"] = 2  # сообщение собрано в момент вызова
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError:
+            logger.exception("Failed")
+
+        first, second = self.records(handler, stream)
+        self.assertEqual(first["message"], "Payload {'step': 1}")
+        self.assertEqual((first["chat_id"], first["update_id"], first["handler"]), (42, 7, "start"))
+        self.assertEqual(first["level"], "INFO")
+        self.assertNotIn("chat_id", second)
+        self.assertIn("RuntimeError: boom", second["exception"])
+
+    def test_rate_limit_per_template(self):
+        logger, handler, stream = self.make_logger(RateLimitFilter(rate=1, burst=2))
+        with patch('tenders_bot.logs.time.monotonic', return_value=100.0):
+            for i in range(5):
+                logger.info("Hot event %s", i)
+            logger.info("Other event")
+            logger.warning("Warning %s", 1)
+            logger.warning("Warning %s", 2)
+        with patch('tenders_bot.logs.time.monotonic', return_value=101.0):
+            logger.info("Hot event %s", 5)
+
+        messages = [(record["message"], record.get("suppressed")) for record in self.records(handler, stream)]
+        self.assertEqual(messages, [
+            ("Hot event 0", None), ("Hot event 1", None), ("Other event", None),
+            ("Warning 1", None), ("Warning 2", None), ("Hot event 5", 3),
+        ])
+
+    def test_full_queue_drops_records(self):
+        logger, handler, stream = self.make_logger()
+        handler.listener.stop()
+        handler.queue.maxsize = 1
+        before = dropped["queue_full"]
+        logger.info("first")
+        logger.info("second")
+        self.assertEqual(dropped["queue_full"], before + 1)
+        handler.listener.start()
+        self.assertEqual([record["message"] for record in self.records(handler, stream)], ["first"])
+
+    def test_rotating_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = os.path.join(directory, "traces", "traces.jsonl")
+        handler = QueueingHandler(filename=filename, max_bytes=100, backup_count=1)
+        handler.setFormatter(logging.Formatter("{message}", style="{"))
+        record = logging.LogRecord("tenders_bot.traces", logging.INFO, __file__, 1, "%s", ("x" * 60,), None)
+        for _ in range(3):
+            handler.handle(record)
+        handler.close()
+
+        self.assertEqual(sorted(os.listdir(os.path.dirname(filename))), ["traces.jsonl", "traces.jsonl.1"])
+        with open(filename, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "x" * 60 + "\n")
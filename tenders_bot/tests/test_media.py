@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from tenders_bot.media import parse_range
+
+
+class TestMediaView(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        patcher = patch('tenders_bot.media.MEDIA_ROOT', media_root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.makedirs(os.path.join(media_root, "user_uploads"))
+        with open(os.path.join(media_root, "user_uploads", "card.pdf"), "wb") as f:
+            f.write(b"0123456789")
+        self.url = "/media/user_uploads/card.pdf"
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+
+    def content(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_staff_only(self):
+        self.client.logout()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("/admin/login/", response["Location"])
+
+    def test_full_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.content(response), b"0123456789")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertIn("private", response["Cache-Control"])
+
+    def test_range(self):
+        response = self.client.get(self.url, headers={"Range": "bytes=2-5"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.content(response), b"2345")
+        self.assertEqual(response["Content-Range"], "bytes 2-5/10")
+        self.assertEqual(response["Content-Length"], "4")
+
+        response = self.client.get(self.url, headers={"Range": "bytes=20-"})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */10")
+
+    def test_range_ignored_when_file_changed(self):
+        response = self.client.get(self.url, headers={"Range": "bytes=2-5", "If-Range": '"old"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.content(response), b"0123456789")
+
+    def test_conditional_requests(self):
+        response = self.client.get(self.url)
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+        response.close()
+
+        self.assertEqual(self.client.get(self.url, headers={"If-None-Match": etag}).status_code, 304)
+        self.assertEqual(self.client.get(self.url, headers={"If-Modified-Since": last_modified}).status_code, 304)
+
+    @patch('tenders_bot.media.MEDIA_SERVER', "nginx")
+    def test_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/user_uploads/card.pdf")
+        self.assertEqual(response.content, b"")
+
+    def test_path_traversal(self):
+        self.assertEqual(self.client.get("/media/../settings.py").status_code, 404)
+        self.assertEqual(self.client.get("/media/user_uploads/missing.pdf").status_code, 404)
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range("bytes=0-", 10), (0, 10))
+        self.assertEqual(parse_range("bytes=-3", 10), (7, 3))
+        self.assertEqual(parse_range("bytes=5-100", 10), (5, 5))
+        self.assertIsNone(parse_range("bytes=0-1,4-5", 10))
+        self.assertIsNone(parse_range(None, 10))
+        with self.assertRaises(ValueError):
+            parse_range("bytes=-0", 10)
@@ -0,0 +1,93 @@
+from unittest.mock import MagicMock, patch
+
+from django.test import SimpleTestCase
+
+from tenders_bot.metrics import (
+    HANDLER_ERRORS,
+    HANDLER_SECONDS,
+    TELEGRAM_REQUESTS,
+    Counter,
+    Histogram,
+    REGISTRY,
+    instrumented_request_sender,
+    observe_handler,
+)
+
+
+class TestMetrics(SimpleTestCase):
+
+    def make(self, metric_class, *args, **kwargs):
+        metric = metric_class(*args, **kwargs)
+        self.addCleanup(REGISTRY.remove, metric)
+        return metric
+
+    def test_histogram_render(self):
+        histogram = self.make(Histogram, "test_seconds", "Test", ("handler",), buckets=(0.1, 1))
+        histogram.observe(0.05, handler="start")
+        histogram.observe(0.1, handler="start")
+        histogram.observe(3, handler="start")
+
+        self.assertEqual(histogram.render().splitlines(), [
+            "# HELP test_seconds Test",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{handler="start",le="0.1"} 2',
+            'test_seconds_bucket{handler="start",le="1"} 2',
+            'test_seconds_bucket{handler="start",le="+Inf"} 3',
+            'test_seconds_sum{handler="start"} 3.15',
+            'test_seconds_count{handler="start"} 3',
+        ])
+
+    def test_counter_label_escaping(self):
+        counter = self.make(Counter, "test_total", "Test", ("error",))
+        counter.inc(error='say "hi"')
+        counter.inc(2, error='say "hi"')
+        self.assertIn('test_total{error="say \\"hi\\""} 3', counter.render())
+
+    def test_observe_handler(self):
+        @observe_handler
+        def failing_handler(message):
+            raise RuntimeError()
+
+        with self.assertRaises(RuntimeError):
+            failing_handler(MagicMock())
+
+        self.assertEqual(HANDLER_SECONDS.count(handler="failing_handler"), 1)
+        self.assertEqual(HANDLER_ERRORS.value(handler="failing_handler"), 1)
+
+    def test_telegram_requests_counted(self):
+        send = MagicMock(return_value=MagicMock(status_code=429))
+        sender = instrumented_request_sender(send)
+
+        before = TELEGRAM_REQUESTS.value(method="sendMessage", status="429")
+        response = sender("post", "https://api.telegram.org/bot1:token/sendMessage", params={"chat_id": 1})
+
+        self.assertIs(response, send.return_value)
+        send.assert_called_once_with("post", "https://api.telegram.org/bot1:token/sendMessage", params={"chat_id": 1})
+        self.assertEqual(TELEGRAM_REQUESTS.value(method="sendMessage", status="429"), before + 1)
+
+    def test_mixed_status_labels_render(self):
+        send = MagicMock(side_effect=[MagicMock(status_code=200), ConnectionError()])
+        sender = instrumented_request_sender(send)
+        sender("post", "https://api.telegram.org/bot1:token/getMe")
+        with self.assertRaises(ConnectionError):
+            sender("post", "https://api.telegram.org/bot1:token/getMe")
+
+        rendered = TELEGRAM_REQUESTS.render()
+        self.assertIn('tenders_bot_telegram_requests_total{method="getMe",status="200"}', rendered)
+        self.assertIn('tenders_bot_telegram_requests_total{method="getMe",status="ConnectionError"}', rendered)
+        counter = self.make(Counter, "test_mixed_total", "Test", ("status",))
+        counter.inc(status=200)
+        counter.inc(status="ReadTimeout")
+        self.assertIn('test_mixed_total{status="200"} 1', counter.render())
+
+    def test_view(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"# TYPE tenders_bot_handler_seconds histogram", response.content)
+        # Без токена извне отдаётся только сотрудникам
+        self.assertEqual(self.client.get("/metrics", REMOTE_ADDR="203.0.113.5").status_code, 403)
+
+        with patch('tenders_bot.metrics.METRICS_TOKEN', "secret"):
+            self.assertEqual(self.client.get("/metrics").status_code, 403)
+            response = self.client.get("/metrics", headers={"Authorization": "Bearer secret"})
+            self.assertEqual(response.status_code, 200)
@@ -0,0 +1,104 @@
+import asyncio
+from io import BytesIO
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from django.test import SimpleTestCase
+from telebot.apihelper import ApiTelegramException
+
+from tenders_bot.outbound import BULK, INTERACTIVE, AsyncScheduledBot, OutboundScheduler, ScheduledBot
+
+
+def too_many_requests(retry_after):
+    result = MagicMock(status_code=429)
+    return ApiTelegramException(
+        "sendMessage", result,
+        {"ok": False, "error_code": 429, "description": "Too Many Requests", "parameters": {"retry_after": retry_after}},
+    )
+
+
+class TestOutboundScheduler(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = [1000.0]
+        patcher = patch('tenders_bot.outbound.time.monotonic', side_effect=lambda: self.clock[0])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.scheduler = OutboundScheduler(global_rate=30, chat_rate=1, chat_burst=2, interactive_reserve=5)
+        # Ожидание не спит, а двигает часы
+        self.scheduler._lock.wait = lambda timeout=None: self.advance(timeout)
+
+    def advance(self, seconds):
+        self.clock[0] += seconds
+
+    def test_chat_limit(self):
+        for _ in range(4):
+            self.scheduler.call(1, MagicMock())
+        # Два сообщения уходят сразу, дальше - по одному в секунду
+        self.assertAlmostEqual(self.clock[0], 1002.0)
+        self.assertAlmostEqual(self.scheduler.stats()["delay_total"][INTERACTIVE], 2.0)
+
+    def test_other_chats_not_delayed(self):
+        for chat_id in range(20):
+            self.scheduler.call(chat_id, MagicMock())
+        self.assertEqual(self.clock[0], 1000.0)
+
+    def test_bulk_keeps_reserve_for_interactive(self):
+        for chat_id in range(25):
+            self.scheduler.call(chat_id, MagicMock(), priority=BULK)
+        self.assertEqual(self.clock[0], 1000.0)
+        # Следующей массовой отправке нужно дождаться токенов сверх резерва, а ответ пользователю уходит сразу
+        self.scheduler.call(100, MagicMock())
+        self.assertEqual(self.clock[0], 1000.0)
+        self.scheduler.call(101, MagicMock(), priority=BULK)
+        self.assertGreater(self.clock[0], 1000.0)
+
+    def test_retry_after_honored(self):
+        func = MagicMock(side_effect=[too_many_requests(5), "ok"])
+
+        self.assertEqual(self.scheduler.call(1, func, "text"), "ok")
+
+        self.assertEqual(func.call_count, 2)
+        self.assertGreaterEqual(self.clock[0], 1005.0)
+        self.assertEqual(self.scheduler.stats()["rate_limited"], 1)
+
+    def test_file_rewound_before_retry(self):
+        uploaded = []
+
+        def send_document(chat_id, document):
+            uploaded.append(document.read())
+            if len(uploaded) == 1:
+                raise too_many_requests(1)
+            return "ok"
+
+        self.assertEqual(self.scheduler.call(1, send_document, 1, BytesIO(b"company card")), "ok")
+        self.assertEqual(uploaded, [b"company card", b"company card"])
+
+    def test_scheduled_bot_limits_only_new_messages(self):
+        bot = MagicMock()
+        sender = ScheduledBot(bot, self.scheduler)
+        for _ in range(5):
+            sender.edit_message_text("text", 1, 2)
+        self.assertEqual(self.clock[0], 1000.0)
+        sender.send_message(1, "text")
+        bot.send_message.assert_called_once_with(1, "text")
+
+    def test_async_call_shares_limits(self):
+        async def sleep(seconds):
+            self.advance(seconds)
+
+        bot = MagicMock(send_message=AsyncMock(side_effect=[too_many_requests(5), "ok", "ok", "ok"]))
+        sender = AsyncScheduledBot(bot, self.scheduler)
+
+        async def send():
+            results = []
+            for _ in range(3):
+                results.append(await sender.send_message(1, "text"))
+            return results
+
+        with patch('tenders_bot.outbound.asyncio.sleep', sleep):
+            self.assertEqual(asyncio.run(send()), ["ok", "ok", "ok"])
+        # Первое сообщение повторено после retry_after, дальше - лимит чата
+        self.assertGreaterEqual(self.clock[0], 1006.0)
+        self.assertEqual(bot.send_message.await_count, 4)
+        self.assertEqual(self.scheduler.stats()["rate_limited"], 1)
+        self.assertEqual(self.scheduler.stats()["waiting"], {INTERACTIVE: 0, BULK: 0})
@@ -0,0 +1,196 @@
+import shutil
+import smtplib
+import tempfile
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
+
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from tenders_bot.metrics import SMTP_CONNECTIONS_OPENED
+from tenders_bot.models import Feedback, OutboxEmail, UserUploadedFile
+from tenders_bot.outbox import build_digest_email, deliver_batch, enqueue_feedback_email
+from tenders_bot.smtp_pool import SMTPConnectionPool, smtp_pool
+
+
+class TestOutbox(TestCase):
+
+    def setUp(self):
+        smtp_pool.close_all()
+        self.feedback = Feedback.objects.create(telegram_chat_id=12345, company="ООО Ромашка", submitted=True)
+
+    def test_deliver_sends_and_marks_sent(self):
+        email = enqueue_feedback_email(self.feedback)
+        enqueue_feedback_email(Feedback.objects.create(telegram_chat_id=1, submitted=True))
+
+        self.assertEqual(deliver_batch(), 2)
+
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn("ООО Ромашка", mail.outbox[0].body)
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.Status.SENT)
+        self.assertEqual(email.attempts, 1)
+        # Повторно ничего не отправляется
+        self.assertEqual(deliver_batch(), 0)
+
+    @patch('tenders_bot.outbox.build_feedback_email', side_effect=ConnectionError("smtp down"))
+    def test_failed_email_is_retried_later(self, mock_build):
+        email = enqueue_feedback_email(self.feedback)
+
+        self.assertEqual(deliver_batch(), 0)
+
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.Status.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertIn("smtp down", email.last_error)
+        # До наступления срока повторной попытки письмо не берётся
+        self.assertEqual(deliver_batch(), 0)
+        self.assertEqual(mock_build.call_count, 1)
+
+    @patch('tenders_bot.outbox.OUTBOX_MAX_ATTEMPTS', 2)
+    @patch('tenders_bot.outbox.build_feedback_email', side_effect=ConnectionError("smtp down"))
+    def test_email_dead_lettered_after_max_attempts(self, mock_build):
+        email = enqueue_feedback_email(self.feedback)
+        for _ in range(2):
+            OutboxEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+            deliver_batch()
+
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.Status.DEAD)
+        self.assertEqual(email.attempts, 2)
+
+    def test_connection_reused_between_batches(self):
+        opened = SMTP_CONNECTIONS_OPENED.value()
+        for _ in range(3):
+            enqueue_feedback_email(Feedback.objects.create(telegram_chat_id=1, submitted=True))
+            self.assertEqual(deliver_batch(), 1)
+        self.assertEqual(SMTP_CONNECTIONS_OPENED.value(), opened + 1)
+
+    @patch('tenders_bot.outbox.OUTBOX_DIGEST_WINDOW', 60)
+    @patch('tenders_bot.outbox.MAIL_FEEDBACK_GROUPS', [["a@example.com", "b@example.com"], ["c@example.com"]])
+    def test_digest_waits_for_window(self):
+        first = enqueue_feedback_email(self.feedback)
+        second_feedback = Feedback.objects.create(telegram_chat_id=1, company="ИП Иванов", submitted=True)
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        name = default_storage.save("user_uploads/card.pdf", ContentFile(b"card"))
+        UserUploadedFile.objects.create(feedback=second_feedback, file=name, name="card.pdf", size=4)
+        second = enqueue_feedback_email(second_feedback)
+
+        # Окно с первого обращения ещё не прошло
+        self.assertEqual(deliver_batch(), 0)
+        self.assertEqual(mail.outbox, [])
+
+        OutboxEmail.objects.filter(pk=first.pk).update(created_at=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(deliver_batch(), 2)
+
+        self.assertEqual([m.to for m in mail.outbox], [["a@example.com", "b@example.com"], ["c@example.com"]])
+        digest = mail.outbox[0]
+        self.assertIn("ООО Ромашка", digest.body)
+        self.assertIn("ИП Иванов", digest.body)
+        self.assertEqual(digest.attachments, [(f"GKE-{second_feedback.pk}_card.pdf", b"card", "application/pdf")])
+        self.assertEqual(
+            set(OutboxEmail.objects.filter(pk__in=[first.pk, second.pk]).values_list("status", flat=True)),
+            {OutboxEmail.Status.SENT},
+        )
+
+    @patch('tenders_bot.outbox.OUTBOX_DIGEST_WINDOW', 60)
+    @patch('tenders_bot.outbox.MAIL_FEEDBACK_GROUPS', [["a@example.com"], ["c@example.com"]])
+    def test_digest_retried_only_for_failed_group(self):
+        email = enqueue_feedback_email(self.feedback)
+        OutboxEmail.objects.filter(pk=email.pk).update(created_at=timezone.now() - timedelta(seconds=61))
+        build = build_digest_email
+        failures = [ConnectionError("smtp down")]
+
+        def build_or_fail(feedbacks, recipients):
+            if recipients == ["c@example.com"] and failures:
+                raise failures.pop()
+            return build(feedbacks, recipients)
+
+        with patch('tenders_bot.outbox.build_digest_email', side_effect=build_or_fail):
+            self.assertEqual(deliver_batch(), 0)
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.digest_sent_to), (OutboxEmail.Status.PENDING, ["a@example.com"]))
+
+            OutboxEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(deliver_batch(), 1)
+
+        # Первая группа получила дайджест один раз
+        self.assertEqual([m.to for m in mail.outbox], [["a@example.com"], ["c@example.com"]])
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.Status.SENT)
+
+    def test_broken_connection_replaced_within_batch(self):
+        for _ in range(3):
+            enqueue_feedback_email(Feedback.objects.create(telegram_chat_id=1, submitted=True))
+        broken, fresh = MagicMock(broken=False), MagicMock(broken=False)
+
+        def disconnect(messages):
+            broken.broken = True
+            raise smtplib.SMTPServerDisconnected()
+
+        broken.send_messages.side_effect = disconnect
+        with patch.object(smtp_pool, "acquire", side_effect=[broken, fresh]), \
+                patch.object(smtp_pool, "release") as release:
+            self.assertEqual(deliver_batch(), 2)
+
+        self.assertEqual(broken.send_messages.call_count, 1)
+        self.assertEqual(fresh.send_messages.call_count, 2)
+        self.assertEqual([c.args[0] for c in release.call_args_list], [broken, fresh])
+
+
+class TestSMTPConnectionPool(TestCase):
+
+    def setUp(self):
+        self.backends = []
+        patcher = patch('tenders_bot.smtp_pool.get_connection', side_effect=self.new_backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = SMTPConnectionPool(size=2, check_after=0, max_idle=60, max_messages=3)
+
+    def new_backend(self, **kwargs):
+        backend = MagicMock()
+        backend.connection.noop.return_value = (250, b"OK")
+        self.backends.append(backend)
+        return backend
+
+    def send(self, count=1):
+        with self.pool.connection() as connection:
+            connection.send_messages([object()] * count)
+
+    def test_dead_connection_replaced_after_noop(self):
+        self.send()
+        self.send()
+        self.assertEqual(len(self.backends), 1)
+
+        self.backends[0].connection.noop.side_effect = smtplib.SMTPServerDisconnected()
+        self.send()
+        self.assertEqual(len(self.backends), 2)
+        self.backends[0].close.assert_called_once()
+
+    def test_broken_connection_not_returned(self):
+        self.send()
+        self.backends[0].send_messages.side_effect = smtplib.SMTPServerDisconnected()
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            self.send()
+        self.assertEqual(self.pool.idle, 0)
+
+        # Отказ принять одно письмо соединение не ломает
+        self.send()
+        self.backends[1].send_messages.side_effect = smtplib.SMTPRecipientsRefused({})
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            self.send()
+        self.assertEqual(self.pool.idle, 1)
+
+    def test_session_closed_after_max_messages(self):
+        self.send(2)
+        self.send(1)
+        self.assertEqual(self.pool.idle, 0)
+        self.backends[0].close.assert_called_once()
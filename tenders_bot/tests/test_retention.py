@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from tenders_bot import retention
+from tenders_bot.models import ChatState, Feedback, OutboxEmail, StoredBlob, UserUploadedFile
+
+
+class TestRetention(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.old = timezone.now() - timedelta(days=100)
+
+    def create_feedback(self, submitted, created_at, files=1):
+        feedback = Feedback.objects.create(telegram_chat_id=1, submitted=submitted)
+        Feedback.objects.filter(pk=feedback.pk).update(created_at=created_at)
+        for i in range(files):
+            name = default_storage.save(f"user_uploads/{feedback.pk}_{i}.pdf", ContentFile(b"x" * 10))
+            UserUploadedFile.objects.create(feedback=feedback, file=name, size=10)
+        return feedback
+
+    def stored_files(self):
+        return sorted(os.listdir(os.path.join(self.media_root, "user_uploads")))
+
+    def test_deleted_rows_remove_files_after_commit(self):
+        feedback = self.create_feedback(submitted=True, created_at=self.old, files=2)
+        kept = self.create_feedback(submitted=True, created_at=self.old)
+        kept_pk = kept.pk
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            feedback.delete()
+            # Точка сохранения откатилась: строки вернулись, их файлы должны остаться
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                kept.delete()
+                raise RuntimeError()
+        self.assertEqual(len(callbacks), 2)
+        self.assertEqual(self.stored_files(), [f"{kept_pk}_0.pdf"])
+
+    def test_collected_files_deleted_together(self):
+        feedback = self.create_feedback(submitted=True, created_at=self.old, files=2)
+        names = sorted(feedback.uploaded_files.values_list("file", flat=True))
+        with patch('tenders_bot.retention.delete_stored_files', return_value=0) as mock_delete:
+            with retention.collect_file_deletions(), self.captureOnCommitCallbacks(execute=True):
+                feedback.delete()
+        mock_delete.assert_called_once()
+        self.assertEqual(sorted(mock_delete.call_args.args[0]), names)
+
+    def test_purge_drafts_in_batches(self):
+        stale = [self.create_feedback(submitted=False, created_at=self.old) for _ in range(3)]
+        fresh = self.create_feedback(submitted=False, created_at=timezone.now())
+        submitted = self.create_feedback(submitted=True, created_at=self.old)
+        cutoff = timezone.now() - timedelta(days=30)
+
+        dry_run = retention.purge_drafts(cutoff, batch_size=2, dry_run=True)
+        self.assertEqual((dry_run.rows, dry_run.files, dry_run.bytes), (3, 3, 30))
+        self.assertEqual(Feedback.objects.count(), 5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = retention.purge_drafts(cutoff, batch_size=2)
+        self.assertEqual((result.rows, result.files, result.bytes), (3, 3, 30))
+        self.assertFalse(Feedback.objects.filter(pk__in=[f.pk for f in stale]).exists())
+        self.assertEqual(self.stored_files(), [f"{fresh.pk}_0.pdf", f"{submitted.pk}_0.pdf"])
+
+    def test_purge_attachments_keeps_pending_emails(self):
+        expired = self.create_feedback(submitted=True, created_at=self.old)
+        pending = self.create_feedback(submitted=True, created_at=self.old)
+        OutboxEmail.objects.create(feedback=pending)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = retention.purge_attachments(timezone.now() - timedelta(days=30))
+        self.assertEqual((result.rows, result.bytes), (1, 10))
+        self.assertTrue(Feedback.objects.filter(pk=expired.pk).exists())
+        self.assertFalse(expired.uploaded_files.exists())
+        self.assertEqual(self.stored_files(), [f"{pending.pk}_0.pdf"])
+
+    def test_purge_orphan_files(self):
+        feedback = self.create_feedback(submitted=True, created_at=self.old)
+        orphan = default_storage.save("user_uploads/orphan.pdf", ContentFile(b"y" * 7))
+        old = (timezone.now() - timedelta(days=2)).timestamp()
+        os.utime(default_storage.path(orphan), (old, old))
+        default_storage.save("user_uploads/just_written.pdf", ContentFile(b"z"))
+        # Содержимое, для которого после записи не успели создать StoredBlob, и содержимое с блобом
+        leaked = default_storage.save("user_uploads/blobs/ab/abc.pdf", ContentFile(b"w" * 5))
+        kept = default_storage.save("user_uploads/blobs/cd/cde.pdf", ContentFile(b"v"))
+        StoredBlob.objects.create(sha256="cde", file=kept, size=1)
+        for name in (leaked, kept):
+            os.utime(default_storage.path(name), (old, old))
+
+        out = StringIO()
+        call_command("purge_retention", "--orphans", "--draft-days", "0", stdout=out)
+        self.assertIn("Deleted 2 orphan files", out.getvalue())
+        self.assertIn("(12 bytes)", out.getvalue())
+        self.assertEqual(self.stored_files(), [f"{feedback.pk}_0.pdf", "blobs", "just_written.pdf"])
+        self.assertFalse(default_storage.exists(leaked))
+        self.assertTrue(default_storage.exists(kept))
+
+    def test_purge_expired_chat_states(self):
+        ChatState.objects.create(chat_id=1)
+        ChatState.objects.create(chat_id=2)
+        ChatState.objects.filter(chat_id=1).update(updated_at=self.old)
+
+        out = StringIO()
+        call_command("purge_retention", "--draft-days", "0", "--attachment-days", "0", stdout=out)
+        self.assertIn("Deleted 1 chat states", out.getvalue())
+        self.assertEqual(list(ChatState.objects.values_list("chat_id", flat=True)), [2])
+
+    def test_command_dry_run(self):
+        self.create_feedback(submitted=False, created_at=self.old)
+        out = StringIO()
+        call_command("purge_retention", "--dry-run", stdout=out)
+        self.assertIn("Would delete 1 drafts (1 files", out.getvalue())
+        self.assertEqual(Feedback.objects.count(), 1)
+        self.assertEqual(len(self.stored_files()), 1)
@@ -0,0 +1,25 @@
+from unittest.mock import patch
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from tenders_bot.apps import setup_node_tree
+from tenders_bot.models import Node
+
+
+class TestRunBot(TestCase):
+
+    def test_refuses_webhook_mode(self):
+        with patch('tenders_bot.management.commands.runbot.TELEGRAM_BOT_MODE', "webhook"):
+            with self.assertRaises(CommandError):
+                call_command("runbot")
+
+    def test_tree_setup_without_writes(self):
+        root = Node.objects.create(button_text="Root")
+        Node.objects.create(button_text="Section", parent_node=root)
+        Node.objects.filter(pk=root.pk).update(path="stale")
+
+        with patch('tenders_bot.node_tree.get_node_tree') as mock_get_tree:
+            setup_node_tree(fix_paths=False)
+        mock_get_tree.assert_called_once()
+        self.assertEqual(Node.objects.get(pk=root.pk).path, "stale")
@@ -0,0 +1,82 @@
+from unittest.mock import MagicMock, patch
+
+from django.db import connection
+from django.test import TestCase
+
+from tenders_bot import tracing
+from tenders_bot.metrics import instrumented_request_sender
+from tenders_bot.models import Feedback
+from tenders_bot.tracing import span, start_trace, to_otlp, trace_queries
+
+
+@patch('tenders_bot.tracing.TRACE_FILE', "traces.jsonl")
+@patch('tenders_bot.tracing.TRACE_SAMPLE_RATE', 0)
+@patch('tenders_bot.tracing.TRACE_SLOW_THRESHOLD', 1)
+class TestTracing(TestCase):
+
+    def setUp(self):
+        patcher = patch('tenders_bot.tracing.export')
+        self.export = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def exported_spans(self):
+        self.assertEqual(self.export.call_count, 1)
+        trace = self.export.call_args.args[0]
+        return {item["name"]: item for item in to_otlp(trace)["resourceSpans"][0]["scopeSpans"][0]["spans"]}
+
+    def test_slow_update_kept_with_span_tree(self):
+        send = instrumented_request_sender(lambda method, url, **kwargs: MagicMock(status_code=200))
+        with patch('tenders_bot.tracing.TRACE_SLOW_THRESHOLD', 0):
+            with start_trace("telegram.update", attributes={"telegram.chat_id": 42}) as trace:
+                with connection.execute_wrapper(trace_queries):
+                    Feedback.objects.filter(telegram_chat_id=42).exists()
+                with span("feedback.file"):
+                    send("post", "https://api.telegram.org/bot1:x/getFile")
+
+        spans = self.exported_spans()
+        root, query, file, request = (
+            spans["telegram.update"], spans["db.query"], spans["feedback.file"], spans["telegram.getFile"]
+        )
+        self.assertNotIn("parentSpanId", root)
+        self.assertEqual({root["traceId"], query["traceId"], request["traceId"]}, {trace.trace_id})
+        self.assertEqual(query["parentSpanId"], root["spanId"])
+        self.assertEqual(request["parentSpanId"], file["spanId"])
+        self.assertEqual(query["kind"], tracing.CLIENT)
+        self.assertIn('"tenders_bot_feedback"', dict(
+            (a["key"], a["value"]["stringValue"]) for a in query["attributes"]
+        )["db.statement"])
+        self.assertEqual(root["attributes"], [{"key": "telegram.chat_id", "value": {"intValue": "42"}}])
+        self.assertEqual(request["attributes"], [{"key": "http.status_code", "value": {"intValue": "200"}}])
+
+    def test_fast_update_sampled_out(self):
+        with start_trace("telegram.update"):
+            with span("work"):
+                pass
+        self.export.assert_not_called()
+
+    def test_failed_update_kept(self):
+        with self.assertRaises(RuntimeError):
+            with start_trace("telegram.update"):
+                with span("work"):
+                    raise RuntimeError("boom")
+
+        spans = self.exported_spans()
+        self.assertEqual(spans["work"]["status"], {"code": 2, "message": "RuntimeError('boom')"})
+        self.assertEqual(spans["telegram.update"]["status"]["code"], 2)
+
+    @patch('tenders_bot.tracing.TRACE_MAX_SPANS', 3)
+    def test_span_limit(self):
+        with patch('tenders_bot.tracing.TRACE_SLOW_THRESHOLD', 0):
+            with start_trace("outbox.deliver") as trace:
+                for _ in range(5):
+                    with span("smtp.send"):
+                        pass
+        self.assertEqual(len(trace.spans), 3)
+        self.assertEqual(trace.dropped_spans, 3)
+
+    def test_span_outside_trace_is_noop(self):
+        with span("work") as current:
+            self.assertIsNone(current)
+        with patch('tenders_bot.tracing.TRACE_FILE', ""), start_trace("telegram.update") as trace:
+            self.assertIsNone(trace)
+        self.export.assert_not_called()
@@ -0,0 +1,119 @@
+from http.client import RemoteDisconnected
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+
+import requests
+from django.test import SimpleTestCase
+from telebot import apihelper
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from tenders_bot.transport import TelegramTransport
+
+URL = "https://api.telegram.org/bot1:x/"
+
+
+def response(status_code, data=None):
+    result = MagicMock(status_code=status_code)
+    result.json.return_value = data or {}
+    return result
+
+
+class TestTelegramTransport(SimpleTestCase):
+
+    def setUp(self):
+        self.transport = TelegramTransport(retries=3, backoff=0.5, backoff_max=8, max_retry_after=10)
+        self.session = MagicMock()
+        self.transport._send = self.session.request
+        patcher = patch('tenders_bot.transport.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('tenders_bot.transport.scheduler')
+        self.scheduler = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self, api_method, *results, **kwargs):
+        self.session.request.reset_mock()
+        self.session.request.side_effect = results
+        kwargs.setdefault("timeout", (apihelper.CONNECT_TIMEOUT, apihelper.READ_TIMEOUT))
+        return self.transport.request("post", URL + api_method, **kwargs)
+
+    def test_send_not_retried_on_bad_gateway(self):
+        # 502 прокси Telegram может прийти, когда сообщение уже доставлено
+        result = self.request("sendMessage", response(502), response(200), params={"chat_id": "42"})
+        self.assertEqual(result.status_code, 502)
+        self.assertEqual(self.session.request.call_count, 1)
+        self.sleep.assert_not_called()
+
+    def test_idempotent_retried_on_bad_gateway(self):
+        result = self.request("editMessageText", response(502), response(200), params={"chat_id": "42"})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(self.session.request.call_count, 2)
+        delay = self.sleep.call_args.args[0]
+        self.assertTrue(0 <= delay <= 0.5)
+
+    def test_send_not_retried_when_possibly_delivered(self):
+        # После таймаута чтения и 500 сообщение могло уйти: повтор отправил бы его дважды
+        with self.assertRaises(requests.ReadTimeout):
+            self.request("sendMessage", requests.ReadTimeout())
+        self.assertEqual(self.session.request.call_count, 1)
+        self.assertEqual(self.request("sendDocument", response(500)).status_code, 500)
+        self.assertEqual(self.session.request.call_count, 1)
+        self.sleep.assert_not_called()
+
+    def test_send_retried_only_when_not_connected(self):
+        refused = requests.ConnectionError(MaxRetryError(None, URL, NewConnectionError(None, "refused")))
+        result = self.request("sendMessage", refused, response(200))
+        self.assertEqual(result.status_code, 200)
+
+        # Соединение из пула закрыто уже после отправки запроса: сообщение могло уйти
+        aborted = requests.ConnectionError(ProtocolError("Connection aborted.", RemoteDisconnected()))
+        with self.assertRaises(requests.ConnectionError):
+            self.request("sendMessage", aborted, response(200))
+        self.assertEqual(self.session.request.call_count, 1)
+        self.assertEqual(self.request("getFile", aborted, response(200)).status_code, 200)
+
+    def test_idempotent_retried_until_limit(self):
+        result = self.request("getFile", requests.ReadTimeout(), requests.ConnectionError(), response(200))
+        self.assertEqual(result.status_code, 200)
+
+        with self.assertRaises(requests.ReadTimeout):
+            self.request("editMessageText", *[requests.ReadTimeout()] * 4)
+        self.assertEqual(self.session.request.call_count, 4)
+
+    def test_short_retry_after_waited_and_shared(self):
+        too_many = response(429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 3}})
+        result = self.request("sendMessage", too_many, response(200), params={"chat_id": "42"})
+        self.assertEqual(result.status_code, 200)
+        self.sleep.assert_called_once_with(3.0)
+        self.scheduler.pause.assert_called_once_with(42, 3.0)
+
+    def test_long_retry_after_left_to_scheduler(self):
+        too_many = response(429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 60}})
+        self.assertIs(self.request("sendMessage", too_many, params={"chat_id": "42"}), too_many)
+        self.sleep.assert_not_called()
+        self.scheduler.pause.assert_not_called()
+
+    def test_timeouts_per_method(self):
+        timeouts = []
+        for api_method, kwargs in [
+            ("sendMessage", {}),
+            ("sendDocument", {"files": {"document": ("card.pdf", BytesIO(b"pdf"))}}),
+            ("getUpdates", {"timeout": 25}),
+        ]:
+            self.request(api_method, response(200), **kwargs)
+            timeouts.append(self.session.request.call_args.kwargs["timeout"])
+        self.assertEqual(timeouts, [(5, 10), (5, 120), 25])
+
+    def test_file_rewound_before_retry(self):
+        document = BytesIO(b"pdf")
+        sent = []
+
+        def send(method, url, files, **kwargs):
+            sent.append(files["document"][1].read())
+            if len(sent) == 1:
+                return response(429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 1}})
+            return response(200)
+
+        self.session.request.side_effect = send
+        self.transport.request("post", URL + "sendDocument", files={"document": ("card.pdf", document)})
+        self.assertEqual(sent, [b"pdf", b"pdf"])
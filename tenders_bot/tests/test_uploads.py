@@ -0,0 +1,130 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest.mock import MagicMock, patch
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+
+from tenders_bot.blobs import blob_file_name
+from tenders_bot.feedback import feedback_process_file
+from tenders_bot.models import Feedback, StoredBlob, UserUploadedFile
+
+
+def fake_session(content, chunk_size=4):
+    response = MagicMock()
+    response.status_code = 200
+    response.iter_content.side_effect = lambda size: (
+        content[i:i + chunk_size] for i in range(0, len(content), chunk_size)
+    )
+    response.__enter__.return_value = response
+    session = MagicMock()
+    session.get.return_value = response
+    return session
+
+
+class TestStreamingUploads(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.feedback = Feedback.objects.create(telegram_chat_id=12345, next_field="files")
+        self.other_feedback = Feedback.objects.create(telegram_chat_id=54321, next_field="files")
+
+    def process_file(self, content, reported_size=None, chat_id=12345, file_unique_id=None):
+        file_info = MagicMock(file_path="documents/file_1.pdf", file_size=reported_size or len(content))
+        session = fake_session(content)
+        with patch('tenders_bot.feedback.bot.get_file', return_value=file_info) as self.mock_get_file, \
+                patch('tenders_bot.feedback.bot.send_message') as mock_send_message, \
+                patch('tenders_bot.uploads.transport.session', session):
+            feedback_process_file("file-id", "card.pdf", chat_id, file_unique_id)
+        self.downloads = session.get.call_count
+        return mock_send_message
+
+    def test_file_streamed_to_storage(self):
+        mock_send_message = self.process_file(b"company card content")
+
+        uploaded_file = UserUploadedFile.objects.get(feedback=self.feedback)
+        self.assertEqual(uploaded_file.size, 20)
+        self.assertEqual(uploaded_file.sha256, hashlib.sha256(b"company card content").hexdigest())
+        with default_storage.open(uploaded_file.file.name) as f:
+            self.assertEqual(f.read(), b"company card content")
+        mock_send_message.assert_called_once_with(12345, "Ваш файл card.pdf добавлен к обращению.")
+
+    @patch('tenders_bot.feedback.MAX_TOTAL_SIZE_MB', 1)
+    def test_size_enforced_while_streaming(self):
+        # Telegram сообщил маленький размер, а фактически пришло больше лимита
+        content = b"x" * (1024 * 1024 + 1)
+        mock_send_message = self.process_file(content, reported_size=10)
+
+        # Файл не уложился в остаток общего лимита, а не в лимит одного файла
+        mock_send_message.assert_called_once_with(12345, "Все файлы в обращении не могут превышать 1Мб.")
+        self.assertFalse(UserUploadedFile.objects.exists())
+        self.assertFalse(StoredBlob.objects.exists())
+        self.assertFalse(default_storage.exists("user_uploads"))
+
+    def test_quota_is_single_query(self):
+        UserUploadedFile.objects.create(feedback=self.feedback, file="user_uploads/a.pdf", size=14 * 1024 * 1024)
+        mock_send_message = self.process_file(b"x" * (2 * 1024 * 1024))
+
+        mock_send_message.assert_called_once_with(12345, "Все файлы в обращении не могут превышать 15Мб.")
+        self.assertEqual(UserUploadedFile.objects.count(), 1)
+
+    def test_saved_name_deleted_when_blob_not_created(self):
+        # Под запрошенным именем уже лежит файл (ждёт удаления после прежнего блоба): хранилище сохранит
+        # содержимое под другим именем, и удалить при ошибке нужно именно его
+        name = "user_uploads/blobs/" + blob_file_name(hashlib.sha256(b"licence").hexdigest(), ".pdf")
+        default_storage.save(name, ContentFile(b"old"))
+
+        with patch.object(StoredBlob.objects, "create", side_effect=DatabaseError), \
+                self.assertRaises(DatabaseError):
+            self.process_file(b"licence")
+
+        self.assertEqual(default_storage.listdir(os.path.dirname(name))[1], [os.path.basename(name)])
+        with default_storage.open(name) as f:
+            self.assertEqual(f.read(), b"old")
+
+    def test_same_content_stored_once(self):
+        self.process_file(b"licence", file_unique_id="unique-1")
+        self.process_file(b"licence", chat_id=54321, file_unique_id="unique-2")
+
+        blob = StoredBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(blob.sha256, hashlib.sha256(b"licence").hexdigest())
+        self.assertEqual(blob.telegram_file_unique_id, "unique-1")
+        self.assertEqual(default_storage.listdir(os.path.dirname(blob.file.name))[1], [os.path.basename(blob.file.name)])
+        for uploaded_file in UserUploadedFile.objects.all():
+            self.assertEqual(uploaded_file.file.name, blob.file.name)
+            self.assertEqual(uploaded_file.display_name, "card.pdf")
+
+    def test_known_file_unique_id_skips_download(self):
+        self.process_file(b"licence", file_unique_id="unique-1")
+        mock_send_message = self.process_file(b"licence", chat_id=54321, file_unique_id="unique-1")
+
+        self.mock_get_file.assert_not_called()
+        self.assertEqual(self.downloads, 0)
+        self.assertEqual(self.other_feedback.uploaded_files.get().name, "card.pdf")
+        self.assertEqual(StoredBlob.objects.get().ref_count, 2)
+        mock_send_message.assert_called_once_with(54321, "Ваш файл card.pdf добавлен к обращению.")
+
+    def test_file_deleted_with_last_reference(self):
+        self.process_file(b"licence", file_unique_id="unique-1")
+        self.process_file(b"licence", chat_id=54321, file_unique_id="unique-1")
+        blob = StoredBlob.objects.get()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.feedback.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(default_storage.exists(blob.file.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other_feedback.delete()
+        self.assertFalse(StoredBlob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
@@ -0,0 +1,60 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.utils import timezone
+
+from tenders_bot.models import ChatState
+from tenders_bot.user_state import DatabaseUserStateStore, LocalUserStateStore, UserState
+
+
+class TestUserStateStores(TestCase):
+
+    def check_store(self, store):
+        self.assertIsNone(store.get(1))
+
+        store.set(1, UserState(return_to_node_id=5))
+        self.assertEqual(store.get(1), UserState(return_to_node_id=5, entering_feedback=False))
+
+        store.update(1, entering_feedback=True)
+        self.assertEqual(store.get(1), UserState(return_to_node_id=5, entering_feedback=True))
+
+        store.delete(1)
+        self.assertIsNone(store.get(1))
+
+    def test_local_store(self):
+        self.check_store(LocalUserStateStore())
+
+    def test_database_store(self):
+        self.check_store(DatabaseUserStateStore())
+
+    def test_local_store_evicts_least_recently_used(self):
+        store = LocalUserStateStore(max_size=2)
+        store.set(1, UserState())
+        store.set(2, UserState())
+        store.get(1)  # 1 использовался недавно, вытесняется 2
+        store.set(3, UserState())
+
+        self.assertEqual(len(store), 2)
+        self.assertIsNotNone(store.get(1))
+        self.assertIsNone(store.get(2))
+
+    def test_local_store_expires_states(self):
+        store = LocalUserStateStore(ttl=10)
+        with patch('tenders_bot.user_state.time.monotonic', return_value=100):
+            store.set(1, UserState())
+        with patch('tenders_bot.user_state.time.monotonic', return_value=111):
+            self.assertIsNone(store.get(1))
+
+    def test_database_store_counts_live_states(self):
+        store = DatabaseUserStateStore(ttl=60)
+        store.set(1, UserState())
+        store.set(2, UserState())
+        ChatState.objects.filter(chat_id=1).update(updated_at=timezone.now() - timedelta(seconds=61))
+
+        self.assertIsNone(store.get(1))
+        self.assertEqual(len(store), 1)
+
+    def test_state_is_compact(self):
+        with self.assertRaises(AttributeError):
+            UserState().node = object()
@@ -0,0 +1,52 @@
+import json
+from unittest.mock import patch
+
+from django.test import TestCase
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 10,
+        "date": 0,
+        "chat": {"id": 12345, "type": "private"},
+        "from": {"id": 12345, "is_bot": False, "first_name": "Test"},
+        "text": "/start",
+    },
+}
+
+
+@patch('tenders_bot.webhook.TELEGRAM_WEBHOOK_SECRET', "secret")
+@patch('tenders_bot.webhook.TELEGRAM_BOT_MODE', "webhook")
+class TestWebhook(TestCase):
+
+    def post(self, secret="secret", body=json.dumps(UPDATE)):
+        return self.client.post(
+            "/telegram/webhook/", body, content_type="application/json",
+            headers={"X-Telegram-Bot-Api-Secret-Token": secret},
+        )
+
+    @patch('tenders_bot.telegram.bot.process_new_updates')
+    def test_update_dispatched(self, mock_process):
+        response = self.post()
+
+        self.assertEqual(response.status_code, 200)
+        update = mock_process.call_args.args[0][0]
+        self.assertEqual(update.update_id, 1)
+        self.assertEqual(update.message.text, "/start")
+
+    @patch('tenders_bot.telegram.bot.process_new_updates')
+    def test_wrong_secret_rejected(self, mock_process):
+        self.assertEqual(self.post(secret="wrong").status_code, 403)
+        self.assertEqual(self.post(body="not json").status_code, 400)
+        mock_process.assert_not_called()
+
+    @patch('tenders_bot.telegram.bot.process_new_updates')
+    def test_json_that_is_not_an_update_rejected(self, mock_process):
+        for body in ("{}", "[]", '"text"', "null", json.dumps({"update_id": 1, "message": "text"})):
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body=body).status_code, 400)
+        mock_process.assert_not_called()
+
+    def test_disabled_in_polling_mode(self):
+        with patch('tenders_bot.webhook.TELEGRAM_BOT_MODE', "polling"):
+            self.assertEqual(self.post().status_code, 404)
@@ -0,0 +1,171 @@
+# Трассировка обработки обновлений
+# На каждое обновление (и на каждую отправленную пачку писем) строится трасса: корневой участок и
+# вложенные участки запросов к базе, к Bot API, скачивания файлов и отправки писем. Трассы пишутся в
+# TRACE_FILE (с ротацией) по строке на трассу в формате OTLP JSON, который понимают коллекторы
+# OpenTelemetry. Сохраняются все медленные (дольше TRACE_SLOW_THRESHOLD) и упавшие трассы и доля
+# TRACE_SAMPLE_RATE остальных - решение принимается, когда трасса уже завершена.
+# Без TRACE_FILE трассировка выключена и участки ничего не стоят
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from tenders_bot.settings import TRACE_FILE, TRACE_MAX_SPANS, TRACE_SAMPLE_RATE, TRACE_SLOW_THRESHOLD
+
+# Виды участков в OTLP
+SERVER = 2  # обработка входящего (обновление Telegram)
+CLIENT = 3  # запрос к внешней системе (база, Bot API, SMTP)
+INTERNAL = 1
+
+trace_logger = logging.getLogger("tenders_bot.traces")  # пишет в TRACE_FILE, см. LOGGING в settings
+
+_current: ContextVar[Optional["Span"]] = ContextVar("trace_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "attributes", "start", "end", "error")
+
+    def __init__(self, trace, parent_id, name, kind, attributes):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.start = time.time_ns()
+        self.end = None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def duration(self) -> float:
+        return ((self.end or time.time_ns()) - self.start) / 1e9
+
+
+class Trace:
+    __slots__ = ("trace_id", "spans", "dropped_spans", "keep")
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self.dropped_spans = 0
+        self.keep = None  # None - решает выборка, False - не сохранять (например, пустой цикл воркера)
+
+    def new_span(self, parent_id, name, kind, attributes) -> Optional[Span]:
+        if len(self.spans) >= TRACE_MAX_SPANS:
+            self.dropped_spans += 1  # не даём трассе огромного цикла занять всю память
+            return None
+        span = Span(self, parent_id, name, kind, attributes)
+        self.spans.append(span)
+        return span
+
+
+# Начать трассу; внутри блока участки (span) привязываются к ней
+@contextmanager
+def start_trace(name, kind=SERVER, attributes=None):
+    if not TRACE_FILE:
+        yield None
+        return
+    trace = Trace()
+    root = trace.new_span(None, name, kind, attributes)
+    token = _current.set(root)
+    try:
+        yield trace
+    except BaseException as e:
+        root.error = repr(e)
+        raise
+    finally:
+        root.end = time.time_ns()
+        _current.reset(token)
+        if trace.dropped_spans:
+            root.set_attribute("tenders_bot.dropped_spans", trace.dropped_spans)
+        if should_keep(trace, root):
+            export(trace)
+
+
+# Участок текущей трассы (вне трассы - ничего не делает)
+@contextmanager
+def span(name, kind=INTERNAL, attributes=None):
+    parent = _current.get()
+    current = parent.trace.new_span(parent.span_id, name, kind, attributes) if parent is not None else None
+    if current is None:
+        yield None
+        return
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = repr(e)
+        raise
+    finally:
+        current.end = time.time_ns()
+        _current.reset(token)
+
+
+# Для connection.execute_wrapper: каждый запрос к базе - участок (параметры запроса не пишем)
+def trace_queries(execute, sql, params, many, context):
+    if _current.get() is None:
+        return execute(sql, params, many, context)
+    attributes = {"db.system": context["connection"].vendor, "db.statement": sql[:1000]}
+    with span("db.executemany" if many else "db.query", CLIENT, attributes):
+        return execute(sql, params, many, context)
+
+
+# Хвостовая выборка: медленные и упавшие трассы сохраняем всегда
+def should_keep(trace: Trace, root: Span) -> bool:
+    if trace.keep is not None:
+        return trace.keep
+    return root.error is not None or root.duration >= TRACE_SLOW_THRESHOLD or random.random() < TRACE_SAMPLE_RATE
+
+
+def export(trace: Trace):
+    trace_logger.info("%s", json.dumps(to_otlp(trace), ensure_ascii=False, separators=(",", ":")))
+
+
+def to_otlp(trace: Trace) -> dict:
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _attributes({"service.name": "tenders_bot"})},
+            "scopeSpans": [{
+                "scope": {"name": "tenders_bot"},
+                "spans": [_span_to_otlp(trace, span) for span in trace.spans],
+            }],
+        }],
+    }
+
+
+def _span_to_otlp(trace: Trace, span: Span) -> dict:
+    data = {
+        "traceId": trace.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start),
+        "endTimeUnixNano": str(span.end or span.start),
+        "attributes": _attributes(span.attributes),
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 0},
+    }
+    if span.parent_id is not None:
+        data["parentSpanId"] = span.parent_id
+    return data
+
+
+def _attributes(attributes: dict) -> list:
+    result = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            value = {"boolValue": value}
+        elif isinstance(value, int):
+            value = {"intValue": str(value)}
+        elif isinstance(value, float):
+            value = {"doubleValue": value}
+        else:
+            value = {"stringValue": str(value)}
+        result.append({"key": key, "value": value})
+    return result
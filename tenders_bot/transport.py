@@ -0,0 +1,161 @@
+# Транспорт запросов к Bot API (apihelper.CUSTOM_REQUEST_SENDER) и скачивания файлов
+# Своя сессия requests с пулом keep-alive соединений на все потоки процесса, таймауты по методу
+# (короткие для обычных методов, длинные для загрузки файлов) и повторы после сбоев. Повторяем с учётом
+# идемпотентности: запрос, который создаёт сообщение (send*, forward*, copy*, create*), повторяем только когда
+# он заведомо не был выполнен - новое соединение не установилось или сервер ответил 429. После любого ответа
+# 5xx (502/503 прокси Telegram может вернуть, когда сообщение уже доставлено) и после обрыва соединения
+# с отправленным запросом (таймаут чтения, сервер закрыл соединение) такой запрос мог дойти, и повтор отправил
+# бы пользователю сообщение дважды. Остальные методы (get*, edit*, delete*, answer*...) при повторе дают
+# тот же результат и повторяются после любого сбоя
+import logging
+import random
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from tenders_bot.metrics import TELEGRAM_RETRIES, instrumented_request_sender
+from tenders_bot.outbound import file_positions, rewind, scheduler
+from tenders_bot.settings import (
+    TELEGRAM_CONNECT_TIMEOUT,
+    TELEGRAM_MAX_RETRY_AFTER,
+    TELEGRAM_POOL_SIZE,
+    TELEGRAM_READ_TIMEOUT,
+    TELEGRAM_RETRIES as MAX_RETRIES,
+    TELEGRAM_RETRY_BACKOFF,
+    TELEGRAM_RETRY_BACKOFF_MAX,
+    TELEGRAM_UPLOAD_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+NON_IDEMPOTENT_PREFIXES = ("send", "forward", "copy", "create")
+
+
+def is_idempotent(api_method: str) -> bool:
+    return not api_method.startswith(NON_IDEMPOTENT_PREFIXES)
+
+
+# Таймаут скачивания файла, присланного пользователем (см. tenders_bot.uploads)
+DOWNLOAD_TIMEOUT = (TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_UPLOAD_TIMEOUT)
+
+
+class TelegramTransport:
+    def __init__(
+        self,
+        pool_size: int = TELEGRAM_POOL_SIZE,
+        retries: int = MAX_RETRIES,
+        backoff: float = TELEGRAM_RETRY_BACKOFF,
+        backoff_max: float = TELEGRAM_RETRY_BACKOFF_MAX,
+        max_retry_after: float = TELEGRAM_MAX_RETRY_AFTER,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.session = requests.Session()
+        # Повторы делаем сами, urllib3 не должен повторять запросы, создающие сообщения
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Каждая попытка считается в метриках и трассе отдельно
+        self._send = instrumented_request_sender(self.session.request)
+
+    # Сигнатура apihelper.CUSTOM_REQUEST_SENDER
+    def request(self, method, url, params=None, files=None, timeout=None, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        idempotent = is_idempotent(api_method)
+        timeout = self.timeout(timeout, files)
+        positions = file_positions((files or {}).values())
+        attempt = 0
+        while True:
+            last = attempt >= self.retries or positions is None  # файл без seek второй раз не отправить
+            try:
+                response = self._send(method, url, params=params, files=files, timeout=timeout, **kwargs)
+            except requests.RequestException as e:
+                reason = retry_reason(e, idempotent)
+                if last or reason is None:
+                    raise
+                delay = self.backoff_delay(attempt)
+                logger.warning("Telegram %s failed (%s), retrying in %.1fs", api_method, reason, delay)
+            else:
+                reason, delay = self.response_retry(response, idempotent, attempt, params)
+                if last or reason is None:
+                    return response
+                logger.warning("Telegram %s returned %s, retrying in %.1fs", api_method, reason, delay)
+            TELEGRAM_RETRIES.inc(method=api_method, reason=reason)
+            time.sleep(delay)
+            rewind(positions)
+            attempt += 1
+
+    # Таймаут, заданный вызывающим (getUpdates с long polling, явный timeout), не трогаем;
+    # вместо таймаутов telebot по умолчанию - короткий для обычных методов, длинный для загрузки файлов
+    @staticmethod
+    def timeout(timeout, files):
+        if timeout is not None and timeout != (apihelper.CONNECT_TIMEOUT, apihelper.READ_TIMEOUT):
+            return timeout
+        return TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_UPLOAD_TIMEOUT if files else TELEGRAM_READ_TIMEOUT
+
+    # Пауза перед повтором: экспоненциальная со случайным разбросом, чтобы потоки не повторяли хором
+    def backoff_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    # Нужно ли повторить запрос после ответа: (причина, пауза) или (None, None)
+    def response_retry(self, response, idempotent, attempt, params):
+        status = response.status_code
+        if status == 429:
+            delay = _retry_after(response)
+            if delay is None or delay > self.max_retry_after:
+                return None, None  # долгую паузу выдерживает планировщик (OutboundScheduler.call)
+            scheduler.pause(_chat_id(params), delay)  # остальные отправки в этот чат тоже подождут
+            return "429", delay
+        if status >= 500 and idempotent:
+            return str(status), self.backoff_delay(attempt)
+        return None, None
+
+
+# Причина повтора после исключения requests (None - не повторять)
+def retry_reason(exception, idempotent) -> Optional[str]:
+    if isinstance(exception, requests.ConnectTimeout):
+        return "connect_timeout"  # соединение не установлено, запрос не отправлен
+    if isinstance(exception, requests.ConnectionError):
+        if _not_connected(exception):
+            return "connection_error"
+        # Соединение оборвалось после отправки запроса (например, RemoteDisconnected на соединении из
+        # пула): Telegram мог его уже выполнить
+        return "connection_aborted" if idempotent else None
+    if isinstance(exception, requests.Timeout) and idempotent:
+        return "read_timeout"
+    return None
+
+
+# Новое соединение не установилось (отказ, ошибка DNS), значит запрос никуда не ушёл
+def _not_connected(exception) -> bool:
+    cause = exception.args[0] if exception.args else None
+    if isinstance(cause, MaxRetryError):
+        cause = cause.reason
+    return isinstance(cause, NewConnectionError)
+
+
+# telebot передаёт chat_id строкой, а планировщик ведёт чаты по числовому id (у каналов - "@name")
+def _chat_id(params):
+    chat_id = (params or {}).get("chat_id")
+    try:
+        return int(chat_id)
+    except (TypeError, ValueError):
+        return chat_id
+
+
+def _retry_after(response) -> Optional[float]:
+    try:
+        parameters = response.json().get("parameters") or {}
+    except ValueError:
+        return None
+    retry_after = parameters.get("retry_after")
+    return float(retry_after) if retry_after is not None else None
+
+
+transport = TelegramTransport()
@@ -0,0 +1,84 @@
+# Потоковое скачивание файлов, которые пользователи присылают боту
+# Файл не собирается целиком в памяти: ответ Telegram читается кусками и сразу пишется во временный файл,
+# по дороге считаются размер (с проверкой лимита) и sha256. В хранилище файл попадает уже по sha256
+# (см. tenders_bot.blobs), поэтому имя в хранилище до конца скачивания неизвестно
+import dataclasses
+import hashlib
+import logging
+import tempfile
+
+from django.core.files import File
+from telebot import apihelper
+
+from tenders_bot.tracing import CLIENT, span
+from tenders_bot.transport import DOWNLOAD_TIMEOUT, transport
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+# Результат скачивания
+@dataclasses.dataclass
+class Download:
+    file: File  # временный файл с содержимым, удаляется при закрытии
+    size: int  # размер в байтах
+    sha256: str
+
+
+# Обёртка над HTTP-ответом: отдаёт его кусками, по дороге проверяя размер и считая sha256
+class StreamedFile(File):
+    def __init__(self, response, name, max_size):
+        super().__init__(None, name)
+        self.response = response
+        self.max_size = max_size
+        self.bytes_read = 0
+        self.hasher = hashlib.sha256()
+
+    def chunks(self, chunk_size=None):
+        for chunk in self.response.iter_content(chunk_size or CHUNK_SIZE):
+            self.bytes_read += len(chunk)
+            if self.bytes_read > self.max_size:
+                raise FileTooLarge(f"{self.name} is larger than {self.max_size} bytes")
+            self.hasher.update(chunk)
+            yield chunk
+
+    def multiple_chunks(self, chunk_size=None):
+        return True
+
+    def close(self):
+        self.response.close()
+
+
+# Ссылка на скачивание файла из Telegram по file_path из getFile
+def telegram_file_url(token, file_path):
+    return (apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}").format(token, file_path)
+
+
+# Скачиваем файл по url во временный файл
+def download(url, max_size, session=None) -> Download:
+    session = session or transport.session  # общий пул соединений с запросами к Bot API
+    output = tempfile.TemporaryFile()
+    try:
+        # В адресе файла есть токен бота, поэтому в трассу его не пишем
+        with (
+            span("telegram.download_file", CLIENT) as current,
+            session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response,
+        ):
+            if response.status_code != 200:
+                raise apihelper.ApiHTTPException("Download file", response)
+            content = StreamedFile(response, url, max_size)
+            for chunk in content.chunks():
+                output.write(chunk)
+            if current is not None:
+                current.set_attribute("file.size", content.bytes_read)
+    except Exception:
+        output.close()
+        raise
+
+    output.seek(0)
+    return Download(file=File(output), size=content.bytes_read, sha256=content.hasher.hexdigest())
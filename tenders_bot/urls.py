@@ -4,10 +4,13 @@
 # Импорт стандартных компонентов Django для маршрутизации
 from django.http import HttpResponse         # Для простого текстового ответа на HTTP-запрос
 from django.conf import settings             # Импорт настроек проекта (settings.py)
-from django.conf.urls.static import static   # Функция для раздачи медиафайлов в режиме разработки
 from django.contrib import admin             # Панель администратора Django
 from django.urls import path                 # Функция для объявления маршрутов
 
+from tenders_bot.media import media_view          # Медиафайлы только для сотрудников
+from tenders_bot.metrics import metrics_view      # Метрики для Prometheus
+from tenders_bot.webhook import telegram_webhook  # Приём обновлений Telegram в режиме webhook
+
 # Функция представления view, показывает приветственное сообщение на главной странице
 
 def home(request):
@@ -17,7 +20,11 @@ def home(request):
 urlpatterns = [
     path("", home, name="home"),        # Маршрут главной страницы сайта (доступна по адресу /)
     path("admin/", admin.site.urls),    # Маршрут административной панели Django (по адресу /admin/)
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path("telegram/webhook/", telegram_webhook, name="telegram_webhook"),  # Обновления от Telegram
+    path("metrics", metrics_view, name="metrics"),  # Метрики бота, БД и SMTP в формате Prometheus
+    # Вложения обращений и файлы узлов (по адресу MEDIA_URL), только для вошедших в админку сотрудников
+    path(settings.MEDIA_URL.lstrip("/") + "<path:path>", media_view, name="media"),
+]
 
 # Кастомизация панели администратора
 admin.site.site_header = "Telegram Bot Administration"         # Заголовок админ-панели (в шапке)
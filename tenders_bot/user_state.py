@@ -0,0 +1,143 @@
+# Хранилище состояний пользователей бота (по chat_id)
+# Состояние компактное: id узла, к которому вернуться после ввода, и флаг ввода обращения.
+# LocalUserStateStore держит состояния в памяти процесса (TTL + LRU),
+# DatabaseUserStateStore - в базе, чтобы несколько процессов бота видели одно и то же состояние
+import abc
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional
+
+from django.utils import timezone
+
+from tenders_bot.db import database_sync_to_async
+from tenders_bot.models import ChatState
+from tenders_bot.settings import USER_STATE_BACKEND, USER_STATE_MAX_SIZE, USER_STATE_TTL
+
+
+# Класс состояний пользователя
+class UserState:
+    __slots__ = ("return_to_node_id", "entering_feedback")
+
+    def __init__(self, return_to_node_id: Optional[int] = None, entering_feedback: bool = False):
+        self.return_to_node_id = return_to_node_id
+        self.entering_feedback = entering_feedback
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, UserState)
+            and self.return_to_node_id == other.return_to_node_id
+            and self.entering_feedback == other.entering_feedback
+        )
+
+    def __repr__(self):
+        return f"UserState(return_to_node_id={self.return_to_node_id}, entering_feedback={self.entering_feedback})"
+
+
+# Интерфейс хранилища
+class UserStateStore(abc.ABC):
+    @abc.abstractmethod
+    def get(self, chat_id) -> Optional[UserState]:
+        pass
+
+    @abc.abstractmethod
+    def set(self, chat_id, state: UserState):
+        pass
+
+    @abc.abstractmethod
+    def delete(self, chat_id):
+        pass
+
+    # Удаление из корутин движка asyncio
+    async def adelete(self, chat_id):
+        await database_sync_to_async(self.delete)(chat_id)
+
+    @abc.abstractmethod
+    def __len__(self):
+        pass
+
+    # Поменять отдельные поля состояния (если состояния нет - создаётся новое)
+    def update(self, chat_id, **fields) -> UserState:
+        state = self.get(chat_id) or UserState()
+        for name, value in fields.items():
+            setattr(state, name, value)
+        self.set(chat_id, state)
+        return state
+
+
+# Состояния в памяти процесса: не больше max_size чатов, каждое живёт ttl секунд с последнего обращения
+class LocalUserStateStore(UserStateStore):
+    def __init__(self, max_size: int = USER_STATE_MAX_SIZE, ttl: float = USER_STATE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._states = OrderedDict()  # chat_id -> (срок жизни, состояние), в порядке последнего обращения
+        self._lock = threading.Lock()
+
+    def get(self, chat_id) -> Optional[UserState]:
+        with self._lock:
+            item = self._states.get(chat_id)
+            if item is None:
+                return None
+            expires_at, state = item
+            if expires_at < time.monotonic():
+                del self._states[chat_id]
+                return None
+            self._states.move_to_end(chat_id)
+            # Отдаём копию, чтобы изменения попадали в хранилище только через set
+            return UserState(state.return_to_node_id, state.entering_feedback)
+
+    def set(self, chat_id, state: UserState):
+        with self._lock:
+            self._states[chat_id] = (time.monotonic() + self.ttl, state)
+            self._states.move_to_end(chat_id)
+            while len(self._states) > self.max_size:
+                self._states.popitem(last=False)
+
+    def delete(self, chat_id):
+        with self._lock:
+            self._states.pop(chat_id, None)
+
+    async def adelete(self, chat_id):
+        self.delete(chat_id)  # только память процесса, ждать нечего
+
+    def __len__(self):
+        return len(self._states)
+
+
+# Состояния в базе (модель ChatState) для нескольких процессов бота
+class DatabaseUserStateStore(UserStateStore):
+    def __init__(self, ttl: float = USER_STATE_TTL):
+        self.ttl = ttl
+
+    # Состояния, которые ещё не истекли; истёкшие строки удаляет purge_retention (см. tenders_bot.retention)
+    def _live(self):
+        return ChatState.objects.filter(updated_at__gte=timezone.now() - timedelta(seconds=self.ttl))
+
+    def get(self, chat_id) -> Optional[UserState]:
+        row = self._live().filter(chat_id=chat_id).values_list("return_to_node_id", "entering_feedback").first()
+        return UserState(*row) if row else None
+
+    def set(self, chat_id, state: UserState):
+        ChatState.objects.update_or_create(
+            chat_id=chat_id,
+            defaults={"return_to_node_id": state.return_to_node_id, "entering_feedback": state.entering_feedback},
+        )
+
+    def delete(self, chat_id):
+        ChatState.objects.filter(chat_id=chat_id).delete()
+
+    def __len__(self):
+        return self._live().count()
+
+
+# Хранилище выбирается настройкой USER_STATE_BACKEND
+def build_user_state_store(backend: str = USER_STATE_BACKEND) -> UserStateStore:
+    if backend == "local":
+        return LocalUserStateStore()
+    if backend == "database":
+        return DatabaseUserStateStore()
+    raise ValueError(f"Unknown user state backend: {backend}")
+
+
+user_states = build_user_state_store()
@@ -0,0 +1,62 @@
+# Приём обновлений Telegram через webhook
+# В этом режиме бот работает внутри веб-процессов Django (gunicorn/uvicorn), и их можно запускать
+# сколько угодно за балансировщиком. Режим polling остаётся запасным (см. telegram_bot_main)
+import asyncio
+import hmac
+import logging
+
+import telebot
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotAllowed, HttpResponseNotFound
+from django.views.decorators.csrf import csrf_exempt
+
+from tenders_bot.settings import TELEGRAM_BOT_MODE, TELEGRAM_WEBHOOK_SECRET
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+# Проверяем секрет, который Telegram передаёт в заголовке (задаётся при setWebhook)
+def is_valid_secret(request) -> bool:
+    if not TELEGRAM_WEBHOOK_SECRET:
+        logger.error("TELEGRAM_WEBHOOK_SECRET is not set, rejecting webhook update")
+        return False
+    return hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), TELEGRAM_WEBHOOK_SECRET)
+
+
+# Передаём обновление тому же диспетчеру, что и при polling
+def dispatch_update(update: telebot.types.Update):
+    # Импортируем при первом обновлении, чтобы процессы без бота (только админка) не создавали его
+    from tenders_bot.telegram import dispatcher
+
+    return dispatcher.dispatch(update)
+
+
+@csrf_exempt
+async def telegram_webhook(request):
+    if TELEGRAM_BOT_MODE != "webhook":
+        return HttpResponseNotFound()
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    if not is_valid_secret(request):
+        return HttpResponseForbidden()
+
+    # Не JSON или JSON, который не является обновлением ({}, [], строка): повтор от Telegram не поможет
+    try:
+        update = telebot.types.Update.de_json(request.body.decode("utf-8"))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        update = None
+    if update is None:
+        logger.warning("Received malformed webhook update")
+        return HttpResponse(status=400)
+
+    # Обработчики работают с ORM синхронно в потоках диспетчера; отвечаем Telegram после обработки,
+    # так число одновременных запросов (max_connections) ограничивает и нагрузку на процесс
+    # Постановка в очередь может ждать свободного места, поэтому тоже вне event loop
+    future = await sync_to_async(dispatch_update, thread_sensitive=False)(update)
+    try:
+        await asyncio.wrap_future(future)
+    except Exception:
+        pass  # ошибка уже записана в лог диспетчером, повтор от Telegram её не исправит
+    return HttpResponse()